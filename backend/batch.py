@@ -0,0 +1,130 @@
+"""
+Resource-safe batch rendering.
+
+A long running process (main.py with many URLs, or a queue worker) renders campaign after campaign.
+`render_guard()` wraps one campaign and, when it finishes or fails, makes sure nothing it started outlives it:
+video readers of every timeline are closed, ffmpeg processes that are still running are stopped, temporary
+render folders and half written cache files of this process are removed and unreachable clips are collected.
+`resource_usage()` reports the numbers a batch should keep flat (see backend/soak.py).
+"""
+import gc
+import logging
+import os
+import shutil
+import signal
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Set
+
+from backend.cache import get_cache_dir, temp_prefix
+from backend.combination.readers import close_all_readers
+from backend.combination.streaming import current_rss_bytes
+
+def _child_ffmpeg_pids() -> Set[int]:
+    """
+    Returns the ids of the ffmpeg processes started by this process. Empty on systems without procfs.
+    """
+    pids = set()
+    parent = str(os.getpid())
+    for entry in Path('/proc').glob('[0-9]*'):
+        try:
+            stat = (entry / 'stat').read_text()
+            # The command name is in parentheses and may contain spaces; the parent id is the second field after it
+            command, fields = stat[stat.index('(') + 1:stat.rindex(')')], stat[stat.rindex(')') + 2:].split()
+        except (OSError, ValueError):
+            continue
+        if fields[1] == parent and fields[0] != 'Z' and command.startswith('ffmpeg'):
+            pids.add(int(entry.name))
+    return pids
+
+
+def _temp_paths() -> Set[Path]:
+    # Temporary render folders of this process only (see cache.temp_prefix); other processes may be rendering too
+    return set(Path(tempfile.gettempdir()).glob(f"{temp_prefix('*')}*"))
+
+
+def _open_fd_count() -> int:
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return -1
+
+
+def resource_usage() -> Dict[str, int]:
+    """
+    Returns the resident memory (bytes), open file descriptors, running ffmpeg child processes
+    and temporary render folders of this process.
+    """
+    return {
+        'rss_bytes': current_rss_bytes(),
+        'open_fds': _open_fd_count(),
+        'ffmpeg_processes': len(_child_ffmpeg_pids()),
+        'temp_paths': len(_temp_paths()),
+    }
+
+
+def release_resources(known_pids: Set[int] = frozenset(), known_temp_paths: Set[Path] = frozenset()) -> Dict[str, int]:
+    """
+    Releases everything a render may have left behind, except the processes and temporary paths that
+    already existed before it (known_pids, known_temp_paths).
+
+    Returns:
+    - Dict[str, int]: Number of readers, processes and temporary paths that had to be released.
+    """
+    released = {'readers': close_all_readers(), 'processes': 0, 'temp_paths': 0}
+
+    leftover_pids = _child_ffmpeg_pids() - set(known_pids)
+    for pid in leftover_pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            continue
+    deadline = time.monotonic() + 2
+    for pid in leftover_pids:
+        while time.monotonic() < deadline:
+            try:
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    break
+            except ChildProcessError:
+                break
+            time.sleep(0.05)
+        else:
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (OSError, ChildProcessError):
+                pass
+        released['processes'] += 1
+
+    for path in _temp_paths() - set(known_temp_paths):
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+        released['temp_paths'] += 1
+    # Half written cache entries of this process (proxies, sprites) are named '<key>.<pid>.tmp'
+    for path in get_cache_dir('').glob(f"*/*.{os.getpid()}.tmp"):
+        path.unlink(missing_ok=True)
+        released['temp_paths'] += 1
+
+    # Clips reference each other through frame functions, so they are only freed by the cycle collector
+    gc.collect()
+    return released
+
+
+@contextmanager
+def render_guard(name: str = ''):
+    """
+    Releases all readers, ffmpeg processes and temporary files started inside the with block when it exits,
+    also when it raises. Exceptions are not swallowed.
+    """
+    known_pids = _child_ffmpeg_pids()
+    known_temp_paths = _temp_paths()
+    try:
+        yield
+    finally:
+        released = release_resources(known_pids, known_temp_paths)
+        if any(released.values()):
+            logging.warning(f"Released resources left behind by '{name}': {released}")
@@ -0,0 +1,257 @@
+"""
+Offline render benchmark.
+
+Generates synthetic campaign folders (color bar videos at several resolutions, photos, a GIF, an .srt file
+and tone audio) with ffmpeg and Pillow, renders every campaign with combine_assets and reports frames per
+second, peak memory and the time per stage as JSON. Nothing is downloaded, so results only depend on the
+code and the machine.
+
+Every scenario runs in a fresh process with its own empty cache folder, so results are not influenced by
+earlier scenarios (pass --warm to reuse the caches of a first render instead).
+
+Usage (from the repository root; subtitles use the fonts in assets/stlib/fonts, or Pillow's default font without them):
+    python -m backend.benchmark [--scenarios photos,video_1080p] [--duration 6] [--workers 1] [--output bench.json]
+"""
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+from moviepy.config import FFMPEG_BINARY
+from PIL import Image
+
+# Asset mix of every scenario: (asset kind, arguments). Durations are in seconds.
+SCENARIOS = {
+    'photos': [('photo', {}), ('photo', {}), ('overlay_photo', {})],
+    'video_360p': [('video', {'size': (640, 360)})],
+    'video_1080p': [('video', {'size': (1920, 1080)})],
+    'video_2160p': [('video', {'size': (3840, 2160)})],
+    'video_resolutions': [('video', {'size': (640, 360)}), ('video', {'size': (1920, 1080)}), ('video', {'size': (3840, 2160)})],
+    'gif_overlay': [('photo', {}), ('gif', {})],
+    'subtitles': [('photo', {}), ('subtitle', {}), ('voiceover', {})],
+    'audio_mix': [('video', {'size': (1920, 1080)}), ('voiceover', {}), ('background_audio', {})],
+    'full_mix': [('video', {'size': (1920, 1080)}), ('photo', {}), ('overlay_video', {'size': (1280, 720)}), ('gif', {}),
+                 ('subtitle', {}), ('voiceover', {}), ('background_audio', {})],
+}
+
+
+def _ffmpeg(*args: str) -> None:
+    subprocess.run([FFMPEG_BINARY, '-y', '-loglevel', 'error', *args], check=True, capture_output=True)
+
+
+def make_color_bars(path: Path, size, duration: float, fps: int = 30) -> None:
+    """
+    Writes an H.264 color bar video with a tone as audio track.
+    """
+    width, height = size
+    _ffmpeg('-f', 'lavfi', '-i', f"smptehdbars=size={width}x{height}:rate={fps}:duration={duration}",
+            '-f', 'lavfi', '-i', f"sine=frequency=1000:duration={duration}",
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-shortest', str(path))
+
+
+def make_photo(path: Path, size=(1920, 1080), seed: int = 0) -> None:
+    """
+    Writes a JPEG with a color gradient and some noise, so it does not compress to nothing.
+    """
+    width, height = size
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                      np.full((height, width), 128, dtype=np.float32)], axis=2)
+    image += rng.normal(0, 12, image.shape)
+    Image.fromarray(np.clip(image, 0, 255).astype(np.uint8)).save(path, quality=90)
+
+
+def make_gif(path: Path, size=(320, 240), frames: int = 20) -> None:
+    """
+    Writes a looping GIF of a circle moving over a transparent background.
+    """
+    width, height = size
+    images = []
+    yy, xx = np.mgrid[0:height, 0:width]
+    for index in range(frames):
+        cx = width * (0.2 + 0.6 * index / frames)
+        inside = (xx - cx) ** 2 + (yy - height / 2) ** 2 < (height / 4) ** 2
+        rgba = np.zeros((height, width, 4), dtype=np.uint8)
+        rgba[inside] = (255, 210, 0, 255)
+        images.append(Image.fromarray(rgba, 'RGBA'))
+    images[0].save(path, save_all=True, append_images=images[1:], duration=100, loop=0, disposal=2)
+
+
+def make_tone(path: Path, duration: float, frequency: int) -> None:
+    """
+    Writes a sine tone as AAC audio.
+    """
+    _ffmpeg('-f', 'lavfi', '-i', f"sine=frequency={frequency}:duration={duration}", '-c:a', 'aac', str(path))
+
+
+def make_srt(path: Path, duration: float, cue_seconds: float = 1.5) -> None:
+    """
+    Writes an .srt file with a new cue every cue_seconds.
+    """
+    def timestamp(seconds):
+        milliseconds = int(round(seconds * 1000))
+        return f"{milliseconds // 3600000:02d}:{milliseconds // 60000 % 60:02d}:{milliseconds // 1000 % 60:02d},{milliseconds % 1000:03d}"
+
+    cues = []
+    for index in range(int(duration // cue_seconds)):
+        start, end = index * cue_seconds, (index + 1) * cue_seconds
+        cues.append(f"{index + 1}\n{timestamp(start)} --> {timestamp(end)}\nBenchmark subtitle number {index + 1}\n")
+    path.write_text('\n'.join(cues), encoding='utf-8')
+
+
+def make_campaign(folder: Path, assets: List, duration: float) -> None:
+    """
+    Generates the asset files and config.json of a synthetic campaign.
+    """
+    folder.mkdir(parents=True, exist_ok=True)
+    backgrounds = [kind for kind, _ in assets if kind in ('video', 'photo')]
+    # The background assets together fill the wanted duration
+    part = duration / max(1, len(backgrounds))
+    configs = []
+    for index, (kind, args) in enumerate(assets):
+        if kind == 'video':
+            filename = f"bars_{index}.mp4"
+            make_color_bars(folder / filename, args['size'], part)
+            configs.append({'asset_type': 'background_video', 'filename': filename})
+        elif kind == 'overlay_video':
+            filename = f"overlay_{index}.mp4"
+            make_color_bars(folder / filename, args['size'], duration / 2)
+            configs.append({'asset_type': 'overlay_video', 'filename': filename, 'duration': duration / 2})
+        elif kind == 'photo':
+            filename = f"photo_{index}.jpg"
+            make_photo(folder / filename, seed=index)
+            configs.append({'asset_type': 'background_photo', 'filename': filename, 'duration': part})
+        elif kind == 'overlay_photo':
+            filename = f"overlay_{index}.jpg"
+            make_photo(folder / filename, size=(800, 600), seed=index)
+            configs.append({'asset_type': 'overlay_photo', 'filename': filename, 'duration': duration / 2})
+        elif kind == 'gif':
+            filename = f"animation_{index}.gif"
+            make_gif(folder / filename)
+            configs.append({'asset_type': 'gif_animation', 'filename': filename, 'position': [0.1, 0.1], 'duration': duration})
+        elif kind == 'subtitle':
+            filename = f"subtitles_{index}.srt"
+            make_srt(folder / filename, duration)
+            configs.append({'asset_type': 'subtitle', 'filename': filename})
+        elif kind in ('voiceover', 'background_audio'):
+            filename = f"{kind}_{index}.m4a"
+            make_tone(folder / filename, duration, 440 if kind == 'voiceover' else 220)
+            configs.append({'asset_type': kind, 'filename': filename})
+
+    with open(folder / 'config.json', 'w') as f:
+        json.dump({'general': {'max_duration_seconds': duration}, 'assets': configs}, f, indent=4)
+
+
+def run_scenario(name: str, duration: float, workers: int, warm: bool, engine: str) -> Dict[str, Any]:
+    """
+    Generates and renders one scenario. Runs in its own process (see main), so peak RSS is per scenario.
+    """
+    with tempfile.TemporaryDirectory(prefix=f"adflowgen_bench_{name}_") as temp_dir:
+        # Set before the render code is imported, the caches pick their folder at import time
+        os.environ['ADFLOWGEN_CACHE_DIR'] = os.path.join(temp_dir, 'cache')
+        from backend import tracing
+        from backend.combination.main import build_timeline, combine_assets
+        from backend.combination.readers import close_timeline
+
+        folder = Path(temp_dir) / f"Campaign_Bench_{name}"
+        stages = {}
+        started = time.perf_counter()
+        make_campaign(folder, SCENARIOS[name], duration)
+        stages['generate_assets'] = time.perf_counter() - started
+
+        # Includes transcoding the video proxies, which the render then reuses
+        started = time.perf_counter()
+        clip, _, _ = build_timeline(folder.resolve())
+        stages['build_timeline'] = time.perf_counter() - started
+        fps = clip.fps or 24
+        frames = max(1, math.ceil(clip.duration * fps - 1e-6))
+
+        if warm:
+            combine_assets(str(folder), workers=workers)
+
+        # Breaks the render down into stages (decoding per layer, composing, encoding, audio, ...)
+        tracing.enable()
+        started = time.perf_counter()
+        if engine == 'encoder_reference':
+            # Encoder reference: the same composed timeline written by MoviePy's write_videofile (video only). This is not
+            # the original CompositeVideoClip pipeline, it only isolates the cost of the streaming/segmented writer
+            clip.write_videofile(str(folder / 'output_video.mp4'), codec='libx264', audio=False, logger=None)
+        else:
+            combine_assets(str(folder), workers=workers, incremental=warm)
+        stages['render'] = time.perf_counter() - started
+        close_timeline(clip)
+        render_stages = {f"{category}/{name}": round(seconds, 3) for (category, name), (seconds, _, _) in tracing.stage_totals().items()}
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1 if platform.system() == 'Darwin' else 1024
+    return {
+        'scenario': name,
+        'engine': engine,
+        'duration_seconds': duration,
+        'frames': frames,
+        'fps': frames / stages['render'],
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 1024 / 1024,
+        'peak_child_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 1024 / 1024,
+        'stages': {stage: round(seconds, 3) for stage, seconds in stages.items()},
+        'render_stages': render_stages,
+    }
+
+
+def main(scenarios: List[str], duration: float = 6, workers: int = 1, warm: bool = False, engine: str = 'combine_assets') -> Dict[str, Any]:
+    """
+    Runs the scenarios one by one, each in a fresh process.
+
+    Returns:
+    - Dict[str, Any]: Machine description and one result per scenario. Failed scenarios have an 'error' instead.
+    """
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for name in scenarios:
+        logging.info(f"Running benchmark scenario '{name}'")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            try:
+                results.append(executor.submit(run_scenario, name, duration, workers, warm, engine).result())
+            except Exception as e:
+                logging.warning(f"Benchmark scenario '{name}' failed: {e}")
+                results.append({'scenario': name, 'engine': engine, 'error': str(e)})
+    return {
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'cpu_count': os.cpu_count()},
+        'settings': {'duration_seconds': duration, 'workers': workers, 'warm': warm, 'engine': engine},
+        'results': results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render synthetic campaigns and report render performance as JSON.")
+    parser.add_argument('--scenarios', type=str, default=','.join(SCENARIOS), help=f"Comma separated scenarios: {', '.join(SCENARIOS)}")
+    parser.add_argument('--duration', type=float, default=6, help="Duration of every synthetic campaign in seconds")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes passed to combine_assets")
+    parser.add_argument('--warm', action='store_true', help="Render once before measuring, so the caches are filled")
+    parser.add_argument('--engine', type=str, default='combine_assets', choices=['combine_assets', 'encoder_reference'],
+                        help="Render with combine_assets, or write the same timeline with MoviePy's write_videofile (encoder reference)")
+    parser.add_argument('--output', type=str, default=None, help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    unknown = [name for name in args.scenarios.split(',') if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+    report = main(args.scenarios.split(','), args.duration, args.workers, args.warm, args.engine)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
@@ -0,0 +1,110 @@
+"""
+Helpers for the shared on-disk caches (content hashing, cache folders and size based LRU eviction).
+
+All caches live below ADFLOWGEN_CACHE_DIR (defaults to ~/.cache/adflowgen), so several campaigns
+and several processes on the same host share them.
+"""
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+# Bounded, so a long running batch process does not keep a digest for every file it ever saw
+DIGEST_MEMO_MAX_ITEMS = 4096
+_digest_memo = OrderedDict()
+
+
+def get_cache_dir(name: str) -> Path:
+    """
+    Returns (and creates) the cache sub folder with the given name.
+    """
+    root = Path(os.getenv('ADFLOWGEN_CACHE_DIR', Path.home() / '.cache' / 'adflowgen'))
+    cache_dir = root / name
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+def temp_prefix(name: str) -> str:
+    """
+    Returns the prefix for temporary folders of this process, e.g. 'adflowgen_segments_1234_'.
+    The process id lets a batch runner tell its own leftovers from those of other renders on the host.
+    """
+    return f"adflowgen_{name}_{os.getpid()}_"
+
+
+def file_digest(path, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Returns the sha256 hex digest of the file contents.
+
+    Digests of the most recently used files are remembered per (path, size, mtime), so hashing
+    the same large source twice in one render is free.
+    """
+    path = Path(path)
+    stat = path.stat()
+    memo_key = (str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+    if memo_key in _digest_memo:
+        _digest_memo.move_to_end(memo_key)
+        return _digest_memo[memo_key]
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    _remember(memo_key, digest)
+    return digest
+
+
+def _remember(memo_key: tuple, digest: str) -> None:
+    _digest_memo[memo_key] = digest
+    _digest_memo.move_to_end(memo_key)
+    while len(_digest_memo) > DIGEST_MEMO_MAX_ITEMS:
+        _digest_memo.popitem(last=False)
+
+
+def remember_digest(path, digest: str) -> None:
+    """
+    Stores a digest computed earlier (e.g. kept in the asset metadata index), so file_digest does not hash the file again.
+    """
+    path = Path(path)
+    stat = path.stat()
+    _remember((str(path.resolve()), stat.st_size, stat.st_mtime_ns), digest)
+
+
+def touch(path) -> None:
+    """
+    Marks a cache entry as recently used.
+    """
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def evict_lru(cache_dir: Path, max_bytes: int) -> None:
+    """
+    Deletes the least recently used files in cache_dir until its total size is at most max_bytes.
+    """
+    entries = []
+    for entry in Path(cache_dir).rglob('*'):
+        try:
+            if not entry.is_file() or entry.name.endswith('.tmp'):
+                continue
+            stat = entry.stat()
+        except OSError:
+            # Evicted by another thread or process while listing
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries, key=lambda item: item[0]):
+        if total_size <= max_bytes:
+            break
+        try:
+            entry.unlink()
+            total_size -= size
+            logging.info(f"Evicted '{entry.name}' from cache '{cache_dir}'")
+        except OSError:
+            # Another process may have evicted it already
+            pass
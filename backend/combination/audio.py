@@ -0,0 +1,156 @@
+"""
+NumPy audio mixing.
+
+Every audio source is decoded once by ffmpeg into a float32 PCM buffer. Voiceovers and background music are
+concatenated, the background music is ducked under the voiceover, and the mix is trimmed to the video duration
+with vectorized operations. The result is encoded once into a single AAC stream for the final mux.
+"""
+import logging
+import math
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from moviepy.config import FFMPEG_BINARY
+
+from backend import tracing
+
+AUDIO_FPS = 44100
+AUDIO_CHANNELS = 2
+# Gain of the background music while the voiceover is speaking; 1.0 disables ducking
+DEFAULT_DUCK_LEVEL = 0.35
+
+
+def decode_audio(path, fps: int = AUDIO_FPS, channels: int = AUDIO_CHANNELS) -> Optional[np.ndarray]:
+    """
+    Decodes the first audio stream of a file into a (samples, channels) float32 array.
+    Returns None if the file has no audio stream or can not be decoded.
+    """
+    cmd = [
+        FFMPEG_BINARY, '-loglevel', 'error', '-i', str(path), '-vn', '-map', '0:a:0',
+        '-f', 'f32le', '-acodec', 'pcm_f32le', '-ac', str(channels), '-ar', str(fps), '-',
+    ]
+    with tracing.span('decode audio', 'audio', file=Path(path).name):
+        result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        logging.warning(f"Could not decode audio of '{Path(path).name}': {result.stderr.decode('utf-8', errors='replace').strip()}")
+        return None
+    samples = np.frombuffer(result.stdout, dtype=np.float32)
+    return samples.reshape(-1, channels)
+
+
+def concatenate_audio(paths: List, fps: int = AUDIO_FPS) -> Optional[np.ndarray]:
+    """
+    Decodes the files and joins them back to back.
+    """
+    parts = [samples for samples in (decode_audio(path, fps) for path in paths) if samples is not None]
+    if not parts:
+        return None
+    return np.concatenate(parts)
+
+
+def ducking_gain(voice: np.ndarray, length: int, duck_level: float, fps: int = AUDIO_FPS,
+                 window_seconds: float = 0.05, smooth_seconds: float = 0.3, threshold: float = 0.02) -> np.ndarray:
+    """
+    Returns a per-sample gain (length,) that is duck_level wherever the voice is speaking and 1 elsewhere,
+    with smoothed transitions so the music fades down and back up instead of jumping.
+    """
+    window = max(1, int(fps * window_seconds))
+    n_windows = -(-length // window)
+    level = np.zeros(n_windows * window, dtype=np.float32)
+    mono = np.abs(voice[:length]).mean(axis=1)
+    level[:len(mono)] = mono ** 2
+    rms = np.sqrt(level.reshape(n_windows, window).mean(axis=1))
+
+    gain = np.where(rms > threshold, duck_level, 1.0).astype(np.float32)
+    smooth = max(1, int(smooth_seconds / window_seconds))
+    gain = np.convolve(gain, np.ones(smooth, dtype=np.float32) / smooth)[smooth // 2:smooth // 2 + n_windows]
+    return np.repeat(gain, window)[:length]
+
+
+def mix_audio(duration: float, voiceover_files: List = (), background_files: List = (),
+              layer_sources: List[Tuple[str, float, float]] = (), duck_level: float = DEFAULT_DUCK_LEVEL,
+              fps: int = AUDIO_FPS, video_fps: float = None) -> Optional[np.ndarray]:
+    """
+    Mixes the audio of the timeline into one (samples, channels) float32 buffer of exactly `duration` seconds,
+    or, with video_fps, exactly as long as the video frames of that duration (the last frame is shown for a full frame).
+
+    Parameters:
+    - duration (float): Duration of the video.
+    - voiceover_files (List): Voiceover files, played back to back from the start.
+    - background_files (List): Background music files, played back to back from the start and ducked under the voiceover.
+    - layer_sources (List[Tuple[str, float, float]]): (file, start, end) of video layers. Their audio is only used
+      when there is no voiceover and no background music, like the audio of the clips themselves used to be.
+    - duck_level (float): Gain of the background music while the voiceover speaks.
+    - video_fps (float): Frame rate of the video. The video holds ceil(duration * video_fps) frames.
+
+    Returns:
+    - The mixed samples, or None if the timeline has no audio.
+    """
+    if video_fps:
+        # Same frame count as plan_segments, so the audio and the video end on the same timestamp
+        duration = max(1, math.ceil(duration * video_fps - 1e-6)) / video_fps
+    length = int(round(duration * fps))
+    voice = concatenate_audio(voiceover_files, fps)
+    background = concatenate_audio(background_files, fps)
+
+    mix = np.zeros((length, AUDIO_CHANNELS), dtype=np.float32)
+    has_audio = False
+    if voice is not None:
+        used = min(length, len(voice))
+        mix[:used] += voice[:used]
+        has_audio = True
+    if background is not None:
+        used = min(length, len(background))
+        if voice is not None and duck_level < 1:
+            mix[:used] += background[:used] * ducking_gain(voice, used, duck_level, fps)[:, None]
+        else:
+            mix[:used] += background[:used]
+        has_audio = True
+
+    if voice is None and background is None:
+        for path, start, end in layer_sources:
+            samples = decode_audio(path, fps)
+            if samples is None:
+                continue
+            first = int(round(start * fps))
+            last = min(length, first + len(samples), int(round(end * fps)))
+            if last > first:
+                mix[first:last] += samples[:last - first]
+                has_audio = True
+
+    if not has_audio:
+        return None
+    np.clip(mix, -1, 1, out=mix)
+    return mix
+
+
+def write_audio(samples: np.ndarray, output_path: str, fps: int = AUDIO_FPS) -> str:
+    """
+    Encodes a (samples, channels) float32 buffer into an AAC file.
+    """
+    cmd = [
+        FFMPEG_BINARY, '-y', '-loglevel', 'error',
+        '-f', 'f32le', '-ar', str(fps), '-ac', str(samples.shape[1]), '-i', '-',
+        '-c:a', 'aac', '-b:a', '192k', str(output_path),
+    ]
+    with tracing.span('encode audio', 'audio', seconds=len(samples) / fps):
+        subprocess.run(cmd, input=np.ascontiguousarray(samples, dtype=np.float32).tobytes(), check=True, capture_output=True)
+    return str(output_path)
+
+
+def render_audio(audio_sources: Dict[str, list], duration: float, output_path: str, duck_level: float = DEFAULT_DUCK_LEVEL,
+                 video_fps: float = None) -> Optional[str]:
+    """
+    Mixes the audio sources collected by build_timeline and writes them to output_path, sized to the video frames with video_fps.
+
+    Returns:
+    - str: output_path, or None if the timeline has no audio.
+    """
+    with tracing.span('mix audio', 'audio'):
+        samples = mix_audio(duration, audio_sources.get('voiceover', []), audio_sources.get('background', []),
+                            audio_sources.get('layers', []), duck_level, video_fps=video_fps)
+    if samples is None:
+        return None
+    return write_audio(samples, output_path)
@@ -0,0 +1,223 @@
+"""
+Single-pass NumPy compositor.
+
+All visual layers (backgrounds, overlays, GIFs and subtitle cues) are blended in stacking order into one
+preallocated frame buffer, instead of nesting CompositeVideoClips. Alpha blending is done with vectorized
+NumPy operations in a preallocated scratch buffer, opaque layers are copied directly, and for layers with a
+static mask only the bounding box of the non-transparent pixels is touched.
+
+Before rendering, the timeline is split into intervals at every layer start and end. For every interval the
+compositor works out which layers are completely hidden behind an opaque layer above them; those layers are
+not asked for frames at all, so e.g. a background video under a full-screen overlay is not decoded.
+"""
+import bisect
+import math
+import time
+from pathlib import Path
+from typing import Any, List, Tuple
+
+import numpy as np
+from moviepy import ImageClip, VideoClip
+
+from backend import tracing
+
+_SHORT_POSITIONS = {
+    'center': ('center', 'center'),
+    'left': ('left', 'center'),
+    'right': ('right', 'center'),
+    'top': ('center', 'top'),
+    'bottom': ('center', 'bottom'),
+}
+
+
+class Compositor:
+    """
+    Blends a list of layer clips into frames of a fixed canvas.
+
+    Parameters:
+    - layers (List): Layer clips in stacking order (first is at the bottom), with start, end and position set.
+    - size (Tuple[int, int]): Canvas (width, height).
+    """
+
+    def __init__(self, layers: List[Any], size: Tuple[int, int]):
+        self.layers = list(layers)
+        self.width, self.height = size
+        self._frame = np.zeros((self.height, self.width, 3), dtype=np.uint8)
+        self._scratch = np.empty((self.height, self.width, 3), dtype=np.float32)
+        self._starts = [layer.start or 0 for layer in self.layers]
+        self._ends = [layer.end if layer.end is not None else math.inf for layer in self.layers]
+        # Static masks (photos, subtitle sprites) are converted once: (alpha HxWx1 float32, bounding box, fully opaque)
+        self._static_alpha = {}
+        self.plan = self.plan_visibility()
+        self._plan_starts = [start for start, _, _ in self.plan]
+        # Names of the layers in traces, e.g. 'layer 0 (bg.mp4)'
+        self._labels = [f"layer {index} ({Path(layer.filename).name if getattr(layer, 'filename', None) else type(layer).__name__})"
+                        for index, layer in enumerate(self.layers)]
+
+    def is_opaque(self, layer: Any) -> bool:
+        """
+        Returns True if every pixel of the layer is fully opaque (no mask, or a static mask without transparency).
+        """
+        mask = layer.mask
+        if mask is None:
+            return True
+        return isinstance(mask, ImageClip) and bool(np.all(mask.img >= 1))
+
+    def layer_rect(self, index: int, t: float) -> Tuple[int, int, int, int]:
+        """
+        Returns the part (x0, y0, x1, y1) of the canvas the layer covers at time t.
+        """
+        layer = self.layers[index]
+        width, height = layer.size
+        x, y = self.position(layer, t - self._starts[index], width, height)
+        return max(0, x), max(0, y), min(self.width, x + width), min(self.height, y + height)
+
+    def plan_visibility(self) -> List[Tuple[float, float, List[int]]]:
+        """
+        Splits the timeline at every layer start and end and returns (start, end, drawn layer indexes) per interval.
+        A layer is left out of an interval if it is off canvas or fully covered by a single opaque layer above it.
+        Layers are assumed to keep their position during an interval, which holds for all positions set by combine_assets.
+        """
+        opaque = [self.is_opaque(layer) for layer in self.layers]
+        breakpoints = sorted({0} | set(self._starts) | {end for end in self._ends if end != math.inf})
+        plan = []
+        for start, end in zip(breakpoints, breakpoints[1:] + [math.inf]):
+            visible = [index for index, (layer_start, layer_end) in enumerate(zip(self._starts, self._ends))
+                       if layer_start <= start and layer_end >= end]
+            rects = {index: self.layer_rect(index, start) for index in visible}
+            drawn = []
+            for position, index in enumerate(visible):
+                x0, y0, x1, y1 = rects[index]
+                if x1 <= x0 or y1 <= y0:
+                    continue
+                covered = any(opaque[above] and rects[above][0] <= x0 and rects[above][1] <= y0
+                              and rects[above][2] >= x1 and rects[above][3] >= y1
+                              for above in visible[position + 1:])
+                if not covered:
+                    drawn.append(index)
+            plan.append((start, end, drawn))
+        return plan
+
+    def visible_layers(self, t: float) -> List[int]:
+        """
+        Returns the indexes of the layers that have to be drawn at time t, bottom first.
+        """
+        interval = bisect.bisect_right(self._plan_starts, t) - 1
+        if interval < 0:
+            return []
+        return self.plan[interval][2]
+
+    def position(self, layer: Any, ct: float, width: int, height: int) -> Tuple[int, int]:
+        """
+        Returns the top-left canvas position of a layer frame, with the same semantics as MoviePy's compose_on.
+        """
+        pos = layer.pos(ct)
+        pos = list(_SHORT_POSITIONS[pos]) if isinstance(pos, str) else list(pos)
+        if layer.relative_pos:
+            for i, dim in enumerate((self.width, self.height)):
+                if not isinstance(pos[i], str):
+                    pos[i] = dim * pos[i]
+        if isinstance(pos[0], str):
+            pos[0] = {'left': 0, 'center': (self.width - width) / 2, 'right': self.width - width}[pos[0]]
+        if isinstance(pos[1], str):
+            pos[1] = {'top': 0, 'center': (self.height - height) / 2, 'bottom': self.height - height}[pos[1]]
+        return int(pos[0]), int(pos[1])
+
+    def alpha(self, index: int, layer: Any, ct: float):
+        """
+        Returns (alpha, bounding box, opaque) for the layer's mask at ct, or None if the layer has no mask.
+        The bounding box (x0, y0, x1, y1) covers all pixels that are not fully transparent.
+        """
+        mask = layer.mask
+        if mask is None:
+            return None
+        if index in self._static_alpha:
+            return self._static_alpha[index]
+
+        alpha = np.asarray(mask.get_frame(ct), dtype=np.float32)
+        visible = alpha > 0
+        rows, columns = np.any(visible, axis=1), np.any(visible, axis=0)
+        if rows.any():
+            y0, y1 = np.argmax(rows), len(rows) - np.argmax(rows[::-1])
+            x0, x1 = np.argmax(columns), len(columns) - np.argmax(columns[::-1])
+            bbox = (int(x0), int(y0), int(x1), int(y1))
+        else:
+            bbox = (0, 0, 0, 0)
+        result = (alpha[:, :, None], bbox, bool(np.all(alpha >= 1)))
+        if isinstance(mask, ImageClip):
+            self._static_alpha[index] = result
+        return result
+
+    def frame_at(self, t: float) -> np.ndarray:
+        """
+        Composes the frame at time t. The returned array is reused for the next frame, copy it to keep it.
+        """
+        frame = self._frame
+        visible = self.visible_layers(t)
+        cleared = False
+        timed = tracing.is_enabled()
+        frame_started = time.perf_counter() if timed else 0
+        for index in visible:
+            layer = self.layers[index]
+            ct = t - self._starts[index]
+            if timed:
+                started = time.perf_counter()
+                img = layer.get_frame(ct)
+                tracing.add(self._labels[index], time.perf_counter() - started)
+            else:
+                img = layer.get_frame(ct)
+            height, width = img.shape[:2]
+            x, y = self.position(layer, ct, width, height)
+            alpha = self.alpha(index, layer, ct)
+
+            # Visible part of the layer in its own coordinates
+            lx0, ly0 = max(0, -x), max(0, -y)
+            lx1, ly1 = min(width, self.width - x), min(height, self.height - y)
+            if alpha is not None:
+                bx0, by0, bx1, by1 = alpha[1]
+                lx0, ly0, lx1, ly1 = max(lx0, bx0), max(ly0, by0), min(lx1, bx1), min(ly1, by1)
+            if lx1 <= lx0 or ly1 <= ly0:
+                continue
+
+            if not cleared:
+                # The canvas only needs clearing if the bottom layer does not cover it completely
+                covers = (alpha is None or alpha[2]) and (lx1 - lx0, ly1 - ly0) == (self.width, self.height)
+                if not covers:
+                    frame.fill(0)
+                cleared = True
+
+            src = img[ly0:ly1, lx0:lx1, :3]
+            dst = frame[y + ly0:y + ly1, x + lx0:x + lx1]
+            if alpha is None or alpha[2]:
+                dst[...] = src
+                continue
+            scratch = self._scratch[:ly1 - ly0, :lx1 - lx0]
+            np.subtract(src, dst, out=scratch, dtype=np.float32)
+            np.multiply(scratch, alpha[0][ly0:ly1, lx0:lx1], out=scratch)
+            np.add(scratch, dst, out=scratch)
+            scratch += 0.5
+            np.copyto(dst, scratch, casting='unsafe')
+
+        if not cleared:
+            frame.fill(0)
+        if timed:
+            tracing.add('compose frame', time.perf_counter() - frame_started)
+        return frame
+
+
+def make_composite_clip(layers: List[Any], size: Tuple[int, int], fps: float) -> VideoClip:
+    """
+    Returns a clip whose frames are composed by a Compositor. Like CompositeVideoClip, its duration is the end
+    of the last layer and `clips` lists the layers. Audio is mixed separately (see audio.py).
+    """
+    compositor = Compositor(layers, size)
+    # Passing make_frame to VideoClip would compose frame 0 just to learn the size (starting video readers)
+    clip = VideoClip()
+    clip.make_frame = compositor.frame_at
+    clip.size = tuple(size)
+    clip.clips = compositor.layers
+    clip.compositor = compositor
+    clip.fps = fps
+    clip.duration = max((layer.end for layer in layers if layer.end is not None), default=None)
+    clip.end = clip.duration
+    return clip
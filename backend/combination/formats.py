@@ -0,0 +1,86 @@
+"""
+Output formats for social placements.
+
+The timeline is composed once on the master canvas; every output format is derived from the composed
+master frame with its own rule:
+- 'fit': scale the whole master frame into the format and pad with black (nothing is cut off).
+- 'crop': fill the format and cut off the sides (or top and bottom) of the master frame, centered.
+"""
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+OUTPUT_FORMATS = {
+    '16:9': {'name': '16:9', 'size': (1920, 1080), 'rule': 'fit'},
+    '9:16': {'name': '9:16', 'size': (1080, 1920), 'rule': 'fit'},
+    # Not cropped by default: subtitles are laid out on the master canvas and are wider than 1080 px
+    '1:1': {'name': '1:1', 'size': (1080, 1080), 'rule': 'fit'},
+}
+
+
+def resolve_formats(formats: List[Union[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Turns a list of format names (e.g. "9:16") and/or format dicts ({"name", "size", "rule"}) into format dicts.
+    Dicts may override the size or rule of a known format, e.g. {"name": "9:16", "rule": "crop"}.
+    """
+    resolved = []
+    for fmt in formats:
+        if isinstance(fmt, str):
+            fmt = {'name': fmt}
+        base = OUTPUT_FORMATS.get(fmt.get('name'), {})
+        fmt = {**base, **fmt}
+        if 'size' not in fmt:
+            raise ValueError(f"Unknown output format '{fmt.get('name')}'. Known formats: {', '.join(OUTPUT_FORMATS)}")
+        if fmt.get('rule', 'fit') not in ('fit', 'crop'):
+            raise ValueError(f"Unknown rule '{fmt['rule']}' for output format '{fmt['name']}', use 'fit' or 'crop'.")
+        fmt['size'] = tuple(int(value) for value in fmt['size'])
+        fmt.setdefault('rule', 'fit')
+        resolved.append(fmt)
+    return resolved
+
+
+def format_suffix(fmt: Dict[str, Any]) -> str:
+    """
+    Returns the filename suffix of a format, e.g. '_9x16'.
+    """
+    return '_' + fmt['name'].replace(':', 'x')
+
+
+def make_frame_transform(source_size, fmt: Optional[Dict[str, Any]]) -> Optional[Callable[[np.ndarray], np.ndarray]]:
+    """
+    Returns a function that turns a composed master frame into a frame of the given format,
+    or None when the master frame can be used as it is.
+    """
+    if fmt is None:
+        return None
+    source_width, source_height = source_size
+    target_width, target_height = fmt['size']
+    if (source_width, source_height) == (target_width, target_height):
+        return None
+
+    if fmt['rule'] == 'crop':
+        scale = max(target_width / source_width, target_height / source_height)
+        crop_width = min(source_width, int(round(target_width / scale)))
+        crop_height = min(source_height, int(round(target_height / scale)))
+        left = (source_width - crop_width) // 2
+        top = (source_height - crop_height) // 2
+
+        def transform(frame):
+            region = Image.fromarray(frame[top:top + crop_height, left:left + crop_width])
+            return np.asarray(region.resize((target_width, target_height), Image.BILINEAR))
+        return transform
+
+    scale = min(target_width / source_width, target_height / source_height)
+    fitted_width = int(round(source_width * scale))
+    fitted_height = int(round(source_height * scale))
+    left = (target_width - fitted_width) // 2
+    top = (target_height - fitted_height) // 2
+    canvas = np.zeros((target_height, target_width, 3), dtype=np.uint8)
+
+    def transform(frame):
+        # Only the fitted area changes between frames, the black padding is written once
+        canvas[top:top + fitted_height, left:left + fitted_width] = np.asarray(
+            Image.fromarray(frame).resize((fitted_width, fitted_height), Image.BILINEAR))
+        return canvas
+    return transform
@@ -0,0 +1,142 @@
+"""
+Pre-decoded GIF sprites.
+
+Every GIF is decoded once into an array of pre-scaled RGBA frames plus the time each frame ends at.
+Sprites are kept in an in-memory LRU keyed by the GIF's content hash and height, and on disk in the shared
+cache, so the same animation is decoded once for all campaigns. During composition a frame is a lookup
+into the sprite, looping when the layer is longer than the animation.
+"""
+import logging
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from moviepy import VideoClip
+from PIL import Image, ImageSequence
+
+from backend import tracing
+from backend.cache import file_digest, get_cache_dir, touch
+
+GIF_SPRITE_VERSION = 1
+# Frame delay used by browsers for GIFs without (or with a zero) delay
+DEFAULT_FRAME_SECONDS = 0.1
+
+
+class GifSprite:
+    """
+    Decoded GIF animation.
+
+    Parameters:
+    - rgb (np.ndarray): N x H x W x 3 uint8 frames.
+    - alpha (np.ndarray): N x H x W float32 opacity between 0 and 1.
+    - ends (np.ndarray): Time (in seconds) at which every frame ends; the last entry is the loop duration.
+    """
+
+    def __init__(self, rgb: np.ndarray, alpha: np.ndarray, ends: np.ndarray):
+        self.rgb = rgb
+        self.alpha = alpha
+        self.ends = ends
+        self.duration = float(ends[-1])
+        self.nbytes = rgb.nbytes + alpha.nbytes
+
+    def frame_index(self, t: float) -> int:
+        """
+        Returns the index of the frame shown at time t, looping the animation.
+        """
+        index = int(np.searchsorted(self.ends, t % self.duration, side='right'))
+        return min(index, len(self.ends) - 1)
+
+
+class GifSpriteCache:
+    """
+    LRU cache of decoded GIF sprites.
+
+    Parameters:
+    - max_items (int): Number of sprites kept in memory.
+    - max_bytes (int): Total size of the sprites kept in memory; long animations are large.
+    - disk_cache (bool): Also store sprites in the shared cache folder, so they survive between processes.
+    """
+
+    def __init__(self, max_items: int = 64, max_bytes: int = 256 * 1024 * 1024, disk_cache: bool = True):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.disk_dir = get_cache_dir('gifs') if disk_cache else None
+        self._sprites = OrderedDict()
+        self._bytes = 0
+
+    def get(self, path, height: int) -> GifSprite:
+        """
+        Returns the sprite of the GIF at path scaled to the given height, decoding it on a cache miss.
+        """
+        key = (file_digest(path), height)
+        sprite = self._sprites.get(key)
+        if sprite is not None:
+            self._sprites.move_to_end(key)
+            return sprite
+
+        disk_path = None
+        if self.disk_dir is not None:
+            disk_path = self.disk_dir / f"{key[0]}_{height}_v{GIF_SPRITE_VERSION}.npz"
+            if disk_path.exists():
+                try:
+                    with np.load(disk_path) as data:
+                        sprite = GifSprite(data['rgb'], data['alpha'], data['ends'])
+                    touch(disk_path)
+                except Exception as e:
+                    logging.warning(f"Could not read cached GIF sprite '{disk_path.name}': {e}")
+
+        if sprite is None:
+            with tracing.span('decode gif', 'assets', file=Path(path).name):
+                sprite = decode_gif(path, height)
+            if disk_path is not None:
+                temp_path = disk_path.with_name(f"{disk_path.stem}.{os.getpid()}.tmp")
+                with open(temp_path, 'wb') as f:
+                    np.savez(f, rgb=sprite.rgb, alpha=sprite.alpha, ends=sprite.ends)
+                os.replace(temp_path, disk_path)
+
+        self._sprites[key] = sprite
+        self._bytes += sprite.nbytes
+        while len(self._sprites) > 1 and (len(self._sprites) > self.max_items or self._bytes > self.max_bytes):
+            self._bytes -= self._sprites.popitem(last=False)[1].nbytes
+        return sprite
+
+
+def decode_gif(path, height: int) -> GifSprite:
+    """
+    Decodes all frames of a GIF, scaled to the given height, together with their timing.
+    """
+    rgb_frames, alpha_frames, delays = [], [], []
+    with Image.open(path) as image:
+        width = max(1, round(image.width * height / image.height))
+        for frame in ImageSequence.Iterator(image):
+            delay = frame.info.get('duration') or 0
+            rgba = np.asarray(frame.convert('RGBA').resize((width, height), Image.LANCZOS))
+            rgb_frames.append(rgba[:, :, :3])
+            alpha_frames.append(rgba[:, :, 3].astype(np.float32) / 255)
+            delays.append(delay / 1000 if delay > 0 else DEFAULT_FRAME_SECONDS)
+    return GifSprite(np.stack(rgb_frames), np.stack(alpha_frames), np.cumsum(delays))
+
+
+_default_cache = GifSpriteCache(disk_cache=os.getenv('ADFLOWGEN_GIF_DISK_CACHE', '1') == '1')
+
+
+def make_gif_clip(path, height: int, duration: float = None, cache: GifSpriteCache = None) -> Any:
+    """
+    Creates a clip (with mask) that plays a GIF from its cached sprite.
+
+    Parameters:
+    - path: Path to the GIF file.
+    - height (int): Height of the clip in pixels.
+    - duration (float): Duration of the clip; the animation loops to fill it. Defaults to one loop.
+    - cache (GifSpriteCache): Sprite cache to use. Defaults to the process wide cache.
+    """
+    cache = cache or _default_cache
+    sprite = cache.get(path, height)
+    clip = VideoClip(make_frame=lambda t: sprite.rgb[sprite.frame_index(t)], duration=duration or sprite.duration)
+    mask = VideoClip(make_frame=lambda t: sprite.alpha[sprite.frame_index(t)], is_mask=True, duration=clip.duration)
+    clip = clip.with_mask(mask)
+    # Lets the segment cache identify the layer by the GIF's contents
+    clip.filename = str(Path(path))
+    return clip
@@ -0,0 +1,95 @@
+"""
+Incremental re-rendering.
+
+Every segment of the timeline gets a key that hashes everything that can change its pixels: the contents
+of the visible layers, their positions, sizes and time windows, the frame range and the render settings.
+Encoded segments are kept per campaign under the key, so after a small edit to config.json only the
+segments whose key changed are encoded again.
+"""
+import hashlib
+import logging
+import shutil
+from pathlib import Path
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+
+from backend.cache import file_digest
+
+SEGMENT_CACHE_VERSION = 1
+# Moving stretches are cut on a fixed time grid, so segment boundaries do not depend on the number of workers
+INCREMENTAL_SEGMENT_SECONDS = 2
+
+
+def layer_fingerprint(layer: Any, memo: Dict[int, str] = None) -> str:
+    """
+    Returns a digest of the pixels a layer can produce: the file contents for file based clips
+    (proxies are named after their content hash already) or the image data for photos and subtitle sprites.
+    """
+    memo = memo if memo is not None else {}
+    filename = getattr(layer, 'filename', None)
+    if filename:
+        name = Path(filename).name
+        source = name if Path(filename).parent.name == 'proxies' else file_digest(filename)
+    elif getattr(layer, 'img', None) is not None:
+        image_id = id(layer.img)
+        if image_id not in memo:
+            memo[image_id] = hashlib.sha1(np.ascontiguousarray(layer.img)).hexdigest()
+        source = memo[image_id]
+    else:
+        # Unknown clip type; identify it by its class so the key is at least stable within one render
+        source = type(layer).__name__
+
+    mask = getattr(layer, 'mask', None)
+    if mask is not None and getattr(mask, 'img', None) is not None:
+        source += hashlib.sha1(np.ascontiguousarray(mask.img)).hexdigest()
+    return source
+
+
+def segment_key(layers: List[Any], first_frame: int, end_frame: int, fps: float, settings: Iterable, memo: Dict[int, str] = None) -> str:
+    """
+    Returns the cache key of the frames [first_frame, end_frame).
+
+    Parameters:
+    - layers (List): All layer clips of the timeline, in stacking order.
+    - first_frame (int), end_frame (int): Frame range of the segment.
+    - fps (float): Output frame rate.
+    - settings (Iterable): Render settings that influence the output (canvas size, preset, ...).
+    - memo (Dict): Shared memo of image digests, so every photo is hashed once per render.
+    """
+    start, end = first_frame / fps, end_frame / fps
+    sha = hashlib.sha256(repr((SEGMENT_CACHE_VERSION, first_frame, end_frame, fps, tuple(settings))).encode('utf-8'))
+    for layer in layers:
+        layer_start = layer.start or 0
+        layer_end = layer.end if layer.end is not None else float('inf')
+        if layer_start >= end or layer_end <= start:
+            continue
+        position = layer.pos(max(start, layer_start)) if callable(getattr(layer, 'pos', None)) else None
+        sha.update(repr((layer_fingerprint(layer, memo), layer_start, layer_end, tuple(layer.size),
+                         position, getattr(layer, 'relative_pos', False))).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def prune_segment_cache(cache_dir: Path, keep: Iterable[str]) -> None:
+    """
+    Deletes cached segments that are not part of the latest render of the campaign.
+    """
+    keep = set(keep)
+    removed = 0
+    for entry in Path(cache_dir).glob('*.mp4'):
+        if entry.stem not in keep:
+            try:
+                entry.unlink()
+                removed += 1
+            except OSError:
+                pass
+    if removed:
+        logging.info(f"Removed {removed} outdated segments from '{cache_dir}'")
+
+
+def store_segment(rendered_path: str, cached_path: Path) -> None:
+    """
+    Moves a freshly encoded segment into the segment cache.
+    """
+    Path(cached_path).parent.mkdir(parents=True, exist_ok=True)
+    shutil.move(rendered_path, cached_path)
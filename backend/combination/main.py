@@ -2,28 +2,58 @@ import os
 from pathlib import Path
 from moviepy import (
     VideoFileClip,
-    AudioFileClip,
     ImageClip,
-    CompositeVideoClip,
-    CompositeAudioClip,
-    TextClip,
-    concatenate_videoclips,
-    concatenate_audioclips,
 )
-from moviepy.video.tools.subtitles import SubtitlesClip
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Union
 import logging
 
-def combine_assets(asset_folder: str, output_filename: str = "output_video.mp4", target_script='latin', preview=False) -> str:
+from backend import tracing
+from backend.combination.segments import render_segmented
+from backend.combination.profiles import resolve_profile
+from backend.combination.proxy_cache import fit_size, get_video_proxy
+from backend.combination.subtitles import make_subtitle_clips, resolve_font
+from backend.combination.gifs import make_gif_clip
+from backend.combination.stills import find_still_intervals
+from backend.combination.formats import format_suffix, resolve_formats
+from backend.combination.compositor import make_composite_clip
+from backend.combination.audio import DEFAULT_DUCK_LEVEL, render_audio
+from backend.combination.planning import AUDIO_TYPES, VISUAL_TYPES, plan_timeline
+from backend.combination.readers import DEFAULT_MAX_OPEN_READERS, ReaderPool, close_timeline, lazy_video_clip
+
+# Canvas used for proxy previews: small, low frame rate and encoded with the 'draft' profile
+PREVIEW_WIDTH = 640
+PREVIEW_HEIGHT = 360
+PREVIEW_FPS = 12
+
+def combine_assets(asset_folder: str, output_filename: str = "output_video.mp4", target_script='latin', preview=False, workers: int = 1,
+                   max_memory_mb: int = None, incremental: bool = True, formats: List[Any] = None,
+                   encoding_profile: Union[str, Dict[str, Any]] = None, trace_path: str = None) -> Union[str, Dict[str, str]]:
     """
     Combines assets from the specified folder into a single video ad creative.
 
     Parameters:
     - asset_folder (str): Path to the folder containing asset configuration files.
     - output_filename (str): Name of the output video file.
+    - preview (bool): Render a quick low-resolution proxy preview to 'preview_<output_filename>' instead.
+      The timeline is built at PREVIEW_WIDTH x PREVIEW_HEIGHT and PREVIEW_FPS from the start, so sources
+      are decoded from small proxies and subtitles are rasterized small.
+    - workers (int): Number of worker processes. With more than one worker the timeline is cut into
+      time ranges that are rendered in parallel and joined without re-encoding.
+    - max_memory_mb (int): Memory cap for the render. Frames are streamed to the encoder through a buffer
+      that shrinks when the cap is reached.
+    - incremental (bool): Keep encoded segments in '.render_cache' inside the asset folder and only encode
+      segments whose layers or settings changed since the previous render.
+    - formats (List): Output formats to produce in one pass, e.g. ["16:9", "9:16", {"name": "1:1", "rule": "crop"}]
+      (see formats.py). Defaults to 'output_formats' in the general configs. Every format is written
+      to '<output_filename stem>_<name>.mp4', e.g. 'output_video_9x16.mp4'.
+    - encoding_profile (str or Dict): Encoding profile ('draft', 'delivery', 'archive' or a dict, see profiles.py).
+      Defaults to 'encoding_profile' in the general configs, or 'delivery'. Previews always use 'draft'.
+    - trace_path (str): Record the time spent per stage and per layer, write it as a Chrome trace to trace_path
+      and log a summary table (see backend/tracing.py). When tracing is already enabled by the caller,
+      the render is recorded in the caller's trace instead.
 
     Returns:
-    - str: Path to the generated video file.
+    - str: Path to the generated video file. With formats: Dict[str, str] of format name to path.
     """
 
     # Resolve the asset folder path
@@ -32,26 +62,106 @@ def combine_assets(asset_folder: str, output_filename: str = "output_video.mp4",
     if not asset_path.exists() or not asset_path.is_dir():
         raise FileNotFoundError(f"The asset folder '{asset_folder}' does not exist or is not a directory.")
 
+    general_configs = load_configs(asset_path).get('general', {})
+    if preview:
+        canvas = (PREVIEW_WIDTH, PREVIEW_HEIGHT, PREVIEW_FPS)
+        output_path = asset_path / f"preview_{output_filename}"
+        profile = resolve_profile('draft')
+        cache_dir = asset_path / '.render_cache' / 'preview'
+    else:
+        canvas = (1920, 1080, 24)
+        output_path = asset_path / output_filename
+        profile = resolve_profile(encoding_profile or general_configs.get('encoding_profile'))
+        cache_dir = asset_path / '.render_cache' / 'full'
+
+    formats = formats or general_configs.get('output_formats')
+    if formats:
+        formats = resolve_formats(formats)
+        if preview:
+            # Previews keep the aspect ratio of every format at the preview scale
+            scale = PREVIEW_HEIGHT / 1080
+            formats = [{**fmt, 'size': tuple(int(round(side * scale / 2)) * 2 for side in fmt['size'])} for fmt in formats]
+        outputs = [(output_path.with_name(f"{output_path.stem}{format_suffix(fmt)}{output_path.suffix}"), fmt) for fmt in formats]
+    else:
+        outputs = [(output_path, None)]
+
+    if trace_path and not tracing.is_enabled():
+        tracing.enable()
+    else:
+        trace_path = None
+
+    with tracing.span('build timeline', asset_folder=asset_path.name):
+        final_with_subtitles, layers, audio_sources = build_timeline(asset_path, target_script, *canvas)
+    duck_level = general_configs.get('background_ducking', DEFAULT_DUCK_LEVEL)
+
+    def write_audio(audio_path):
+        # All audio sources are decoded once and mixed with NumPy into a single track
+        return render_audio(audio_sources, final_with_subtitles.duration, audio_path, duck_level, video_fps=final_with_subtitles.fps)
+
+    # Write the final video to a file
+    # Intervals without any moving layer are composed once and encoded from a single frame
+    try:
+        still_intervals = find_still_intervals(layers, final_with_subtitles.duration, final_with_subtitles.compositor)
+        with tracing.span('render', asset_folder=asset_path.name, outputs=len(outputs), workers=workers):
+            output_paths = render_segmented(final_with_subtitles, outputs, build_final_clip, (asset_path, target_script, *canvas),
+                                            workers=workers, still_intervals=still_intervals, max_memory_mb=max_memory_mb, profile=profile,
+                                            layers=layers, cache_dir=cache_dir if incremental else None, audio_writer=write_audio)
+    finally:
+        # The video readers (ffmpeg processes) of the timeline are stopped whether the render succeeded or not
+        close_timeline(final_with_subtitles)
+        if trace_path:
+            tracing.finish(trace_path)
+
+    if formats:
+        return {fmt['name']: path for fmt, path in zip(formats, output_paths)}
+    return output_paths[0]
+
+def build_final_clip(asset_path: Path, target_script='latin', wanted_width: int = 1920, wanted_height: int = 1080, wanted_fps: int = 24):
+    """
+    Builds the final composed clip for the asset folder. See build_timeline.
+    """
+    return build_timeline(asset_path, target_script, wanted_width, wanted_height, wanted_fps)[0]
+
+def build_timeline(asset_path: Path, target_script='latin', wanted_width: int = 1920, wanted_height: int = 1080, wanted_fps: int = 24):
+    """
+    Builds the complete video timeline (backgrounds, overlays and subtitles) described by the config.json in asset_path,
+    and collects the audio sources to mix (see audio.py).
+
+    Parameters:
+    - asset_path (Path): Resolved path to the asset folder.
+    - target_script (str): Script used to pick the subtitle font.
+    - wanted_width (int), wanted_height (int), wanted_fps (int): Output canvas. Sizes of GIFs and subtitles
+      are scaled relative to a 1920x1080 canvas.
+
+    Returns:
+    - The final composed clip, trimmed to max_duration_seconds if set. Assets starting after max_duration_seconds
+      are not loaded at all and assets running past it are trimmed before composition.
+    - List of all visual layer clips (backgrounds, overlays and subtitle cues) with their start and end times.
+    - Dict of audio sources: 'voiceover' and 'background' files, and 'layers' as (file, start, end) of the video layers.
+    """
     # Load asset configurations
     configs = load_configs(asset_path)
     asset_configs = configs.get('assets', [])
     general_configs = configs.get('general', {})
     max_duration_seconds = general_configs.get('max_duration_seconds', None)
 
+    # Start and end times come from the asset metadata index, so no clip has to be opened to place the others
+    plan = plan_timeline(asset_path, configs)
+    for problem in plan['problems']:
+        logging.warning(problem)
+    if plan['cut']:
+        logging.info(f"Not loading {len(plan['cut'])} assets that start after max_duration_seconds: {', '.join(plan['cut'])}")
+    # Video readers only run during their layer's time window, with a cap on how many run at once
+    reader_pool = ReaderPool(general_configs.get('max_open_readers', DEFAULT_MAX_OPEN_READERS))
+
     # Initialize lists to hold different asset types
     background_clips: List[Any] = []
-    voiceover_audio_clips: List[Any] = []
-    background_audio_clips: List[Any] = []
+    voiceover_audio_files: List[Path] = []
+    background_audio_files: List[Path] = []
     overlay_clips: List[Any] = []
     subtitle_clips: List[Any] = []
     
-    total_duration_bg = 0
-    total_duration_overlay = 0
-    
-    wanted_width = 1920  
-    wanted_height = 1080
-    wanted_ratio = wanted_width / wanted_height
-    wanted_fps = 24
+    scale = wanted_height / 1080
     fontfilepath = {
         'latin': 'assets/stlib/fonts/FreeMonoBold.ttf',
         'ethiopian': 'assets/stlib/fonts/NotoSansEthiopic.ttf'
@@ -59,7 +169,7 @@ def combine_assets(asset_folder: str, output_filename: str = "output_video.mp4",
     }.get(target_script, 'assets/stlib/fonts/FreeMonoBold.ttf')
 
     # Process each asset based on its type
-    for config in asset_configs:
+    for position, config in enumerate(asset_configs):
         asset_type = config.get('asset_type')
         if not asset_type:
             # Some assets configs (e.g. "generation_method": "generate_voiceover") are not assets themselves, but instructions for creating assets
@@ -70,160 +180,106 @@ def combine_assets(asset_folder: str, output_filename: str = "output_video.mp4",
             if not asset_file.exists():
                 logging.warning(f"Asset file '{filename}' does not exist. Skipping.")
                 continue
+        planned = plan['entries'].get(position)
+        if asset_type in VISUAL_TYPES + AUDIO_TYPES and planned is None:
+            # Unreadable or unsuitable file (reported by plan_timeline), or starts after max_duration_seconds
+            continue
 
-        if asset_type == 'background_video':
-            start_time = total_duration_bg 
-            clip = VideoFileClip(str(asset_file)).with_start(start_time)
-            if clip.w / clip.h != wanted_ratio:
-                if clip.w / clip.h > wanted_ratio:
-                    clip = clip.resized(width=wanted_width)
-                else:
-                    clip = clip.resized(height=wanted_height)
-            else:
-                if clip.w != wanted_width:
-                    clip = clip.resized(width=wanted_width)
-            total_duration_bg += clip.duration
-            background_clips.append(clip)
-
-        elif asset_type == 'background_photo':
-            duration = int(config.get('duration', 5))
-            start_time = total_duration_bg
-            img_clip = ImageClip(str(asset_file), duration=duration).with_start(start_time) # .with_duration(duration)  # Default duration
-            if img_clip.w / img_clip.h != wanted_ratio:
-                if img_clip.w / img_clip.h > wanted_ratio:
-                    img_clip = img_clip.resized(width=wanted_width)
-                else:
-                    img_clip = img_clip.resized(height=wanted_height)
-            else:
-                if img_clip.w != wanted_width:
-                    img_clip = img_clip.resized(width=wanted_width)
-            img_clip.fps = 24
-            background_clips.append(img_clip)
-            total_duration_bg += duration
-            img_clip = img_clip.with_end(total_duration_bg)
+        # Loading an asset includes transcoding its proxy, decoding GIFs and rasterizing subtitles
+        with tracing.span(f"load {asset_type}", 'assets', file=filename):
+            if asset_type == 'background_video':
+                # Audio of video layers is decoded separately by the audio mixer, so no audio reader is opened here
+                clip = lazy_video_clip(get_video_proxy(asset_file, wanted_width, wanted_height, wanted_fps), reader_pool).with_start(planned['start'])
+                if planned['trimmed']:
+                    clip = clip.with_end(planned['end'])
+                clip = fit_to_canvas(clip, wanted_width, wanted_height)
+                background_clips.append(clip)
+
+            elif asset_type == 'background_photo':
+                duration = planned['end'] - planned['start']
+                img_clip = ImageClip(str(asset_file), duration=duration).with_start(planned['start'])
+                img_clip = fit_to_canvas(img_clip, wanted_width, wanted_height)
+                img_clip.fps = wanted_fps
+                background_clips.append(img_clip)
         
-        elif asset_type == 'overlay_photo':
-            duration = int(config.get('duration', 5))
-            start_time = total_duration_overlay
-            img_clip = ImageClip(str(asset_file), duration=duration).with_start(start_time) # .with_duration(duration)  # Default duration
-            if img_clip.w / img_clip.h != wanted_ratio:
-                if img_clip.w / img_clip.h > wanted_ratio:
-                    img_clip = img_clip.resized(width=wanted_width)
-                else:
-                    img_clip = img_clip.resized(height=wanted_height)
-            else:
-                if img_clip.w != wanted_width:
-                    img_clip = img_clip.resized(width=wanted_width)
-            img_clip.fps = 24
-            img_clip = img_clip.with_position(("center", "center"))
-            overlay_clips.append(img_clip)
-            total_duration_overlay += duration
-            img_clip = img_clip.with_end(total_duration_overlay)
+            elif asset_type == 'overlay_photo':
+                duration = planned['end'] - planned['start']
+                img_clip = ImageClip(str(asset_file), duration=duration).with_start(planned['start'])
+                img_clip = fit_to_canvas(img_clip, wanted_width, wanted_height)
+                img_clip.fps = wanted_fps
+                img_clip = img_clip.with_position(("center", "center"))
+                overlay_clips.append(img_clip)
         
-        elif asset_type == 'overlay_video':
-            duration = int(config.get('duration', 5))
-            start_time = total_duration_overlay
-            clip = VideoFileClip(str(asset_file)).with_start(start_time)
-            if clip.w / clip.h != wanted_ratio:
-                if clip.w / clip.h > wanted_ratio:
-                    clip = clip.resized(width=wanted_width)
-                else:
-                    clip = clip.resized(height=wanted_height)
-            else:
-                if clip.w != wanted_width:
-                    clip = clip.resized(width=wanted_width)
-            clip = clip.with_position(("center", "center")) 
-            overlay_clips.append(clip)
-            total_duration_overlay += duration
-            clip = clip.with_end(total_duration_overlay)
+            elif asset_type == 'overlay_video':
+                # Plays in full; the next overlay starts after 'duration' (see plan_timeline)
+                clip = lazy_video_clip(get_video_proxy(asset_file, wanted_width, wanted_height, wanted_fps), reader_pool).with_start(planned['start'])
+                if planned['trimmed']:
+                    clip = clip.with_end(planned['end'])
+                clip = fit_to_canvas(clip, wanted_width, wanted_height)
+                clip = clip.with_position(("center", "center")) 
+                overlay_clips.append(clip)
             
 
-        elif asset_type == 'voiceover':
-            audio_clip = AudioFileClip(str(asset_file))
-            voiceover_audio_clips.append(audio_clip)
+            elif asset_type == 'voiceover':
+                voiceover_audio_files.append(asset_file)
             
-        elif asset_type == 'background_audio':
-            audio_clip = AudioFileClip(str(asset_file))
-            background_audio_clips.append(audio_clip)
-
-        elif asset_type == 'gif_animation':
-            gif_position = config.get('position', (0.5, 0.5)) 
-            gif_position = tuple(gif_position) # In JSON, position is represented as [0.5, 0.5]
-            gif_clip = VideoFileClip(str(asset_file))  # Resize if necessary
-            gif_clip = gif_clip.resized(height=200)
-            overlay_clips.append(gif_clip.with_position(gif_position))
-
-        elif asset_type == 'subtitle':
-            if filename.endswith('.srt'):
-                # Parse the .srt file
-                # def subtitle_generator(txt):
-                #     return TextClip(txt, fontsize=24, color='white', stroke_color='black', stroke_width=2)
-                # TODO: Implement a more advanced subtitle generator 
-                # with white text with a black border, such as in fireship videos
-                # much larger text
-                subtitle_generator = lambda text: TextClip(font=fontfilepath, text=text,
-                                font_size=72, color='white', method='caption', size=(int(wanted_width*3/4), None), stroke_color='black', stroke_width=2)
-
-                subtitles = SubtitlesClip(str(asset_file), make_textclip=subtitle_generator, encoding='utf-8')
-                subtitle_clips.append(subtitles.with_position(("center", "bottom")))
+            elif asset_type == 'background_audio':
+                background_audio_files.append(asset_file)
+
+            elif asset_type == 'gif_animation':
+                gif_position = config.get('position', (0.5, 0.5)) 
+                gif_position = tuple(gif_position) # In JSON, position is represented as [0.5, 0.5]
+                # Decoded once into pre-scaled frames (cached by content hash) and looped from memory
+                gif_clip = make_gif_clip(asset_file, height=int(200 * scale), duration=planned['end'] - planned['start'])
+                overlay_clips.append(gif_clip.with_position(gif_position))
+
+            elif asset_type == 'subtitle':
+                if filename.endswith('.srt'):
+                    # Every cue is rasterized once into a cached sprite (white text with a black border)
+                    subtitle_clips.extend(make_subtitle_clips(asset_file, font=resolve_font(fontfilepath), font_size=int(72 * scale),
+                                                              width=int(wanted_width*3/4), position=("center", "bottom"),
+                                                              stroke_width=max(1, round(2 * scale)), until=max_duration_seconds))
+                else:
+                    logging.warning(f"Unsupported subtitle format in file '{filename}'. Skipping.")
             else:
-                logging.warning(f"Unsupported subtitle format in file '{filename}'. Skipping.")
-        else:
-            logging.warning(f"Unknown asset type '{asset_type}'. Skipping.")
+                logging.warning(f"Unknown asset type '{asset_type}'. Skipping.")
 
-    # Combine background clips
+    # Combine background, overlay and subtitle clips in a single compositing pass
     # TODO: Find a way to more naturally combine video/photo lengths. Idea: max_duration_bg_seconds in general configs
-    if background_clips:
-        final_background = concatenate_videoclips(background_clips, method="compose")
-    else:
+    if not background_clips:
         raise ValueError("No background clips found to create the video.")
-
-    # Combine overlay clips
-    if overlay_clips:
-        final_overlays = CompositeVideoClip([final_background] + overlay_clips) # use_bgclip=True  the first clip in the list should be used as the ‘background’ on which all other clips are blitted
-    else:
-        final_overlays = final_background
-
-    # Add subtitles if any
-    if subtitle_clips:
-        final_with_subtitles = CompositeVideoClip([final_overlays] + subtitle_clips)
-    else:
-        final_with_subtitles = final_overlays
+    background_clips = [clip.with_position(("center", "center")) for clip in background_clips]
+    layers = background_clips + overlay_clips + subtitle_clips
+    final_with_subtitles = make_composite_clip(layers, (wanted_width, wanted_height), wanted_fps)
+    final_with_subtitles.reader_pool = reader_pool
         
-    # Combine voiceover and background audio
-    if voiceover_audio_clips and background_audio_clips:
-        # Combine the voiceover and background audio clips into a composite audio clip
-        combined_all_audio = CompositeAudioClip([concatenate_audioclips(voiceover_audio_clips),
-                                                concatenate_audioclips(background_audio_clips)])
-    elif voiceover_audio_clips:
-        # If only voiceover audio clips are available
-        combined_all_audio = concatenate_audioclips(voiceover_audio_clips)
-    elif background_audio_clips:
-        # If only background audio clips are available
-        combined_all_audio = concatenate_audioclips(background_audio_clips)
-    else:
-        # If no audio clips are available, set to None
-        combined_all_audio = None
-
-    # Add all audio to final video
-    if combined_all_audio:
-        combined_all_audio = combined_all_audio.with_end(final_with_subtitles.duration)
-        print(f"Clipping duration of background audio: {final_with_subtitles.duration}s")
-        final_with_subtitles = final_with_subtitles.with_audio(combined_all_audio)
-    
-    # Set the final video duration
+    # Audio is mixed separately; the video layers only contribute their audio when there is no voiceover or background audio
+    audio_sources = {
+        'voiceover': voiceover_audio_files,
+        'background': background_audio_files,
+        'layers': [(layer.filename, layer.start or 0, layer.end if layer.end is not None else final_with_subtitles.duration)
+                   for layer in layers if isinstance(layer, VideoFileClip)],
+    }
+
+    # Set the final video duration. The layers were already cut at max_duration_seconds by plan_timeline,
+    # so this only catches layers whose real length differs from the indexed metadata
     if max_duration_seconds:
         if final_with_subtitles.duration > max_duration_seconds:
             final_with_subtitles = final_with_subtitles.with_duration(max_duration_seconds)
-        
-    if preview:
-        preview_clip = final_with_subtitles.resized(height=600)  # Adjust height to fit your screen
-        preview_clip.preview(audio=True)
-        return
-    # Write the final video to a file
-    final_with_subtitles.write_videofile(str(asset_path / output_filename), codec='libx264', audio_codec='aac', temp_audiofile='temp-audio.m4a', remove_temp=True)
 
-    return str(asset_path / output_filename)
+    return final_with_subtitles, layers, audio_sources
+
+def fit_to_canvas(clip, wanted_width: int, wanted_height: int):
+    """
+    Resizes clip so it fits inside the wanted canvas. Clips that already have the fitted size
+    (such as cached proxies) are returned as they are, so no per-frame scaling is added.
+    """
+    fitted_width, fitted_height = fit_size(clip.w, clip.h, wanted_width, wanted_height)
+    if abs(clip.w - fitted_width) <= 2 and abs(clip.h - fitted_height) <= 2:
+        return clip
+    if clip.w / clip.h > wanted_width / wanted_height:
+        return clip.resized(width=wanted_width)
+    return clip.resized(height=wanted_height)
 
 def load_configs(asset_path: Path) -> Dict[str, List[Dict[str, Any]]]:
     """
@@ -0,0 +1,163 @@
+"""
+Timeline planning from asset metadata.
+
+The start and end time of every asset, the length of the video and an estimate of the render cost are worked
+out from config.json and the asset metadata index (see backend/metadata.py), without opening any clip.
+build_timeline places the clips at the planned times, and the plan can be checked on its own in milliseconds:
+
+    python -m backend.combination.planning assets/Campaign_Simpletest_01A
+"""
+import json
+import logging
+import math
+import sys
+from pathlib import Path
+from typing import Any, Dict, List
+
+from backend.cache import get_cache_dir
+from backend.metadata import AssetIndex
+from backend.combination.proxy_cache import PROXY_VERSION, fit_size
+
+VISUAL_TYPES = ('background_video', 'background_photo', 'overlay_video', 'overlay_photo', 'gif_animation')
+AUDIO_TYPES = ('voiceover', 'background_audio')
+
+
+def plan_timeline(asset_path: Path, configs: Dict[str, Any], index: AssetIndex = None) -> Dict[str, Any]:
+    """
+    Works out when every asset is shown, with the same rules build_timeline applies:
+    backgrounds play one after another, overlays play one after another (an overlay video plays in full
+    but the next overlay starts after its 'duration'), GIFs start at 0 and audio is concatenated per type.
+
+    Parameters:
+    - asset_path (Path): Campaign folder.
+    - configs (Dict): Contents of config.json.
+    - index (AssetIndex): Metadata index of the folder. Created (and saved) when not given.
+
+    With max_duration_seconds in the general configs the plan is cut there: assets that start at or after
+    the cutoff are left out (so they are never opened) and assets that run past it end at the cutoff.
+
+    Returns:
+    - Dict[str, Any]: 'entries' maps the position of an asset in config['assets'] to its plan
+      (asset_type, filename, start, end, trimmed, metadata); 'duration' is the length of the video;
+      'audio_durations' the total length per audio type; 'cut' lists the filenames left out because of
+      max_duration_seconds; 'problems' lists issues found on the way.
+    """
+    save_index = index is None
+    index = index or AssetIndex(asset_path)
+    general_configs = configs.get('general', {})
+    max_duration_seconds = general_configs.get('max_duration_seconds', None)
+
+    entries = {}
+    problems = []
+    total_duration_bg = 0
+    total_duration_overlay = 0
+    audio_durations = {asset_type: 0.0 for asset_type in AUDIO_TYPES}
+
+    for position, config in enumerate(configs.get('assets', [])):
+        asset_type = config.get('asset_type')
+        filename = config.get('filename')
+        if asset_type not in VISUAL_TYPES + AUDIO_TYPES or not filename:
+            continue
+        metadata = index.get(filename)
+        if metadata is None:
+            problems.append(f"Asset file '{filename}' does not exist or can not be read.")
+            continue
+        if asset_type in ('background_video', 'overlay_video', 'gif_animation') and (not metadata['has_video'] or not metadata['duration']):
+            problems.append(f"'{filename}' is used as {asset_type} but has no video stream with a duration.")
+            continue
+        if asset_type in AUDIO_TYPES and not metadata['has_audio']:
+            problems.append(f"'{filename}' is used as {asset_type} but has no audio stream.")
+            continue
+
+        if asset_type == 'background_video':
+            start, end = total_duration_bg, total_duration_bg + metadata['duration']
+            total_duration_bg = end
+        elif asset_type == 'background_photo':
+            start, end = total_duration_bg, total_duration_bg + int(config.get('duration', 5))
+            total_duration_bg = end
+        elif asset_type == 'overlay_photo':
+            start, end = total_duration_overlay, total_duration_overlay + int(config.get('duration', 5))
+            total_duration_overlay = end
+        elif asset_type == 'overlay_video':
+            start, end = total_duration_overlay, total_duration_overlay + metadata['duration']
+            total_duration_overlay += int(config.get('duration', 5))
+        elif asset_type == 'gif_animation':
+            start, end = 0, config.get('duration') or metadata['duration']
+        else:
+            start, end = audio_durations[asset_type], audio_durations[asset_type] + (metadata['duration'] or 0)
+            audio_durations[asset_type] = end
+
+        entries[position] = {'asset_type': asset_type, 'filename': filename, 'start': start, 'end': end, 'trimmed': False, 'metadata': metadata}
+
+    # Before the cut: a voiceover is only a problem if the assets themselves are shorter than it
+    uncut_duration = max((entry['end'] for entry in entries.values() if entry['asset_type'] in VISUAL_TYPES), default=0)
+    cut = []
+    if max_duration_seconds:
+        for position, entry in list(entries.items()):
+            if entry['start'] >= max_duration_seconds:
+                cut.append(entry['filename'])
+                del entries[position]
+            elif entry['end'] > max_duration_seconds:
+                entry['end'] = max_duration_seconds
+                entry['trimmed'] = True
+
+    visual_ends = [entry['end'] for entry in entries.values() if entry['asset_type'] in VISUAL_TYPES]
+    duration = max(visual_ends, default=0)
+    if not any(entry['asset_type'] in ('background_video', 'background_photo') for entry in entries.values()):
+        problems.append("No background clips found to create the video.")
+    if audio_durations['voiceover'] > uncut_duration > 0:
+        problems.append(f"The voiceover ({audio_durations['voiceover']:.1f}s) is longer than the video ({uncut_duration:.1f}s) and will be cut off.")
+
+    if save_index:
+        index.save()
+    return {'entries': entries, 'duration': duration, 'audio_durations': audio_durations, 'cut': cut, 'problems': problems}
+
+
+def estimate_cost(plan: Dict[str, Any], wanted_width: int = 1920, wanted_height: int = 1080, wanted_fps: int = 24) -> Dict[str, Any]:
+    """
+    Estimates the work of rendering a plan: output frames, video frames to decode (at proxy size)
+    and the number of proxies that still have to be transcoded.
+    """
+    frames = math.ceil(plan['duration'] * wanted_fps)
+    decoded_frames = 0
+    decoded_pixels = 0
+    proxies_to_create = 0
+    proxy_dir = get_cache_dir('proxies')
+    for entry in plan['entries'].values():
+        if entry['asset_type'] not in ('background_video', 'overlay_video'):
+            continue
+        metadata = entry['metadata']
+        visible_seconds = max(0, min(entry['end'], plan['duration']) - entry['start'])
+        proxy_width, proxy_height = fit_size(metadata['width'], metadata['height'], wanted_width, wanted_height)
+        decoded_frames += math.ceil(visible_seconds * wanted_fps)
+        decoded_pixels += math.ceil(visible_seconds * wanted_fps) * proxy_width * proxy_height
+        proxy_name = f"{metadata['sha256']}_{wanted_width}x{wanted_height}_{wanted_fps}_v{PROXY_VERSION}.mp4"
+        if not (proxy_dir / proxy_name).exists():
+            proxies_to_create += 1
+    return {
+        'frames': frames,
+        'decoded_video_frames': decoded_frames,
+        'decoded_megapixels': round(decoded_pixels / 1e6, 1),
+        'proxies_to_create': proxies_to_create,
+    }
+
+
+def _print_plan(asset_folder: str) -> List[str]:
+    asset_path = Path(asset_folder).resolve()
+    with open(asset_path / 'config.json', 'r') as f:
+        configs = json.load(f)
+    plan = plan_timeline(asset_path, configs)
+    for entry in sorted(plan['entries'].values(), key=lambda entry: (entry['start'], entry['asset_type'])):
+        print(f"{entry['start']:>8.2f} - {entry['end']:>8.2f}  {entry['asset_type']:<18} {entry['filename']}{' (trimmed)' if entry['trimmed'] else ''}")
+    print(f"Duration: {plan['duration']:.2f}s")
+    if plan['cut']:
+        print(f"Left out after max_duration_seconds: {', '.join(plan['cut'])}")
+    print(json.dumps(estimate_cost(plan), indent=4))
+    for problem in plan['problems']:
+        logging.warning(problem)
+    return plan['problems']
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(1 if _print_plan(sys.argv[1]) else 0)
@@ -0,0 +1,188 @@
+"""
+Encoding profiles.
+
+A profile holds the libx264 settings used for every segment of a render:
+- 'draft': fastest encode, large files and visible artifacts. Used for previews.
+- 'delivery': balanced settings for uploading to ad platforms (the default).
+- 'archive': slow encode with near transparent quality, for masters that are kept.
+
+`autotune_profile` encodes a short sample of a campaign on this machine with candidate settings and picks
+the fastest one that meets a target bitrate and quality. Run it with:
+
+    python -m backend.combination.profiles --asset_folder assets/Campaign_Simpletest_01A --max_bitrate_kbps 8000 --save
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Union
+
+from moviepy.config import FFMPEG_BINARY
+
+from backend.cache import temp_prefix
+from backend.combination.readers import close_timeline
+
+# Static and moving segments must be encoded with the same profile to be joined by stream copy
+ENCODING_PROFILES = {
+    'draft': {'name': 'draft', 'preset': 'ultrafast', 'crf': 28},
+    'delivery': {'name': 'delivery', 'preset': 'medium', 'crf': 23},
+    'archive': {'name': 'archive', 'preset': 'slow', 'crf': 18},
+}
+DEFAULT_PROFILE = 'delivery'
+
+# Candidate settings tried by autotune_profile
+TUNE_PRESETS = ['veryfast', 'faster', 'fast', 'medium', 'slow']
+TUNE_CRFS = [18, 20, 23, 26]
+
+
+def resolve_profile(profile: Union[str, Dict[str, Any], None]) -> Dict[str, Any]:
+    """
+    Turns a profile name (e.g. "draft") or profile dict ({"name", "preset", "crf"}) into a profile dict.
+    Dicts may override the settings of a known profile, e.g. {"name": "delivery", "crf": 20}.
+    """
+    if profile is None:
+        profile = DEFAULT_PROFILE
+    if isinstance(profile, str):
+        profile = {'name': profile}
+    base = ENCODING_PROFILES.get(profile.get('name'), {})
+    profile = {**base, **profile}
+    if 'preset' not in profile or 'crf' not in profile:
+        raise ValueError(f"Unknown encoding profile '{profile.get('name')}'. Known profiles: {', '.join(ENCODING_PROFILES)}")
+    profile['crf'] = int(profile['crf'])
+    return profile
+
+
+def video_codec_args(profile: Dict[str, Any]) -> List[str]:
+    """
+    Returns the ffmpeg output arguments for encoding video with the given profile.
+    """
+    args = ['-c:v', 'libx264', '-preset', profile['preset'], '-crf', str(profile['crf'])]
+    if profile.get('tune'):
+        args += ['-tune', profile['tune']]
+    return args + ['-pix_fmt', 'yuv420p']
+
+
+def write_sample(clip: Any, sample_path: str, sample_seconds: float) -> int:
+    """
+    Composes the first sample_seconds of clip once and stores the raw RGB frames in sample_path.
+
+    Returns:
+    - int: Number of frames written.
+    """
+    fps = clip.fps or 24
+    n_frames = max(1, int(min(sample_seconds, clip.duration) * fps))
+    with open(sample_path, 'wb') as f:
+        for index in range(n_frames):
+            f.write(clip.get_frame(index / fps)[:, :, :3].astype('uint8').tobytes())
+    return n_frames
+
+
+def measure_candidate(sample_path: str, size, fps: float, n_frames: int, profile: Dict[str, Any], output_path: str) -> Dict[str, float]:
+    """
+    Encodes the raw sample with the profile and returns its encode time, bitrate and PSNR against the sample.
+    """
+    width, height = size
+    raw_input = ['-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f"{width}x{height}", '-r', str(fps), '-i', sample_path]
+
+    started = time.perf_counter()
+    subprocess.run([FFMPEG_BINARY, '-y', '-loglevel', 'error', *raw_input, *video_codec_args(profile), output_path],
+                   check=True, capture_output=True)
+    encode_seconds = time.perf_counter() - started
+
+    result = subprocess.run([FFMPEG_BINARY, '-i', output_path, *raw_input, '-lavfi', 'psnr', '-f', 'null', '-'],
+                            capture_output=True, text=True)
+    match = re.search(r'average:([0-9.]+|inf)', result.stderr)
+    psnr = float(match.group(1)) if match else 0.0
+
+    return {
+        'encode_seconds': encode_seconds,
+        'fps': n_frames / encode_seconds if encode_seconds else float('inf'),
+        'bitrate_kbps': os.path.getsize(output_path) * 8 / 1000 / (n_frames / fps),
+        'psnr': psnr,
+    }
+
+
+def autotune_profile(asset_folder: str, target_script: str = 'latin', max_bitrate_kbps: float = None, min_psnr: float = 40.0,
+                     sample_seconds: float = 4, presets: List[str] = None, crfs: List[int] = None) -> Dict[str, Any]:
+    """
+    Finds the fastest encoding settings on this machine that meet a bitrate and quality target.
+
+    The first sample_seconds of the campaign are composed once; the sample is then encoded with every
+    candidate preset and crf, and the fastest candidate within the targets is returned.
+
+    Parameters:
+    - asset_folder (str): Campaign used as sample.
+    - target_script (str): Script used to pick the subtitle font.
+    - max_bitrate_kbps (float): Highest acceptable average bitrate. None accepts any bitrate.
+    - min_psnr (float): Lowest acceptable average PSNR (in dB) against the uncompressed frames.
+    - sample_seconds (float): Length of the sample.
+    - presets (List[str]), crfs (List[int]): Candidate settings, default TUNE_PRESETS and TUNE_CRFS.
+
+    Returns:
+    - Dict[str, Any]: The chosen profile (named 'tuned'), with its measurements under 'measured'.
+      Falls back to the default profile when no candidate meets the targets.
+    """
+    # Imported here, the timeline builder imports this module
+    from backend.combination.main import build_final_clip
+
+    clip = build_final_clip(Path(asset_folder).resolve(), target_script)
+    fps = clip.fps or 24
+    results = []
+    with tempfile.TemporaryDirectory(prefix=temp_prefix('tune')) as temp_dir:
+        sample_path = os.path.join(temp_dir, 'sample.rgb')
+        try:
+            n_frames = write_sample(clip, sample_path, sample_seconds)
+        finally:
+            # Stops the layer video readers, closing the composite clip does not reach them
+            close_timeline(clip)
+
+        for preset in presets or TUNE_PRESETS:
+            for crf in crfs or TUNE_CRFS:
+                profile = {'name': 'tuned', 'preset': preset, 'crf': crf}
+                measured = measure_candidate(sample_path, clip.size, fps, n_frames, profile, os.path.join(temp_dir, 'candidate.mp4'))
+                logging.info(f"preset={preset} crf={crf}: {measured['fps']:.1f} fps, {measured['bitrate_kbps']:.0f} kbps, PSNR {measured['psnr']:.2f} dB")
+                results.append((profile, measured))
+
+    accepted = [(profile, measured) for profile, measured in results
+                if measured['psnr'] >= min_psnr and (max_bitrate_kbps is None or measured['bitrate_kbps'] <= max_bitrate_kbps)]
+    if not accepted:
+        logging.warning(f"No candidate meets the targets, using the '{DEFAULT_PROFILE}' profile")
+        return resolve_profile(DEFAULT_PROFILE)
+
+    profile, measured = min(accepted, key=lambda item: item[1]['encode_seconds'])
+    logging.info(f"Picked preset={profile['preset']} crf={profile['crf']}")
+    return {**profile, 'measured': {key: round(value, 2) for key, value in measured.items()}}
+
+
+def save_profile(asset_folder: str, profile: Dict[str, Any]) -> None:
+    """
+    Stores the profile as 'encoding_profile' in the general settings of the campaign's config.json.
+    """
+    config_file = Path(asset_folder) / 'config.json'
+    with open(config_file, 'r') as f:
+        configs = json.load(f)
+    configs.setdefault('general', {})['encoding_profile'] = {key: value for key, value in profile.items() if key != 'measured'}
+    with open(config_file, 'w') as f:
+        json.dump(configs, f, indent=4)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the fastest encoding settings on this machine that meet a bitrate and quality target.")
+    parser.add_argument('--asset_folder', type=str, required=True, help="Campaign to encode a sample of")
+    parser.add_argument('--target_script', type=str, default='latin', help="Script used to pick the subtitle font")
+    parser.add_argument('--max_bitrate_kbps', type=float, default=None, help="Highest acceptable average bitrate in kbps")
+    parser.add_argument('--min_psnr', type=float, default=40.0, help="Lowest acceptable average PSNR in dB")
+    parser.add_argument('--sample_seconds', type=float, default=4, help="Length of the encoded sample in seconds")
+    parser.add_argument('--save', action='store_true', help="Store the result as encoding_profile in the campaign's config.json")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    tuned = autotune_profile(args.asset_folder, args.target_script, args.max_bitrate_kbps, args.min_psnr, args.sample_seconds)
+    print(json.dumps(tuned, indent=4))
+    if args.save:
+        save_profile(args.asset_folder, tuned)
@@ -0,0 +1,84 @@
+"""
+Normalized proxy cache for background and overlay videos.
+
+Every source video is transcoded once to the size it is shown at on the canvas and to the output frame rate.
+Proxies are keyed by the content hash of the source plus the target settings, so repeat renders
+and campaigns that share stock footage (e.g. the stlib intro/outro) decode small, pre-scaled files.
+"""
+import logging
+import os
+import subprocess
+from pathlib import Path
+from typing import Tuple
+
+from moviepy.config import FFMPEG_BINARY
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+from backend import tracing
+from backend.cache import evict_lru, file_digest, get_cache_dir, touch
+
+PROXY_VERSION = 1
+PROXY_CACHE_MAX_BYTES = int(os.getenv('ADFLOWGEN_PROXY_CACHE_MB', 10240)) * 1024 * 1024
+
+
+def fit_size(width: int, height: int, wanted_width: int, wanted_height: int) -> Tuple[int, int]:
+    """
+    Returns the size a (width, height) source gets when it is fitted inside the wanted canvas,
+    rounded to even numbers as required by yuv420p.
+    """
+    if width / height > wanted_width / wanted_height:
+        new_width, new_height = wanted_width, wanted_width * height / width
+    else:
+        new_width, new_height = wanted_height * width / height, wanted_height
+    return int(round(new_width / 2)) * 2, int(round(new_height / 2)) * 2
+
+
+def get_video_proxy(source_path, wanted_width: int = 1920, wanted_height: int = 1080, fps: float = 24) -> str:
+    """
+    Returns the path of a proxy of source_path that is already scaled to fit the canvas and resampled to fps.
+
+    The proxy is created on first use. If transcoding fails the source path itself is returned,
+    so rendering falls back to scaling at render time.
+
+    Parameters:
+    - source_path: Path to the source video.
+    - wanted_width (int), wanted_height (int): Size of the output canvas.
+    - fps (float): Output frame rate.
+
+    Returns:
+    - str: Path to the proxy (or to the source on failure).
+    """
+    source_path = Path(source_path)
+    cache_dir = get_cache_dir('proxies')
+    key = f"{file_digest(source_path)}_{wanted_width}x{wanted_height}_{fps}_v{PROXY_VERSION}"
+    proxy_path = cache_dir / f"{key}.mp4"
+
+    if proxy_path.exists():
+        touch(proxy_path)
+        return str(proxy_path)
+
+    # Write to a temporary name first, so concurrent renders never pick up a half written proxy
+    temp_path = cache_dir / f"{key}.{os.getpid()}.tmp"
+    try:
+        infos = ffmpeg_parse_infos(str(source_path))
+        width, height = infos['video_size']
+        proxy_width, proxy_height = fit_size(width, height, wanted_width, wanted_height)
+
+        cmd = [
+            FFMPEG_BINARY, '-y', '-loglevel', 'error', '-i', str(source_path),
+            '-map', '0:v:0', '-map', '0:a?',
+            '-vf', f"scale={proxy_width}:{proxy_height}:flags=bicubic,fps={fps}",
+            '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '18', '-pix_fmt', 'yuv420p',
+            '-c:a', 'aac', '-b:a', '192k', '-f', 'mp4', str(temp_path),
+        ]
+        with tracing.span('transcode proxy', 'assets', file=source_path.name, size=f"{proxy_width}x{proxy_height}"):
+            subprocess.run(cmd, check=True, capture_output=True)
+        os.replace(temp_path, proxy_path)
+    except Exception as e:
+        temp_path.unlink(missing_ok=True)
+        logging.warning(f"Could not create proxy for '{source_path.name}', using the source instead: {e}")
+        return str(source_path)
+
+    logging.info(f"Created {proxy_width}x{proxy_height} proxy for '{source_path.name}'")
+    evict_lru(cache_dir, PROXY_CACHE_MAX_BYTES)
+    return str(proxy_path)
@@ -0,0 +1,107 @@
+"""
+Lazily opened video readers.
+
+A VideoFileClip starts an ffmpeg subprocess as soon as it is created, so a campaign with many stock clips
+used to hold one decoder per clip for the whole render. Video layers are created with `lazy_video_clip`
+instead: the reader is closed right after the clip is built and started again (at the requested time) on
+the first frame of the layer's time window. The streaming engine closes it again once the window has
+passed (see streaming.py). A ReaderPool caps how many readers of a timeline are open at the same time,
+closing the least recently used one when another has to be opened.
+"""
+import os
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+from moviepy import VideoFileClip
+
+from backend import tracing
+
+DEFAULT_MAX_OPEN_READERS = int(os.getenv('ADFLOWGEN_MAX_OPEN_READERS', 4))
+
+# Pools of all timelines alive in this process, so a batch runner can close every reader after a render
+_pools = weakref.WeakSet()
+
+
+class ReaderPool:
+    """
+    Keeps at most max_open ffmpeg video readers running.
+
+    Parameters:
+    - max_open (int): Maximum number of open readers. Should be at least the number of video layers that
+      are on screen at the same time, otherwise those layers keep closing each other's readers.
+    """
+
+    def __init__(self, max_open: int = DEFAULT_MAX_OPEN_READERS):
+        self.max_open = max(1, int(max_open))
+        self._open = OrderedDict()
+        self.opened = 0
+        self.peak_open = 0
+        _pools.add(self)
+
+    def get_frame(self, reader: Any, t: float):
+        """
+        Returns the frame at t from reader, starting its subprocess first if it is not running.
+        """
+        key = id(reader)
+        if reader.proc is None:
+            # Readers can also be closed from outside (see streaming.release_reader)
+            for other_key in [other_key for other_key, other in self._open.items() if other.proc is None]:
+                del self._open[other_key]
+            while len(self._open) >= self.max_open:
+                _, oldest = self._open.popitem(last=False)
+                oldest.close()
+            with tracing.span('open reader', 'assets', file=Path(reader.filename).name, t=t):
+                # Starting past the last frame reads nothing, and a freshly started reader has no last frame to fall back on
+                reader.initialize(max(0, min(t, (reader.n_frames - 1) / reader.fps)))
+            self._open[key] = reader
+            self.opened += 1
+            self.peak_open = max(self.peak_open, len(self._open))
+        else:
+            self._open[key] = reader
+            self._open.move_to_end(key)
+        return reader.get_frame(t)
+
+    def close_all(self) -> int:
+        """
+        Closes every open reader and returns how many were running.
+        Closed readers are started again when a frame is requested.
+        """
+        closed = 0
+        while self._open:
+            _, reader = self._open.popitem()
+            closed += reader.proc is not None
+            reader.close()
+        return closed
+
+
+def close_timeline(clip: Any) -> int:
+    """
+    Closes the video readers of a timeline built by build_timeline. Returns the number of readers that were running.
+    """
+    pool = getattr(clip, 'reader_pool', None)
+    return pool.close_all() if pool is not None else 0
+
+
+def close_all_readers() -> int:
+    """
+    Closes the readers of every timeline in this process. Returns the number of readers that were running.
+    """
+    return sum(pool.close_all() for pool in list(_pools))
+
+
+def lazy_video_clip(filename, pool: ReaderPool) -> VideoFileClip:
+    """
+    Creates a VideoFileClip (without audio) whose reader only runs while frames are read from it.
+
+    Parameters:
+    - filename: Path to the video file.
+    - pool (ReaderPool): Pool that limits the number of open readers of the timeline.
+    """
+    clip = VideoFileClip(str(filename), audio=False)
+    reader = clip.reader
+    reader.close()
+    clip.make_frame = lambda t: pool.get_frame(reader, t)
+    clip.reader_pool = pool
+    return clip
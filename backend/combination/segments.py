@@ -0,0 +1,282 @@
+"""
+Segmented rendering: the timeline is cut into frame-aligned time ranges, every range is rendered
+on its own (in worker processes when more than one worker is used), and the encoded pieces are joined
+with ffmpeg's concat demuxer without re-encoding. Audio is rendered once for the whole timeline and muxed in at the end.
+
+Ranges in which nothing moves (see stills.py) are composed once and encoded from that single frame.
+"""
+import math
+import os
+import logging
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from moviepy.config import FFMPEG_BINARY
+
+from backend import tracing
+from backend.combination.formats import make_frame_transform
+from backend.combination.stills import encode_still_segment
+from backend.combination.streaming import stream_frames
+from backend.cache import temp_prefix
+from backend.combination.incremental import INCREMENTAL_SEGMENT_SECONDS, prune_segment_cache, segment_key, store_segment
+from backend.combination.profiles import resolve_profile
+from backend.combination.readers import close_timeline
+
+
+def plan_segments(duration: float, fps: float, parts: int, still_intervals: List[Tuple[float, float]] = (),
+                  grid_frames: int = None) -> List[Tuple[int, int, bool]]:
+    """
+    Splits the timeline into frame ranges.
+
+    Still intervals become one range each. The remaining (moving) frames are divided into about
+    `parts` ranges in total, proportionally to the length of every moving stretch. With grid_frames
+    the moving frames are instead cut at every multiple of grid_frames, which gives the same boundaries
+    on every render (needed to reuse cached segments).
+
+    Parameters:
+    - duration (float): Duration of the timeline in seconds.
+    - fps (float): Frame rate of the output.
+    - parts (int): Wanted number of ranges for the moving frames.
+    - still_intervals (List[Tuple[float, float]]): Intervals (in seconds) in which every visible layer is static.
+    - grid_frames (int): Optional fixed cut interval for moving frames.
+
+    Returns:
+    - List[Tuple[int, int, bool]]: (first_frame, end_frame, is_still) triples covering all frames in order.
+    """
+    total_frames = max(1, math.ceil(duration * fps - 1e-6))
+
+    # Frame i is shown at i / fps, so an interval [start, end) holds frames ceil(start * fps) .. ceil(end * fps) - 1
+    stills = []
+    for start, end in still_intervals:
+        first_frame = min(total_frames, math.ceil(start * fps - 1e-6))
+        end_frame = min(total_frames, math.ceil(end * fps - 1e-6))
+        if end_frame > first_frame:
+            stills.append((first_frame, end_frame))
+
+    moving = []
+    position = 0
+    for first_frame, end_frame in stills + [(total_frames, total_frames)]:
+        if first_frame > position:
+            moving.append((position, first_frame))
+        position = max(position, end_frame)
+    moving_frames = sum(end_frame - first_frame for first_frame, end_frame in moving)
+
+    segments = [(first_frame, end_frame, True) for first_frame, end_frame in stills]
+    for first_frame, end_frame in moving:
+        length = end_frame - first_frame
+        if grid_frames:
+            boundaries = [first_frame] + list(range((first_frame // grid_frames + 1) * grid_frames, end_frame, grid_frames)) + [end_frame]
+        else:
+            count = max(1, min(length, round(parts * length / moving_frames)))
+            boundaries = [first_frame + round(length * i / count) for i in range(count + 1)]
+        segments.extend((a, b, False) for a, b in zip(boundaries[:-1], boundaries[1:]))
+    return sorted(segments)
+
+
+# Timeline of this worker process, built once by _init_worker and reused for all of its segments
+_worker_clip = None
+
+
+def _init_worker(clip_factory: Callable, factory_args: tuple, trace: bool = False) -> None:
+    """
+    Worker initializer: rebuilds the timeline once in this process. The clip objects can not be sent to
+    other processes, and rebuilding them per segment would probe every video and rasterize every subtitle again.
+    """
+    global _worker_clip
+    if trace:
+        tracing.enable()
+    with tracing.span('rebuild timeline in worker'):
+        _worker_clip = clip_factory(*factory_args)
+
+
+def _render_segment(start: float, end: float, fps: float, threads: int, segment_paths: List[str], max_memory_mb: int = None,
+                    profile: Dict[str, Any] = None, formats: List[Optional[Dict[str, Any]]] = None,
+                    trace: bool = False) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """
+    Worker entry point: encodes the video of [start, end) of the worker's timeline only.
+    Returns the segment paths and, with trace, the trace events recorded in this worker.
+    """
+    try:
+        write_segment(_worker_clip, start, end, fps, threads, segment_paths, max_memory_mb, profile, formats)
+    finally:
+        # Readers are started again on demand, the next segment of this worker is usually elsewhere in the timeline
+        close_timeline(_worker_clip)
+    return segment_paths, tracing.drain() if trace else []
+
+
+def write_segment(clip: Any, start: float, end: float, fps: float, threads: int, segment_paths: List[str], max_memory_mb: int = None,
+                  profile: Dict[str, Any] = None, formats: List[Optional[Dict[str, Any]]] = None) -> List[str]:
+    """
+    Encodes the video (without audio) of [start, end) of clip with the streaming engine, once per output format.
+    """
+    return stream_frames(clip, segment_paths, start, end, fps, profile=profile, threads=threads, max_memory_mb=max_memory_mb, formats=formats)
+
+
+def write_still_segment(clip: Any, first_frame: int, end_frame: int, fps: float, segment_paths: List[str], profile: Dict[str, Any] = None,
+                        formats: List[Optional[Dict[str, Any]]] = None) -> List[str]:
+    """
+    Composes the first frame of a still range once and encodes it, converted to every output format.
+    """
+    with tracing.span('still segment', frames=end_frame - first_frame, outputs=len(segment_paths)):
+        frame = np.ascontiguousarray(clip.get_frame(first_frame / fps)[:, :, :3], dtype=np.uint8)
+        for segment_path, fmt in zip(segment_paths, formats or [None] * len(segment_paths)):
+            transform = make_frame_transform(clip.size, fmt)
+            encode_still_segment(transform(frame) if transform else frame, end_frame - first_frame, fps, segment_path, profile=profile)
+    tracing.flush_totals(first_frame=first_frame, end_frame=end_frame)
+    return segment_paths
+
+
+def count_video_frames(path) -> int:
+    """
+    Counts the packets of the first video stream of a file without decoding it (one packet per frame for H.264).
+    """
+    result = subprocess.run([FFMPEG_BINARY, '-loglevel', 'error', '-i', str(path), '-map', '0:v:0', '-c', 'copy', '-f', 'framecrc', '-'],
+                            check=True, capture_output=True, text=True)
+    return sum(1 for line in result.stdout.splitlines() if line and not line.startswith('#'))
+
+
+def concat_segments(segment_paths: List[str], output_path: Path, audio_path: str = None, list_file: Path = None,
+                    duration: float = None) -> None:
+    """
+    Joins encoded segments with the ffmpeg concat demuxer (stream copy) and muxes in the audio track if given.
+
+    The audio is read for at most `duration` seconds (the length of the encoded frames). The output is never cut
+    to the shorter stream: with stream copy that drops the last frames whenever the video does not end on an audio packet.
+    """
+    list_file = list_file or Path(segment_paths[0]).parent / 'segments.txt'
+    with open(list_file, 'w', encoding='utf-8') as f:
+        for segment_path in segment_paths:
+            escaped = str(segment_path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    cmd = [FFMPEG_BINARY, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', str(list_file)]
+    if audio_path:
+        if duration is not None:
+            cmd += ['-t', f"{duration:.6f}"]
+        cmd += ['-i', audio_path, '-map', '0:v', '-map', '1:a']
+    cmd += ['-c', 'copy', '-movflags', '+faststart', str(output_path)]
+    subprocess.run(cmd, check=True, capture_output=True)
+
+
+def render_segmented(final_clip: Any, outputs: List[Tuple[Path, Optional[Dict[str, Any]]]], clip_factory: Callable, factory_args: tuple,
+                     workers: int = None, still_intervals: List[Tuple[float, float]] = (), max_memory_mb: int = None,
+                     profile: Dict[str, Any] = None, layers: List[Any] = None, cache_dir: Path = None,
+                     audio_writer: Callable[[str], Optional[str]] = None) -> List[str]:
+    """
+    Renders final_clip segment by segment to one or more output files.
+
+    With more than one worker, moving segments are rendered in worker processes. The clip objects themselves
+    can not be sent to other processes, so each worker process calls clip_factory(*factory_args) once to rebuild
+    the same timeline and renders the time ranges it is given from it. Still segments are composed once in this process.
+
+    Every frame is composed once; each output gets it converted to its own format (see formats.py),
+    so several aspect ratios cost a single pass over the decoded sources.
+
+    Parameters:
+    - final_clip: The fully built timeline in this process; used for its duration, fps, audio and still frames.
+    - outputs (List[Tuple[Path, Dict]]): (output path, output format) pairs. A format of None writes the
+      composed frames as they are.
+    - clip_factory (Callable): Module level function that rebuilds final_clip.
+    - factory_args (tuple): Arguments for clip_factory.
+    - workers (int): Number of worker processes. Defaults to the number of CPU cores.
+    - still_intervals (List[Tuple[float, float]]): Intervals that can be encoded from a single frame.
+    - max_memory_mb (int): Memory cap for the render, shared evenly by the worker processes.
+    - profile (Dict): Encoding profile used for every segment (see profiles.py). Defaults to the default profile.
+    - layers (List): Layer clips of the timeline, used to compute segment keys.
+    - cache_dir (Path): Segment cache of the campaign. When given (together with layers), segments whose key
+      is already in the cache are reused and only changed segments are encoded.
+    - audio_writer (Callable): Writes the audio track to the given path and returns it (or None without audio).
+      Defaults to writing the audio of final_clip.
+
+    Returns:
+    - List[str]: Paths to the generated video files, in the order of outputs.
+    """
+    workers = workers or os.cpu_count() or 1
+    profile = profile or resolve_profile(None)
+    fps = final_clip.fps or 24
+    duration = final_clip.duration
+    total_frames = max(1, math.ceil(duration * fps - 1e-6))
+    formats = [fmt for _, fmt in outputs]
+    incremental = cache_dir is not None and layers is not None
+    grid_frames = int(INCREMENTAL_SEGMENT_SECONDS * fps) if incremental else None
+    segments = plan_segments(duration, fps, workers, still_intervals, grid_frames)
+
+    # cached_paths[segment][output] is the cache entry of that segment in that output format
+    cached_paths = [[None] * len(outputs) for _ in segments]
+    if incremental:
+        memo = {}
+        for index, (first_frame, end_frame, _) in enumerate(segments):
+            for output_index, fmt in enumerate(formats):
+                settings = (tuple(final_clip.size), repr(sorted(profile.items())), repr(sorted(fmt.items())) if fmt else None)
+                key = segment_key(layers, first_frame, end_frame, fps, settings, memo)
+                cached_paths[index][output_index] = Path(cache_dir) / f"{key}.mp4"
+        # A segment is only skipped if it is cached in every output format
+
+    is_cached = [incremental and all(path.exists() for path in paths) for paths in cached_paths]
+    moving_count = sum(1 for index, (_, _, is_still) in enumerate(segments) if not is_still and not is_cached[index])
+    if incremental:
+        logging.info(f"Reusing {sum(is_cached)} of {len(segments)} cached segments")
+    threads = max(1, (os.cpu_count() or 1) // max(1, min(workers, moving_count)))
+    logging.info(f"Rendering {duration:.2f}s in {len(segments)} segments ({len(segments) - moving_count} still or cached) "
+                 f"in {len(outputs)} formats with {workers} workers")
+
+    def to_time(frame_index):
+        return duration if frame_index >= total_frames else frame_index / fps
+
+    with tempfile.TemporaryDirectory(prefix=temp_prefix('segments')) as temp_dir:
+        segment_paths = [[os.path.join(temp_dir, f"segment_{index:04d}_{output_index}.mp4") for output_index in range(len(outputs))]
+                         for index in range(len(segments))]
+        executor = None
+        if workers > 1 and moving_count:
+            executor = ProcessPoolExecutor(max_workers=min(workers, moving_count), initializer=_init_worker,
+                                           initargs=(clip_factory, factory_args, tracing.is_enabled()))
+        worker_memory_mb = max_memory_mb // min(workers, moving_count) if executor is not None and max_memory_mb else max_memory_mb
+        try:
+            futures = []
+            for index, (first_frame, end_frame, is_still) in enumerate(segments):
+                if is_cached[index]:
+                    continue
+                if is_still:
+                    write_still_segment(final_clip, first_frame, end_frame, fps, segment_paths[index], profile, formats)
+                elif executor is not None:
+                    futures.append(executor.submit(_render_segment, to_time(first_frame), to_time(end_frame), fps, threads,
+                                                   segment_paths[index], worker_memory_mb, profile, formats, tracing.is_enabled()))
+                else:
+                    write_segment(final_clip, to_time(first_frame), to_time(end_frame), fps, threads, segment_paths[index],
+                                  max_memory_mb, profile, formats)
+            for future in futures:
+                tracing.merge(future.result()[1])
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        if incremental:
+            for index in range(len(segments)):
+                for output_index, cached_path in enumerate(cached_paths[index]):
+                    if not is_cached[index]:
+                        store_segment(segment_paths[index][output_index], cached_path)
+                    segment_paths[index][output_index] = str(cached_path)
+            prune_segment_cache(cache_dir, (path.stem for paths in cached_paths for path in paths))
+
+        audio_path = None
+        with tracing.span('audio'):
+            if audio_writer is not None:
+                audio_path = audio_writer(os.path.join(temp_dir, 'audio.m4a'))
+            elif final_clip.audio is not None:
+                audio_path = os.path.join(temp_dir, 'audio.m4a')
+                final_clip.audio.with_duration(total_frames / fps).write_audiofile(audio_path, codec='aac', logger=None)
+
+        for output_index, (output_path, _) in enumerate(outputs):
+            with tracing.span('concat segments', output=str(output_path), segments=len(segments)):
+                concat_segments([paths[output_index] for paths in segment_paths], output_path, audio_path,
+                                list_file=Path(temp_dir) / f"segments_{output_index}.txt", duration=total_frames / fps)
+            output_frames = count_video_frames(output_path)
+            if output_frames != total_frames:
+                raise RuntimeError(f"{output_path} has {output_frames} frames, {total_frames} were rendered")
+            logging.info(f"Joined {len(segments)} segments into {output_path}")
+
+    return [str(output_path) for output_path, _ in outputs]
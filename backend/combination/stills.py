@@ -0,0 +1,75 @@
+"""
+Still-image fast path.
+
+Slideshow style creatives (a background photo, a stream of overlay photos and subtitles) consist mostly
+of intervals in which nothing on screen moves. Such an interval is composed once and the single frame
+is handed to the encoder, which repeats it for the duration of the interval.
+"""
+import subprocess
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from moviepy import ImageClip
+from moviepy.config import FFMPEG_BINARY
+
+from backend.combination.profiles import resolve_profile, video_codec_args
+
+
+def is_static_clip(clip: Any) -> bool:
+    """
+    Returns True if every frame of the clip is the same (photos and subtitle sprites).
+    """
+    return isinstance(clip, ImageClip)
+
+
+def find_still_intervals(layers: List[Any], duration: float, compositor: Any = None) -> List[Tuple[float, float]]:
+    """
+    Finds the time intervals in which every visible layer is static.
+
+    Parameters:
+    - layers (List): All leaf clips of the timeline (backgrounds, overlays, GIFs and subtitle cues) with start/end set.
+    - duration (float): Duration of the final video.
+    - compositor (Compositor): Optional. If given its visibility plan is used, so moving layers that are hidden
+      behind opaque layers do not make an interval moving.
+
+    Returns:
+    - List[Tuple[float, float]]: Sorted, non-overlapping (start, end) intervals in seconds.
+    """
+    if compositor is not None:
+        intervals = []
+        for start, end, drawn in compositor.plan:
+            if start < duration and all(is_static_clip(compositor.layers[index]) for index in drawn):
+                intervals.append((start, min(end, duration)))
+        return intervals
+
+    spans = []
+    for layer in layers:
+        start = layer.start or 0
+        end = layer.end if layer.end is not None else duration
+        if end > start and start < duration:
+            spans.append((start, min(end, duration), is_static_clip(layer)))
+
+    breakpoints = sorted({0, duration} | {t for start, end, _ in spans for t in (start, end)})
+    intervals = []
+    for start, end in zip(breakpoints[:-1], breakpoints[1:]):
+        visible = [static for span_start, span_end, static in spans if span_start < end and span_end > start]
+        if all(visible):
+            intervals.append((start, end))
+    return intervals
+
+
+def encode_still_segment(frame: np.ndarray, n_frames: int, fps: float, segment_path: str, profile: Dict[str, Any] = None) -> str:
+    """
+    Encodes a single composed frame repeated n_frames times. The frame is sent to ffmpeg once and repeated
+    with the loop filter, so Python does no per-frame work.
+    """
+    height, width = frame.shape[:2]
+    profile = profile or resolve_profile(None)
+    cmd = [
+        FFMPEG_BINARY, '-y', '-loglevel', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f"{width}x{height}", '-r', str(fps), '-i', '-',
+        '-vf', f"loop=loop={n_frames - 1}:size=1:start=0",
+        '-frames:v', str(n_frames), *video_codec_args(profile), '-r', str(fps), segment_path,
+    ]
+    subprocess.run(cmd, input=np.ascontiguousarray(frame[:, :, :3], dtype=np.uint8).tobytes(), check=True, capture_output=True)
+    return segment_path
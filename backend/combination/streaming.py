@@ -0,0 +1,244 @@
+"""
+Bounded-memory streaming render engine.
+
+Frames are composed one by one in this thread, pass through a fixed-size buffer and are written by a
+second thread to ffmpeg's stdin. Only the buffered frames and the open clip readers are held in memory.
+With a memory cap the buffer shrinks and idle clip readers are released whenever the process grows over the cap.
+"""
+import logging
+import math
+import os
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+from moviepy.config import FFMPEG_BINARY
+
+from backend import tracing
+from backend.combination.formats import make_frame_transform
+from backend.combination.profiles import resolve_profile, video_codec_args
+
+DEFAULT_BUFFER_FRAMES = 16
+
+
+class FrameBuffer:
+    """
+    Thread-safe FIFO of frames with a capacity that can be lowered while frames flow through it.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self._frames = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def put(self, frame) -> None:
+        with self._condition:
+            while len(self._frames) >= self.capacity and not self._closed:
+                self._condition.wait()
+            self._frames.append(frame)
+            self._condition.notify_all()
+
+    def get(self):
+        with self._condition:
+            while not self._frames:
+                self._condition.wait()
+            frame = self._frames.popleft()
+            self._condition.notify_all()
+            return frame
+
+    def shrink(self) -> int:
+        with self._condition:
+            self.capacity = max(1, self.capacity // 2)
+            return self.capacity
+
+    def close(self) -> None:
+        """
+        Unblocks a producer waiting for space (used when the consumer fails).
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+def current_rss_bytes() -> int:
+    """
+    Returns the resident set size of this process in bytes.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        # No procfs (e.g. macOS): fall back to the peak RSS, reported in bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def iter_leaf_clips(clip: Any) -> Iterator[Any]:
+    """
+    Yields all non-composite clips inside a (nested) composite clip.
+    """
+    children = getattr(clip, 'clips', None)
+    if children:
+        for child in children:
+            yield from iter_leaf_clips(child)
+    else:
+        yield clip
+
+
+def release_reader(clip: Any) -> None:
+    """
+    Closes the ffmpeg reader of a file based clip. MoviePy reopens a closed reader on the next get_frame,
+    so this only frees the subprocess and its buffers.
+    """
+    reader = getattr(clip, 'reader', None)
+    if reader is not None and getattr(reader, 'proc', None) is not None:
+        reader.close()
+
+
+def _write_frames(buffer: FrameBuffer, stdin, errors: List[BaseException]) -> None:
+    try:
+        while True:
+            frame = buffer.get()
+            if frame is None:
+                break
+            stdin.write(frame)
+    except BaseException as e:
+        errors.append(e)
+        buffer.close()
+
+
+class EncoderPipe:
+    """
+    One ffmpeg libx264 process fed with raw RGB frames from a FrameBuffer by a writer thread.
+    """
+
+    def __init__(self, output_path: str, size, fps: float, profile: Dict[str, Any], threads: int, capacity: int):
+        width, height = size
+        cmd = [
+            FFMPEG_BINARY, '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f"{width}x{height}", '-r', str(fps), '-i', '-',
+            *video_codec_args(profile), '-r', str(fps),
+        ]
+        if threads:
+            cmd += ['-threads', str(threads)]
+        cmd.append(output_path)
+
+        self.output_path = output_path
+        self.buffer = FrameBuffer(capacity)
+        self.errors = []
+        self.stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=self.stderr)
+        self.writer = threading.Thread(target=_write_frames, args=(self.buffer, self.process.stdin, self.errors), daemon=True)
+        self.writer.start()
+
+    def finish(self) -> None:
+        """
+        Flushes the buffer, waits for ffmpeg and raises an IOError if encoding failed.
+        """
+        self.buffer.put(None)
+        self.writer.join()
+        try:
+            try:
+                self.process.stdin.close()
+            except OSError as e:
+                # Broken pipe, ffmpeg exited early; the writer thread usually recorded the same error
+                self.errors.append(e)
+            self.process.wait()
+            if self.errors or self.process.returncode != 0:
+                self.stderr.seek(0)
+                message = self.stderr.read().decode('utf-8', errors='replace')
+                raise IOError(f"ffmpeg failed to encode '{self.output_path}': {message or self.errors}")
+        finally:
+            # Never leave a zombie ffmpeg or an open stderr file behind, also when closing stdin failed
+            self.process.wait()
+            self.stderr.close()
+
+
+def stream_frames(clip: Any, segment_paths: List[str], start: float, end: float, fps: float, profile: Dict[str, Any] = None,
+                  threads: int = None, max_memory_mb: int = None, buffer_frames: int = DEFAULT_BUFFER_FRAMES,
+                  formats: List[Dict[str, Any]] = None) -> List[str]:
+    """
+    Encodes the video (without audio) of [start, end) of clip by streaming raw frames into ffmpeg.
+
+    Every frame is composed once; with several output formats it is converted to each format
+    and sent to one encoder per format.
+
+    Parameters:
+    - clip: Clip to render, in timeline time.
+    - segment_paths (List[str]): Output file per format.
+    - start (float), end (float): Time range to render in seconds.
+    - fps (float): Output frame rate.
+    - profile (Dict), threads (int): libx264 settings (see profiles.py). Defaults to the default profile.
+    - max_memory_mb (int): Memory cap for this process. When the resident size grows over it the frame
+      buffers are halved and readers of layers that are not on screen are released.
+    - buffer_frames (int): Maximum number of composed frames waiting for each encoder.
+    - formats (List[Dict]): Output format per segment path (see formats.py). None renders the clip as it is.
+
+    Returns:
+    - List[str]: segment_paths.
+    """
+    formats = formats or [None] * len(segment_paths)
+    profile = profile or resolve_profile(None)
+    transforms = [make_frame_transform(clip.size, fmt) for fmt in formats]
+    sizes = [fmt['size'] if fmt else tuple(clip.size) for fmt in formats]
+    frame_bytes = sum(width * height * 3 for width, height in sizes)
+    n_frames = max(1, math.ceil((end - start) * fps - 1e-6))
+    max_memory = max_memory_mb * 1024 * 1024 if max_memory_mb else None
+
+    capacity = buffer_frames
+    if max_memory:
+        capacity = min(capacity, (max_memory - current_rss_bytes()) // frame_bytes)
+        if capacity < 1:
+            logging.warning(f"Process already uses more than the memory cap of {max_memory_mb} MB, rendering with a single frame buffer")
+
+    # Readers of layers whose time window has passed are released as soon as the render moves beyond them
+    file_layers = sorted((leaf for leaf in iter_leaf_clips(clip) if getattr(leaf, 'reader', None) is not None),
+                         key=lambda leaf: leaf.end if leaf.end is not None else math.inf)
+
+    with tracing.span('encode segment', start=start, end=end, frames=n_frames, outputs=len(segment_paths)):
+        timed = tracing.is_enabled()
+        encoders = [EncoderPipe(path, size, fps, profile, threads, capacity) for path, size in zip(segment_paths, sizes)]
+        try:
+            for index in range(n_frames):
+                t = start + index / fps
+                while file_layers and file_layers[0].end is not None and file_layers[0].end <= t:
+                    release_reader(file_layers.pop(0))
+
+                if max_memory and index % max(1, int(fps)) == 0 and current_rss_bytes() > max_memory:
+                    new_capacity = min(encoder.buffer.shrink() for encoder in encoders)
+                    for leaf in file_layers:
+                        if not leaf.is_playing(t):
+                            release_reader(leaf)
+                    logging.info(f"Memory cap of {max_memory_mb} MB reached, frame buffer lowered to {new_capacity} frames")
+
+                frame = np.ascontiguousarray(clip.get_frame(t)[:, :, :3], dtype=np.uint8)
+                if any(encoder.errors for encoder in encoders):
+                    break
+                for encoder, transform in zip(encoders, transforms):
+                    started = time.perf_counter()
+                    output_frame = transform(frame) if transform else frame
+                    converted = time.perf_counter()
+                    encoder.buffer.put(output_frame.tobytes())
+                    if timed:
+                        # Time blocked on a full buffer is time x264 is behind the compositor
+                        tracing.add('format transform', converted - started)
+                        tracing.add('wait for encoder', time.perf_counter() - converted)
+        finally:
+            failures = []
+            with tracing.span('flush encoders', outputs=len(encoders)):
+                for encoder in encoders:
+                    try:
+                        encoder.finish()
+                    except IOError as e:
+                        failures.append(e)
+            if failures:
+                raise failures[0]
+
+    # Per-frame timings of this segment become one trace event each
+    tracing.flush_totals(start=start, end=end)
+    return segment_paths
@@ -0,0 +1,141 @@
+"""
+Pre-rasterized subtitle sprites.
+
+Every subtitle cue is rendered once into an RGBA sprite (font load, caption layout and stroke happen only then).
+Sprites are kept in an in-memory LRU keyed by text and style, and optionally on disk, so composing a subtitle
+into a frame is a plain array blit.
+"""
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, List
+
+import numpy as np
+from moviepy import ImageClip, TextClip
+from moviepy.video.tools.subtitles import file_to_subtitles
+from PIL import ImageFont
+
+from backend import tracing
+from backend.cache import file_digest, get_cache_dir, touch
+
+
+class SubtitleSpriteCache:
+    """
+    LRU cache of rasterized subtitle sprites (HxWx4 uint8 RGBA arrays).
+
+    Parameters:
+    - max_items (int): Number of sprites kept in memory.
+    - max_bytes (int): Total size of the sprites kept in memory.
+    - disk_cache (bool): Also store sprites in the shared cache folder, so they survive between processes.
+    """
+
+    def __init__(self, max_items: int = 1024, max_bytes: int = 128 * 1024 * 1024, disk_cache: bool = False):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.disk_dir = get_cache_dir('subtitles') if disk_cache else None
+        self._sprites = OrderedDict()
+        self._bytes = 0
+
+    def get(self, text: str, font: str, font_size: int, width: int, color: str = 'white',
+            stroke_color: str = 'black', stroke_width: int = 2) -> np.ndarray:
+        """
+        Returns the RGBA sprite for text in the given style, rasterizing it on a cache miss.
+        """
+        font_key = file_digest(font) if Path(font).exists() else font
+        key = (text, font_key, font_size, width, color, stroke_color, stroke_width)
+        sprite = self._sprites.get(key)
+        if sprite is not None:
+            self._sprites.move_to_end(key)
+            return sprite
+
+        disk_path = None
+        if self.disk_dir is not None:
+            disk_path = self.disk_dir / f"{hashlib.sha256(repr(key).encode('utf-8')).hexdigest()}.npy"
+            if disk_path.exists():
+                try:
+                    sprite = np.load(disk_path)
+                    touch(disk_path)
+                except Exception as e:
+                    logging.warning(f"Could not read cached subtitle sprite '{disk_path.name}': {e}")
+
+        if sprite is None:
+            with tracing.span('rasterize subtitle', 'assets', characters=len(text)):
+                sprite = rasterize_text(text, font, font_size, width, color, stroke_color, stroke_width)
+            if disk_path is not None:
+                temp_path = disk_path.with_name(f"{disk_path.stem}.{os.getpid()}.tmp")
+                with open(temp_path, 'wb') as f:
+                    np.save(f, sprite)
+                os.replace(temp_path, disk_path)
+
+        self._sprites[key] = sprite
+        self._bytes += sprite.nbytes
+        while len(self._sprites) > 1 and (len(self._sprites) > self.max_items or self._bytes > self.max_bytes):
+            self._bytes -= self._sprites.popitem(last=False)[1].nbytes
+        return sprite
+
+
+def resolve_font(font: str) -> str:
+    """
+    Returns font if the font file exists. Otherwise logs a warning and returns Pillow's built-in TrueType font
+    (Latin only), written once to the shared cache folder, so subtitles still render on a checkout without the fonts.
+    """
+    if Path(font).exists():
+        return font
+    fallback_path = get_cache_dir('fonts') / 'pillow_default.ttf'
+    if not fallback_path.exists():
+        temp_path = fallback_path.with_name(f"{fallback_path.name}.{os.getpid()}.tmp")
+        temp_path.write_bytes(ImageFont.load_default(size=72).font_bytes)
+        os.replace(temp_path, fallback_path)
+    logging.warning(f"Font '{font}' not found, using Pillow's default font for the subtitles")
+    return str(fallback_path)
+
+
+def rasterize_text(text: str, font: str, font_size: int, width: int, color: str = 'white',
+                   stroke_color: str = 'black', stroke_width: int = 2) -> np.ndarray:
+    """
+    Renders text as a caption of the given width and returns it as an RGBA uint8 array.
+    """
+    text_clip = TextClip(font=font, text=text, font_size=font_size, color=color, method='caption',
+                         size=(width, None), stroke_color=stroke_color, stroke_width=stroke_width)
+    rgb = text_clip.get_frame(0)
+    alpha = np.round(text_clip.mask.get_frame(0) * 255)
+    text_clip.close()
+    return np.dstack([rgb, alpha]).astype(np.uint8)
+
+
+_default_cache = SubtitleSpriteCache(disk_cache=os.getenv('ADFLOWGEN_SUBTITLE_DISK_CACHE', '0') == '1')
+
+
+def make_subtitle_clips(srt_path, font: str, font_size: int, width: int, position=("center", "bottom"), stroke_width: int = 2,
+                        cache: SubtitleSpriteCache = None, encoding: str = 'utf-8', until: float = None) -> List[Any]:
+    """
+    Creates one ImageClip per cue of an .srt file, built from cached sprites.
+
+    Parameters:
+    - srt_path: Path to the .srt file.
+    - font (str): Path to the font file.
+    - font_size (int): Font size of the subtitles.
+    - width (int): Caption width in pixels; text is wrapped to this width.
+    - position: Position of the cues on the canvas.
+    - stroke_width (int): Width of the black text border.
+    - cache (SubtitleSpriteCache): Sprite cache to use. Defaults to the process wide cache.
+    - until (float): End of the video. Cues starting at or after it are not rasterized, cues running past it end there.
+
+    Returns:
+    - List of clips with start, end and position set.
+    """
+    cache = cache or _default_cache
+    clips = []
+    for (start, end), text in file_to_subtitles(str(srt_path), encoding=encoding):
+        if until is not None:
+            if start >= until:
+                continue
+            end = min(end, until)
+        if not text.strip() or end <= start:
+            continue
+        sprite = cache.get(text, font, font_size, width, stroke_width=stroke_width)
+        clip = ImageClip(sprite, transparent=True).with_start(start).with_end(end).with_position(position)
+        clips.append(clip)
+    return clips
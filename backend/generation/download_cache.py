@@ -0,0 +1,177 @@
+"""
+Shared download cache for generated assets.
+
+Files downloaded from a URL (Wikimedia images, Pexels and Unsplash photos, GIFs) are stored once in the shared
+cache folder, named by the sha256 of their content. A small JSON entry per URL records which content it
+served, with its ETag and Last-Modified headers. Within DOWNLOAD_MAX_AGE_SECONDS a cached URL is used without
+asking the server; after that it is revalidated with a conditional request, and a '304 Not Modified' answer
+costs no download. Campaign folders get a hardlink to the cached file (a copy on file systems without
+hardlinks), so re-running a campaign or rendering the same topic in another language barely touches the network.
+
+Cached files are made read-only, which stops accidental writes through a hardlink but not root or anyone who can
+chmod them. Modification is detected rather than prevented: the size and mtime of a cached file are recorded in its
+entry every time it is used, and its digest is checked again whenever they change, so a cached file that was written
+to in place is downloaded again instead of being handed to other campaigns.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import requests
+
+from backend import tracing
+from backend.cache import evict_lru, file_digest, get_cache_dir, touch
+from backend.generation.http_session import get_session
+
+DOWNLOAD_CACHE_VERSION = 1
+DOWNLOAD_CACHE_MAX_BYTES = int(os.getenv('ADFLOWGEN_DOWNLOAD_CACHE_MB', 4096)) * 1024 * 1024
+# Cached URLs younger than this are used without revalidating them
+DOWNLOAD_MAX_AGE_SECONDS = float(os.getenv('ADFLOWGEN_DOWNLOAD_MAX_AGE_HOURS', 24 * 7)) * 3600
+
+
+def url_key(url: str) -> str:
+    """
+    Returns the name of the cache entry of a URL.
+    """
+    return hashlib.sha256(f"{url}_v{DOWNLOAD_CACHE_VERSION}".encode('utf-8')).hexdigest()
+
+
+def _read_entry(entry_path: Path) -> Optional[Dict[str, Any]]:
+    try:
+        with open(entry_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_entry(entry_path: Path, entry: Dict[str, Any]) -> None:
+    temp_path = entry_path.with_name(f"{entry_path.name}.{threading.get_ident()}.{os.getpid()}.tmp")
+    with open(temp_path, 'w') as f:
+        json.dump(entry, f, indent=4)
+    os.replace(temp_path, entry_path)
+
+
+def _is_intact(blob_path: Path, entry: Dict[str, Any]) -> bool:
+    """
+    Checks that a cached file still holds the content of its entry. Only hashes it when its size or mtime
+    changed since it was last used through this entry.
+    """
+    stat = blob_path.stat()
+    if stat.st_size == entry.get('size') and stat.st_mtime_ns == entry.get('verified_mtime_ns'):
+        return True
+    return file_digest(blob_path) == entry['digest']
+
+
+def _mark_used(blob_path: Path, entry_path: Path, entry: Dict[str, Any]) -> None:
+    # The new mtime of the cached file is recorded, so the next use does not hash it again
+    touch(blob_path)
+    entry['verified_mtime_ns'] = blob_path.stat().st_mtime_ns
+    _write_entry(entry_path, entry)
+
+
+def link_or_copy(source: Path, output_path: Path) -> None:
+    """
+    Places source at output_path as a hardlink, or as a copy when hardlinks are not possible (e.g. another drive).
+    """
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    if output_path.exists() or output_path.is_symlink():
+        if output_path.samefile(source):
+            return
+        output_path.unlink()
+    try:
+        os.link(source, output_path)
+    except OSError:
+        shutil.copyfile(source, output_path)
+
+
+def cached_download(url: str, output_path, headers: Dict[str, str] = None) -> Path:
+    """
+    Downloads url to output_path through the shared download cache.
+
+    Parameters:
+    - url (str): URL of the file.
+    - output_path: Path the file is placed at (usually inside a campaign folder).
+    - headers (Dict[str, str]): Extra request headers, e.g. an API key.
+
+    Returns:
+    - Path: output_path.
+
+    Raises requests.HTTPError when the server answers with an error and nothing is cached for the URL.
+    If the server cannot be reached (or fails) while revalidating, the cached copy is used; a URL that
+    is gone (404, 410) raises.
+    """
+    output_path = Path(output_path)
+    cache_dir = get_cache_dir('downloads')
+    key = url_key(url)
+    entry_path = cache_dir / f"{key}.json"
+    entry = _read_entry(entry_path)
+    blob_path = cache_dir / entry['digest'] if entry else None
+    if blob_path is not None and not blob_path.exists():
+        # The content was evicted, download it again
+        entry, blob_path = None, None
+    elif blob_path is not None and not _is_intact(blob_path, entry):
+        # Written to through one of its hardlinks, the content no longer matches the URL
+        logging.warning(f"Cached download of '{url}' was modified, downloading it again")
+        blob_path.unlink(missing_ok=True)
+        entry, blob_path = None, None
+
+    if entry and time.time() - entry['checked_at'] < DOWNLOAD_MAX_AGE_SECONDS:
+        _mark_used(blob_path, entry_path, entry)
+        link_or_copy(blob_path, output_path)
+        logging.info(f"Using cached download of '{url}'")
+        return output_path
+
+    request_headers = dict(headers or {})
+    if entry and entry.get('etag'):
+        request_headers['If-None-Match'] = entry['etag']
+    if entry and entry.get('last_modified'):
+        request_headers['If-Modified-Since'] = entry['last_modified']
+
+    temp_path = cache_dir / f"{key}.{threading.get_ident()}.{os.getpid()}.tmp"
+    try:
+        with tracing.span('download', 'generation', url=url):
+            with get_session().get(url, headers=request_headers, stream=True) as response:
+                if entry and response.status_code == 304:
+                    logging.info(f"Cached download of '{url}' is still up to date")
+                else:
+                    response.raise_for_status()
+                    sha = hashlib.sha256()
+                    size = 0
+                    with open(temp_path, 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=1024 * 1024):
+                            sha.update(chunk)
+                            size += len(chunk)
+                            f.write(chunk)
+                    digest = sha.hexdigest()
+                    blob_path = cache_dir / digest
+                    # Identical content downloaded from another URL (or by another process) is stored only once
+                    if blob_path.exists():
+                        temp_path.unlink()
+                    else:
+                        os.chmod(temp_path, 0o444)
+                        os.replace(temp_path, blob_path)
+                    entry = {'url': url, 'digest': digest, 'size': size, 'content_type': response.headers.get('Content-Type')}
+                    logging.info(f"Downloaded '{url}' ({size / 1024:.0f} KB)")
+                entry['etag'] = response.headers.get('ETag', entry.get('etag'))
+                entry['last_modified'] = response.headers.get('Last-Modified', entry.get('last_modified'))
+    except requests.RequestException as e:
+        temp_path.unlink(missing_ok=True)
+        gone = isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code in (404, 410)
+        if entry is None or gone:
+            raise
+        logging.warning(f"Could not revalidate '{url}', using the cached copy: {e}")
+    except Exception:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+    entry['checked_at'] = time.time()
+    _mark_used(blob_path, entry_path, entry)
+    link_or_copy(blob_path, output_path)
+    evict_lru(cache_dir, DOWNLOAD_CACHE_MAX_BYTES)
+    return output_path
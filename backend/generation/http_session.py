@@ -0,0 +1,109 @@
+"""
+Shared HTTP session for the generation modules.
+
+All downloads and API calls of the generators go through one requests.Session, so connections to the same host
+(Wikimedia, Pexels, Unsplash, Giphy, Google APIs) are kept alive and reused instead of opening a new TCP/TLS
+connection per request. The session retries connection errors and 429/5xx answers with an exponential backoff
+(honouring Retry-After), applies connect/read timeouts to every request, and counts the requests, bytes and
+latency per host. Use get_session() instead of calling requests.get directly.
+"""
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Seconds to wait for a connection and for every read from it
+HTTP_CONNECT_TIMEOUT = float(os.getenv('ADFLOWGEN_HTTP_CONNECT_TIMEOUT', 10))
+HTTP_READ_TIMEOUT = float(os.getenv('ADFLOWGEN_HTTP_READ_TIMEOUT', 60))
+HTTP_RETRIES = int(os.getenv('ADFLOWGEN_HTTP_RETRIES', 4))
+HTTP_BACKOFF_SECONDS = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Connections kept open per host; matches the number of assets generated at the same time
+HTTP_POOL_SIZE = 16
+
+_session = None
+_session_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = defaultdict(lambda: {'requests': 0, 'errors': 0, 'retries': 0, 'bytes': 0, 'seconds': 0.0})
+
+
+class GenerationSession(requests.Session):
+    """
+    requests.Session with default timeouts and per host counters.
+    """
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+        return super().request(method, url, **kwargs)
+
+    def send(self, request, **kwargs):
+        host = urlparse(request.url).netloc
+        started = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+        except requests.RequestException:
+            _record(host, time.perf_counter() - started, error=True)
+            raise
+        if kwargs.get('stream'):
+            # The body is read later by the caller, count the announced size
+            size = int(response.headers.get('Content-Length') or 0)
+        else:
+            size = len(response.content)
+        retries = getattr(response.raw, 'retries', None)
+        _record(host, time.perf_counter() - started, error=response.status_code >= 400, size=size,
+                retries=len(retries.history) if retries is not None else 0)
+        return response
+
+
+def _record(host: str, seconds: float, error: bool = False, size: int = 0, retries: int = 0) -> None:
+    with _stats_lock:
+        stats = _stats[host]
+        stats['requests'] += 1
+        stats['errors'] += int(error)
+        stats['retries'] += retries
+        stats['bytes'] += size
+        stats['seconds'] += seconds
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the session shared by all generation modules (created on first use).
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=HTTP_RETRIES, backoff_factor=HTTP_BACKOFF_SECONDS, status_forcelist=RETRY_STATUSES,
+                          allowed_methods=['HEAD', 'GET', 'OPTIONS'], respect_retry_after_header=True, raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+            session = GenerationSession()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+def http_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Returns the counters per host: requests, errors (4xx/5xx answers and failed connections), retries,
+    bytes and the total seconds spent waiting.
+    """
+    with _stats_lock:
+        return {host: dict(stats) for host, stats in _stats.items()}
+
+
+def log_http_stats() -> None:
+    """
+    Logs the counters per host.
+    """
+    for host, stats in sorted(http_stats().items()):
+        average_ms = stats['seconds'] / stats['requests'] * 1000 if stats['requests'] else 0
+        logging.info(f"{host}: {stats['requests']} requests ({stats['errors']} failed, {stats['retries']} retries), "
+                     f"{stats['bytes'] / 1024 / 1024:.1f} MB, {average_ms:.0f} ms average")
+
@@ -1,13 +1,19 @@
 import os
 import json
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List
 import logging
 import shutil
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
 
 from .stock_media import download_stock_video, download_stock_image_pexels, download_stock_image_unsplash, download_gif
 from .voiceover import generate_voiceover
 from .other import download_website_screenshot, gather_random_image_from_stlib
+from .download_cache import cached_download
+from .http_session import log_http_stats
+from backend import tracing
 
 
 def load_config(asset_folder: str) -> Dict[str, Any]:
@@ -25,27 +31,116 @@ def load_config(asset_folder: str) -> Dict[str, Any]:
     
     return config
 
-def generate_assets(asset_folder: str):
+# Maximum number of concurrent requests per provider. Override per campaign with 'generation_concurrency'
+# in the general configs, e.g. {"wikimedia": 8, "elevenlabs": 1}
+DEFAULT_PROVIDER_LIMITS = {
+    'wikimedia': 4,
+    'web': 8,
+    'pexels': 2,
+    'unsplash': 2,
+    'youtube': 2,
+    'giphy': 2,
+    'elevenlabs': 1,
+    'screenshotlayer': 1,
+    'local': 8,
+}
+DEFAULT_GENERATION_WORKERS = 16
+
+
+def asset_provider(asset: Dict[str, Any]) -> str:
+    """
+    Returns the provider an asset is fetched from, which decides its concurrency limit.
+    """
+    generation_method = asset.get('generation_method')
+    if generation_method in ('direct_image_url', 'from_url'):
+        host = urlparse(asset.get('src') or asset.get('url') or '').netloc
+        return 'wikimedia' if host.endswith(('wikimedia.org', 'wikipedia.org')) else 'web'
+    return {
+        'stock_video': 'youtube',
+        'stock_photo': 'pexels',
+        'website_picture': 'screenshotlayer',
+        'voice': 'elevenlabs',
+        'generate_voiceover': 'elevenlabs',
+        'generate_gif_animation': 'giphy',
+    }.get(generation_method, 'local')
+
+
+def generate_assets(asset_folder: str, max_workers: int = None):
     """
     Generates or downloads assets as specified in the config.json in the asset folder.
+
+    Assets are independent of each other, so they are generated concurrently in a thread pool. The number of
+    concurrent requests per provider (Wikimedia, Pexels, YouTube, ElevenLabs, ...) is capped by
+    DEFAULT_PROVIDER_LIMITS, overridden by 'generation_concurrency' in the general configs. An asset is only
+    handed to the pool once its provider has a free slot, so assets of a busy provider never hold pool threads
+    that other providers could use.
+
+    Parameters:
+    - asset_folder (str): Campaign folder with the config.json.
+    - max_workers (int): Maximum number of assets generated at the same time. Defaults to
+      'generation_workers' in the general configs, or DEFAULT_GENERATION_WORKERS.
     """
     config = load_config(asset_folder)
     assets = config.get('assets', [])
     asset_path = Path(asset_folder)
-    
-    # List to hold additional entries to config.json
+    general_configs = config.get('general', {})
+    limits = {**DEFAULT_PROVIDER_LIMITS, **general_configs.get('generation_concurrency', {})}
+    max_workers = max(1, max_workers or general_configs.get('generation_workers', DEFAULT_GENERATION_WORKERS))
+
+    # Indices of the assets that still have to be submitted, per provider, in config order
+    queued = defaultdict(deque)
+    for index, asset in enumerate(assets):
+        queued[asset_provider(asset)].append(index)
+    running = {}
+    active = defaultdict(int)
+    results = [[] for _ in assets]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(assets) or 1), thread_name_prefix='generate') as executor:
+        while queued or running:
+            for provider in list(queued):
+                queue = queued[provider]
+                while queue and active[provider] < max(1, limits.get(provider, 1)) and len(running) < max_workers:
+                    index = queue.popleft()
+                    running[executor.submit(generate_asset, assets[index], asset_path)] = (index, provider)
+                    active[provider] += 1
+                if not queue:
+                    del queued[provider]
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, provider = running.pop(future)
+                active[provider] -= 1
+                results[index] = future.result()
+
+    # Results are collected in config order, so the config.json rewrite does not depend on which asset finished first
+    additional_entries = [entry for entries in results for entry in entries]
+    # Requests, bytes and latency per host since the process started
+    log_http_stats()
+
+    # Update the config.json with additional entries after all assets are generated
+    if additional_entries:
+        config['assets'].extend(additional_entries)
+        updated_config_path = Path(asset_folder) / 'config.json'
+        with open(updated_config_path, 'w') as config_file:
+            json.dump(config, config_file, indent=4)
+        logging.info(f"Updated config.json with additional entries: {additional_entries}")
+
+
+def generate_asset(asset: Dict[str, Any], asset_path: Path) -> List[Dict[str, Any]]:
+    """
+    Generates or downloads a single asset. Returns the entries to add to config.json for files it created.
+    """
     additional_entries = []
-    
-    for asset in assets:
-        generation_method = asset.get('generation_method')
-        filename = asset.get('filename')
-        if filename:
-            output_file = asset_path / filename
-        
+    generation_method = asset.get('generation_method')
+    filename = asset.get('filename')
+    if filename:
+        output_file = asset_path / filename
+
+    with tracing.span(f"generate {generation_method}", 'generation', file=filename):
         if generation_method == 'stock_video':
             # Download stock video
             logging.info(f"Downloading stock video '{filename}'...")
-            download_stock_video(filename=filename, output_folder=asset_path, search_term=asset.get('search_term'))
+            download_stock_video(filename=filename, output_folder=asset_path, search_term=asset.get('search_term'),
+                                 max_seconds=asset.get('max_seconds'))
         elif generation_method == 'stock_photo':
             # Download stock image
             logging.info(f"Downloading stock image '{filename}'...")
@@ -73,12 +168,14 @@ def generate_assets(asset_folder: str):
             logging.info(f"Getting asset from stlib '{filename}'...")
             # copy from assets/stlib to asset_path
             stlib_filepath = Path("assets/stlib") / filename
+            # Replace instead of overwrite: a file from an earlier run may be a hardlink into the download cache
+            output_file.unlink(missing_ok=True)
             shutil.copy(stlib_filepath, output_file)
         elif generation_method == 'generate_voiceover':
             # Generate voiceover and additional subtitle
             voiceover_text = asset.get('voiceover_text', 'Default voiceover text.')
             logging.info(f"Generating voiceover '{filename}'...")
-            
+
             # Base filename for voiceover files
             base_filename = "voiceover"
             audio_file = f"{base_filename}.mp3"
@@ -86,21 +183,18 @@ def generate_assets(asset_folder: str):
 
             # Generate the voiceover files
             generate_voiceover(voiceover_text=voiceover_text, output_folder=asset_path, filename_base=base_filename)
-            
+
             # Add generated audio and subtitle files to additional entries
             additional_entries.append({"asset_type": "audio", "filename": audio_file})
             additional_entries.append({"asset_type": "subtitle", "filename": subtitle_file})
-            
-        elif generation_method == 'direct_image_url':
-            # Download an image from a direct URL
-            image_url = asset.get('src')
+
+        elif generation_method in ('direct_image_url', 'from_url'):
+            # Download an image from a direct URL ('from_url' entries of the wiki generator keep it in 'url')
+            image_url = asset.get('src') or asset.get('url')
             logging.info(f"Downloading image from URL: {image_url}")
             try:
-                import requests
-                response = requests.get(image_url, stream=True)
-                response.raise_for_status()  # Raise an error for bad responses
-                with open(output_file, 'wb') as f:
-                    shutil.copyfileobj(response.raw, f)
+                # Wikimedia images are shared by the language versions of a topic, so they come from the download cache
+                cached_download(image_url, output_file)
                 logging.info(f"Downloaded image saved as: {output_file}")
             except Exception as e:
                 logging.error(f"Failed to download image from URL '{image_url}': {e}")
@@ -108,11 +202,5 @@ def generate_assets(asset_folder: str):
             raise NotImplementedError("Subtitle generation from existing audio is not yet implemented.")
         else:
             logging.warning(f"Unknown generation method '{generation_method}'. Skipping.")
-            
-    # Update the config.json with additional entries after the loop
-    if additional_entries:
-        config['assets'].extend(additional_entries)
-        updated_config_path = Path(asset_folder) / 'config.json'
-        with open(updated_config_path, 'w') as config_file:
-            json.dump(config, config_file, indent=4)
-        logging.info(f"Updated config.json with additional entries: {additional_entries}")
\ No newline at end of file
+
+    return additional_entries
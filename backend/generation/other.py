@@ -7,13 +7,14 @@
 #     & viewport = 1440x900
 #     & width = 250
 
-import requests
 from pathlib import Path
 import logging
 import os
 import shutil
 import random
 
+from backend.generation.http_session import get_session
+
 def download_website_screenshot(website_url: str, output_folder: str = ".", filename: str = "screenshot.png", viewport: str = "1024x768") -> None:
     """
     Downloads a screenshot of the specified website using the ScreenshotLayer API and saves it to the specified filename.
@@ -49,11 +50,12 @@ def download_website_screenshot(website_url: str, output_folder: str = ".", file
 
     try:
         # Make the API request to capture the screenshot
-        response = requests.get(api_url, params=params, stream=True)
+        response = get_session().get(api_url, params=params, stream=True)
         if response.status_code == 200:
             # Save the screenshot to the specified file
             output_path = Path(output_folder) / filename
             output_path.parent.mkdir(parents=True, exist_ok=True)
+            output_path.unlink(missing_ok=True)
             with open(output_path, 'wb') as f:
                 for chunk in response.iter_content(chunk_size=8192):
                     f.write(chunk)
@@ -78,6 +80,8 @@ def gather_random_image_from_stlib(input_folder, filename, output_folder):
     random_image = random.choice(stlib_images)
     output_path = Path(output_folder) / filename
     output_path.parent.mkdir(parents=True, exist_ok=True)
+    # Replace instead of overwrite: a file from an earlier run may be a hardlink into the download cache
+    output_path.unlink(missing_ok=True)
     shutil.copy(random_image, output_path)
     logging.info(f"Random image copied to {output_path}")
     return output_path
\ No newline at end of file
@@ -0,0 +1,81 @@
+"""
+Persistent cache of search results (Pexels, Unsplash, YouTube).
+
+The same topics are rendered in many languages, so the generators search the stock APIs for the same
+terms over and over. Results are stored in a SQLite database in the shared cache folder, keyed by provider,
+query and search parameters, and reused until they are older than SEARCH_CACHE_TTL_SECONDS. A repeat run
+skips the search call and only spends rate limit on new queries.
+"""
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Callable, Dict, List
+
+from backend.cache import get_cache_dir
+
+SEARCH_CACHE_TTL_SECONDS = float(os.getenv('ADFLOWGEN_SEARCH_CACHE_TTL_HOURS', 24 * 7)) * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS searches (
+    provider TEXT NOT NULL,
+    query TEXT NOT NULL,
+    params TEXT NOT NULL,
+    results TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (provider, query, params)
+);
+"""
+
+
+def _connect() -> sqlite3.Connection:
+    # One short lived connection per call, searches run in the generation threads of several processes
+    db = sqlite3.connect(str(get_cache_dir('search') / 'search.db'), timeout=30, isolation_level=None)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.executescript(_SCHEMA)
+    return db
+
+
+def cached_search(provider: str, query: str, params: Dict[str, Any], search: Callable[[], List[Any]],
+                  ttl_seconds: float = None) -> List[Any]:
+    """
+    Returns the results of a search, from the cache if the same search was made within ttl_seconds.
+
+    Parameters:
+    - provider (str): Name of the searched service, e.g. 'pexels'.
+    - query (str): Search term.
+    - params (Dict[str, Any]): Other parameters that change the results (orientation, number of results, ...).
+      Must not contain API keys, they would be stored in the cache.
+    - search (Callable): Makes the search and returns a JSON serializable list of results. Called on a cache miss.
+      Empty results are not cached.
+    - ttl_seconds (float): Maximum age of cached results. Defaults to SEARCH_CACHE_TTL_SECONDS
+      (ADFLOWGEN_SEARCH_CACHE_TTL_HOURS, one week); 0 always searches.
+
+    Returns:
+    - List[Any]: The search results.
+    """
+    ttl_seconds = SEARCH_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+    params_key = json.dumps(params or {}, sort_keys=True)
+    db = _connect()
+    try:
+        row = db.execute('SELECT results, created FROM searches WHERE provider = ? AND query = ? AND params = ?',
+                         (provider, query, params_key)).fetchone()
+        if row is not None and time.time() - row[1] < ttl_seconds:
+            cached = json.loads(row[0])
+            # Empty results stored by older versions are searched again
+            if cached:
+                logging.info(f"Using cached {provider} results for '{query}'")
+                return cached
+
+        results = search()
+        if not results:
+            # An empty answer is often a transient provider problem, it must not block the query for the whole TTL
+            return results
+        db.execute('INSERT OR REPLACE INTO searches (provider, query, params, results, created) VALUES (?, ?, ?, ?, ?)',
+                   (provider, query, params_key, json.dumps(results), time.time()))
+        # Expired searches are only kept until the next write
+        db.execute('DELETE FROM searches WHERE created < ?', (time.time() - max(ttl_seconds, SEARCH_CACHE_TTL_SECONDS),))
+        return results
+    finally:
+        db.close()
@@ -9,7 +9,7 @@ Contents of the script:
 from backend.generation.voiceover import generate_voiceover
 from backend.generation.main import generate_assets
 from backend.generation.stock_media import download_images_bing
-import requests
+from backend.generation.http_session import get_session
 from bs4 import BeautifulSoup
 import re
 from openai import OpenAI
@@ -330,7 +330,8 @@ Only give the content of the script itself in {target_language}
     return response_json
     
 def scrape_wiki_page(wikipedia_url):
-    response = requests.get(wikipedia_url)
+    response = get_session().get(wikipedia_url)
+    response.raise_for_status()
     soup = BeautifulSoup(response.text, 'html.parser')
     
     # Extract all paragraphs
@@ -2,23 +2,35 @@ import requests
 from pathlib import Path
 import logging
 import os
+import subprocess
+import tempfile
 import traceback
 from pytubefix import YouTube
 from pytubefix.cli import on_progress
 from bing_image_downloader import downloader
+from moviepy.config import FFMPEG_BINARY
+
+from backend.cache import temp_prefix
+from backend.generation.download_cache import cached_download
+from backend.generation.http_session import get_session
+from backend.generation.search_cache import cached_search
+
+# Height of the output canvas (combine_assets renders 1920x1080); larger streams only cost download and decode time
+STOCK_VIDEO_MIN_HEIGHT = 1080
             
-def download_stock_video(filename: str, output_folder: str = ".", search_term: str = "") -> None:
+def download_stock_video(filename: str, output_folder: str = ".", search_term: str = "", max_seconds: float = None) -> None:
     """
     Downloads a sample stock video and saves it to the specified filename.
+    With max_seconds only the first max_seconds of the video are downloaded.
     """
     search_term = "stock video" + search_term
-    video_path = get_youtube_video_from_term(search_term, output_folder, filename)
+    video_path = get_youtube_video_from_term(search_term, output_folder, filename, max_seconds)
     logging.info(f"Downloaded video from search term: {search_term} to {video_path}")
             
-def get_youtube_video_from_term(search_term: str, output_folder: str, filename: str) -> str:
+def get_youtube_video_from_term(search_term: str, output_folder: str, filename: str, max_seconds: float = None) -> str:
     video_urls = search_youtube_videos(search_term, max_results=5)
     for url in video_urls:
-        success, video_path = download_youtube_video_from_url(url, output_folder, filename)
+        success, video_path = download_youtube_video_from_url(url, output_folder, filename, max_seconds)
         if success:
             return video_path
         else:
@@ -27,23 +39,113 @@ def get_youtube_video_from_term(search_term: str, output_folder: str, filename:
 def search_youtube_videos(search_term: str, max_results: int = 5) -> list:
     YOUTUBE_API_KEY = os.environ['YOUTUBE_API_KEY']
     search_url = f"https://www.googleapis.com/youtube/v3/search?part=snippet&maxResults={max_results}&q={search_term}&key={YOUTUBE_API_KEY}&type=video"
-    response = requests.get(search_url)
-    
-    if response.status_code != 200:
-        raise Exception(f"Failed to search YouTube videos: {response.text}")
-    else:
-        response_json = response.json()
-        video_ids = [item['id']['videoId'] for item in response_json['items']]
-        video_urls = [f"https://www.youtube.com/watch?v={video_id}" for video_id in video_ids]
-        return video_urls
+
+    def search() -> list:
+        response = get_session().get(search_url)
+        if response.status_code != 200:
+            raise Exception(f"Failed to search YouTube videos: {response.text}")
+        video_ids = [item['id']['videoId'] for item in response.json()['items']]
+        return [f"https://www.youtube.com/watch?v={video_id}" for video_id in video_ids]
+
+    # Searches for the same term are answered from the search cache, a search costs 100 units of the daily quota
+    return cached_search('youtube', search_term, {'max_results': max_results}, search)
         
-def download_youtube_video_from_url(url: str, output_folder: str, filename: str) -> tuple:
+def stream_height(stream) -> int:
+    """
+    Returns the height of a video stream from its resolution (e.g. '720p'), 0 if it has none (or for None).
+    """
+    return int(stream.resolution.rstrip('p')) if getattr(stream, 'resolution', None) else 0
+
+def pick_stream(streams, min_height: int = STOCK_VIDEO_MIN_HEIGHT):
+    """
+    Returns the smallest stream that is at least min_height high, or the highest stream if none is.
+    """
+    streams = sorted((stream for stream in streams if stream_height(stream)), key=stream_height)
+    if not streams:
+        return None
+    for stream in streams:
+        if stream_height(stream) >= min_height:
+            return stream
+    return streams[-1]
+
+def pick_streams(yt, min_height: int = STOCK_VIDEO_MIN_HEIGHT) -> list:
+    """
+    Picks the streams to download for a YouTube video: [progressive stream] or [video stream, audio stream].
+
+    Progressive streams (video and audio in one file) rarely go above 720p, so when none covers min_height,
+    the smallest H.264 video-only (adaptive) stream that does is used together with the best mp4 audio stream.
+    """
+    progressive = pick_stream(yt.streams.filter(progressive=True, file_extension='mp4'), min_height)
+    if progressive is not None and stream_height(progressive) >= min_height:
+        return [progressive]
+
+    # H.264, so the muxed file decodes everywhere (AV1 and VP9 need decoders that not every ffmpeg build has)
+    adaptive = pick_stream([stream for stream in yt.streams.filter(adaptive=True, only_video=True, file_extension='mp4')
+                            if str(getattr(stream, 'video_codec', '')).startswith('avc1')], min_height)
+    audio = yt.streams.filter(only_audio=True, file_extension='mp4').order_by('abr').desc().first()
+    if adaptive is not None and audio is not None and stream_height(adaptive) > stream_height(progressive):
+        return [adaptive, audio]
+    return [progressive] if progressive is not None else []
+
+def copy_streams(inputs: list, output_path: Path, max_seconds: float = None) -> None:
+    """
+    Writes the video of the first input and the audio of the last input to output_path without re-encoding,
+    cut after max_seconds if given. Inputs may be URLs: ffmpeg reads them with range requests and stops after
+    max_seconds, so only the start of a remote video is downloaded.
+    """
+    temp_path = output_path.with_name(f"{output_path.stem}.part{output_path.suffix}")
+    cmd = [FFMPEG_BINARY, '-y', '-loglevel', 'error']
+    for source in inputs:
+        cmd += ['-i', str(source)]
+    if max_seconds:
+        cmd += ['-t', str(max_seconds)]
+    cmd += ['-map', '0:v:0', '-map', f"{len(inputs) - 1}:a{'?' if len(inputs) == 1 else ':0'}",
+            '-c', 'copy', '-movflags', '+faststart', str(temp_path)]
+    try:
+        subprocess.run(cmd, check=True, capture_output=True, timeout=600)
+        os.replace(temp_path, output_path)
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+def download_streams(streams: list, output_path: Path, max_seconds: float = None) -> None:
+    """
+    Downloads a progressive stream, or a video and an audio stream muxed into one file, to output_path.
+    With max_seconds only the first max_seconds are fetched; if the streams can not be cut remotely they are
+    downloaded completely and cut locally.
+    """
+    if max_seconds:
+        try:
+            copy_streams([stream.url for stream in streams], output_path, max_seconds)
+            return
+        except Exception as e:
+            logging.warning(f"Could not download only the first {max_seconds} seconds, downloading the whole video: {e}")
+    if len(streams) == 1 and not max_seconds:
+        streams[0].download(output_path=str(output_path.parent), filename=output_path.name)
+        return
+    with tempfile.TemporaryDirectory(prefix=temp_prefix('youtube')) as temp_dir:
+        files = [stream.download(output_path=temp_dir, filename=f"stream_{index}.{stream.subtype}") for index, stream in enumerate(streams)]
+        copy_streams(files, output_path, max_seconds)
+
+def download_youtube_video_from_url(url: str, output_folder: str, filename: str, max_seconds: float = None,
+                                    min_height: int = STOCK_VIDEO_MIN_HEIGHT) -> tuple:
+    """
+    Downloads the smallest version of a YouTube video that covers min_height (see pick_streams).
+
+    With max_seconds only the first max_seconds are fetched.
+
+    Returns:
+    - tuple: (True, path of the video) on success, (False, traceback) on failure.
+    """
     try:
         yt = YouTube(url, on_progress_callback = on_progress)
-        video = yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc().first()
-        if video:
-            video_path = video.download(output_path=output_folder, filename = filename)
-            return True, video_path
+        streams = pick_streams(yt, min_height)
+        if not streams:
+            return False, f"No mp4 stream found for {url}"
+        logging.info(f"Downloading {streams[0].resolution} {'progressive' if len(streams) == 1 else 'video and audio'} stream of {url}")
+        output_path = Path(output_folder) / filename
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        download_streams(streams, output_path, max_seconds)
+        return True, str(output_path)
     except Exception:
         return False, traceback.format_exc()
 
@@ -73,33 +175,26 @@ def download_stock_image_unsplash(filename: str, output_folder: str = ".", searc
         'orientation': orientation  # Ensure landscape images for better fit 
     }
 
-    try:
+    def search_photos() -> list:
         # Make the API request to fetch the image
-        response = requests.get(url, params=params)
-        if response.status_code == 200:
-            data = response.json()
-            results = data.get('results', [])
-            
-            if results:
-                # Get the first image's URL
-                image_url = results[0]['urls']['raw']  # Use 'raw' to enforce size
-
-                # Download the image
-                image_response = requests.get(image_url)
-                if image_response.status_code == 200:
-                    # Save the image to the specified file
-                    output_path = Path(output_folder) / filename
-                    output_path.parent.mkdir(parents=True, exist_ok=True)
-                    with open(output_path, 'wb') as f:
-                        f.write(image_response.content)
-                    print(f"Image downloaded and saved to {output_path}")
-                    return True
-                else:
-                    raise Exception(f"Failed to download image from URL: {image_url}")
-            else:
-                raise Exception("No images found for the given search term.")
-        else:
+        response = get_session().get(url, params=params)
+        if response.status_code != 200:
             raise Exception(f"Unsplash API request failed: {response.status_code} - {response.text}")
+        return [result['urls']['raw'] for result in response.json().get('results', [])]  # Use 'raw' to enforce size
+
+    try:
+        # Repeat searches are answered from the search cache
+        image_urls = cached_search('unsplash', search_term, {'per_page': 1, 'orientation': orientation}, search_photos)
+        if image_urls:
+            # Get the first image's URL
+            image_url = image_urls[0]
+
+            # Download the image (through the shared download cache, other campaigns often use the same photo)
+            output_path = cached_download(image_url, Path(output_folder) / filename)
+            print(f"Image downloaded and saved to {output_path}")
+            return True
+        else:
+            raise Exception("No images found for the given search term.")
     except Exception as e:
         print(f"An error occurred while fetching image: {e}")
         
@@ -151,33 +246,26 @@ def download_stock_image_pexels(filename: str, output_folder: str = ".", search_
         'orientation': orientation
     }
 
-    try:
+    def search_photos() -> list:
         # Make the API request to fetch the image
-        response = requests.get(url, headers=headers, params=params)
-        if response.status_code == 200:
-            data = response.json()
-            photos = data.get('photos', [])
-            
-            if photos:
-                # Get the first image's URL (original quality)
-                image_url = photos[0]['src']['original']
-
-                # Download the image
-                image_response = requests.get(image_url)
-                if image_response.status_code == 200:
-                    # Save the image to the specified file
-                    output_path = Path(output_folder) / filename
-                    output_path.parent.mkdir(parents=True, exist_ok=True)
-                    with open(output_path, 'wb') as f:
-                        f.write(image_response.content)
-                    print(f"Image downloaded and saved to {output_path}")
-                    return True
-                else:
-                    raise Exception(f"Failed to download image from URL: {image_url}")
-            else:
-                raise Exception("No images found for the given search term.")
-        else:
+        response = get_session().get(url, headers=headers, params=params)
+        if response.status_code != 200:
             raise Exception(f"Pexels API request failed: {response.status_code} - {response.text}")
+        return [photo['src']['original'] for photo in response.json().get('photos', [])]  # original quality
+
+    try:
+        # Repeat searches are answered from the search cache
+        image_urls = cached_search('pexels', search_term, {'per_page': 1, 'orientation': orientation}, search_photos)
+        if image_urls:
+            # Get the first image's URL
+            image_url = image_urls[0]
+
+            # Download the image (through the shared download cache, other campaigns often use the same photo)
+            output_path = cached_download(image_url, Path(output_folder) / filename)
+            print(f"Image downloaded and saved to {output_path}")
+            return True
+        else:
+            raise Exception("No images found for the given search term.")
     except Exception as e:
         print(f"An error occurred while fetching image: {e}")
         
@@ -189,11 +277,9 @@ def download_gif(filename: str, output_folder: str = ".", url: str = None) -> No
     if not url:
         # Use a sample GIF URL
         url = "https://media.giphy.com/media/3o6fJ1BM7osQBajvS0/giphy.gif"
-    gif_response = requests.get(url)
-    if gif_response.status_code != 200:
-        raise Exception(f"Failed to download GIF: {gif_response.text}")
-    output_path = Path(output_folder) / filename
-    with open(output_path, 'wb') as f:
-        f.write(gif_response.content)
+    try:
+        cached_download(url, Path(output_folder) / filename)
+    except requests.RequestException as e:
+        raise Exception(f"Failed to download GIF: {e}")
 
 
@@ -1,11 +1,15 @@
 import os
 import json
 
+from backend.metadata import index_assets
+
 def check_configs(asset_folder):
     """
     Check the asset folder for the presence of a 'config.json' file. If not, create completely new.
     
     If there is a config file, load the configs and add any missing assets to the .json file.
+    The metadata of the found files is recorded in the asset metadata index (asset_metadata.json), so
+    planning the timeline later does not have to open them.
     """
     config_path = os.path.join(asset_folder, 'config.json')
     config = {
@@ -28,6 +32,7 @@ def check_configs(asset_folder):
         '.wav': 'background_audio'
     }
 
+    found_files = []
     for root, _, files in os.walk(asset_folder):
         for file in files:
             ext = os.path.splitext(file)[1].lower()
@@ -37,6 +42,9 @@ def check_configs(asset_folder):
                     "filename": file
                 }
                 config["assets"].append(asset)
+                found_files.append(file)
 
     with open(config_path, 'w') as f:
-        json.dump(config, f, indent=4)
\ No newline at end of file
+        json.dump(config, f, indent=4)
+
+    index_assets(asset_folder, found_files)
\ No newline at end of file
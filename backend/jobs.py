@@ -0,0 +1,398 @@
+"""
+Local job queue for rendering many campaigns in parallel.
+
+Jobs are rows in a SQLite database (no external services). A job renders one campaign folder with
+combine_assets, optionally after generating its assets from a Wikipedia page first. A pool of worker
+processes claims jobs one at a time, renders them inside batch.render_guard and marks them done.
+
+- Failed jobs are retried with an exponential backoff until they reach max_attempts.
+- Running jobs send a heartbeat. A job whose heartbeat stops (e.g. the worker or the machine crashed)
+  is claimed again by the next free worker, so a batch resumes where it stopped.
+- The database can be shared by the workers of several processes on one host. SQLite locking is not
+  reliable on network file systems, so every host should use its own database file.
+
+Usage (from the repository root):
+    python -m backend.jobs --db jobs.db enqueue assets/Campaign_A assets/Campaign_B
+    python -m backend.jobs --db jobs.db enqueue --wiki https://en.wikipedia.org/wiki/Great_Wall_of_China --target_language Amharic
+    python -m backend.jobs --db jobs.db work --workers 8
+    python -m backend.jobs --db jobs.db status
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from backend import tracing
+
+DEFAULT_MAX_ATTEMPTS = 3
+# Seconds before the first retry; doubled for every further attempt
+RETRY_BACKOFF_SECONDS = 30
+HEARTBEAT_SECONDS = 15
+# A running job without a heartbeat for this long is considered abandoned and claimed again
+STALE_SECONDS = 120
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    asset_folder TEXT NOT NULL,
+    params TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    not_before REAL NOT NULL DEFAULT 0,
+    worker TEXT,
+    heartbeat REAL,
+    error TEXT,
+    output TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, not_before);
+"""
+
+
+class JobQueue:
+    """
+    SQLite backed queue of render jobs.
+
+    Parameters:
+    - db_path: Path to the database file. Created if it does not exist.
+    - stale_seconds (float): Time without a heartbeat after which a running job is claimed again.
+    """
+
+    def __init__(self, db_path, stale_seconds: float = STALE_SECONDS):
+        self.db_path = str(db_path)
+        self.stale_seconds = stale_seconds
+        # Autocommit mode; transactions are started explicitly where several statements must be atomic
+        self._db = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def enqueue(self, asset_folder: str, params: Dict[str, Any] = None, max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> int:
+        """
+        Adds a job that renders asset_folder. Returns the job id.
+
+        Parameters:
+        - asset_folder (str): Campaign folder.
+        - params (Dict): Keyword arguments for combine_assets (e.g. output_filename, preview, encoding_profile).
+          With 'wikipedia_url' and 'target_language' the assets are generated with generate_wiki_assets first.
+        - max_attempts (int): Number of times the job is tried before it is marked failed.
+        """
+        now = time.time()
+        cursor = self._db.execute(
+            'INSERT INTO jobs (asset_folder, params, max_attempts, created, updated) VALUES (?, ?, ?, ?, ?)',
+            (str(asset_folder), json.dumps(params or {}), max_attempts, now, now))
+        return cursor.lastrowid
+
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """
+        Marks the oldest job that is due (or abandoned by a crashed worker) as running for worker and returns it.
+        Returns None if no job is due.
+        """
+        now = time.time()
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            # A job that keeps taking its worker down with it (e.g. killed for running out of memory) is not retried forever
+            self._db.execute("UPDATE jobs SET status = 'failed', error = 'Worker stopped while rendering', heartbeat = NULL, updated = ? "
+                             "WHERE status = 'running' AND heartbeat < ? AND attempts >= max_attempts", (now, now - self.stale_seconds))
+            row = self._db.execute(
+                "SELECT * FROM jobs WHERE (status = 'queued' AND not_before <= ?) OR (status = 'running' AND heartbeat < ?) "
+                "ORDER BY id LIMIT 1", (now, now - self.stale_seconds)).fetchone()
+            if row is None:
+                self._db.execute('COMMIT')
+                return None
+            if row['status'] == 'running':
+                logging.warning(f"Job {row['id']} of worker '{row['worker']}' stopped sending heartbeats, claiming it again")
+            self._db.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, heartbeat = ?, updated = ? WHERE id = ?",
+                             (worker, now, now, row['id']))
+            self._db.execute('COMMIT')
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        job = dict(row)
+        job['attempts'] += 1
+        job['params'] = json.loads(job['params'])
+        return job
+
+    def heartbeat(self, job_id: int, worker: str) -> None:
+        """
+        Tells the queue the worker is still busy with the job.
+        """
+        self._db.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ? AND status = 'running'", (time.time(), job_id, worker))
+
+    def complete(self, job_id: int, output: Any = None) -> None:
+        """
+        Marks a job done and stores its output (e.g. the path of the video).
+        """
+        now = time.time()
+        self._db.execute("UPDATE jobs SET status = 'done', output = ?, error = NULL, heartbeat = NULL, updated = ? WHERE id = ?",
+                         (json.dumps(output), now, job_id))
+
+    def fail(self, job_id: int, error: str) -> str:
+        """
+        Records a failed attempt. The job is queued again after a backoff, or marked failed when it has
+        no attempts left. Returns the new status.
+        """
+        now = time.time()
+        row = self._db.execute('SELECT attempts, max_attempts FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row['attempts'] < row['max_attempts']:
+            status, not_before = 'queued', now + RETRY_BACKOFF_SECONDS * 2 ** (row['attempts'] - 1)
+        else:
+            status, not_before = 'failed', 0
+        self._db.execute('UPDATE jobs SET status = ?, not_before = ?, error = ?, heartbeat = NULL, updated = ? WHERE id = ?',
+                         (status, not_before, error, now, job_id))
+        return status
+
+    def retry_failed(self) -> int:
+        """
+        Queues all failed jobs again with fresh attempts. Returns the number of jobs.
+        """
+        cursor = self._db.execute("UPDATE jobs SET status = 'queued', attempts = 0, not_before = 0, updated = ? WHERE status = 'failed'",
+                                  (time.time(),))
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Returns the number of jobs per status.
+        """
+        return {row['status']: row['count'] for row in self._db.execute('SELECT status, COUNT(*) AS count FROM jobs GROUP BY status')}
+
+    def jobs(self, status: str = None) -> List[Dict[str, Any]]:
+        """
+        Returns all jobs, or the jobs with the given status.
+        """
+        if status:
+            rows = self._db.execute('SELECT * FROM jobs WHERE status = ? ORDER BY id', (status,))
+        else:
+            rows = self._db.execute('SELECT * FROM jobs ORDER BY id')
+        return [dict(row) for row in rows]
+
+    def has_pending(self) -> bool:
+        """
+        Returns True while jobs are queued (possibly waiting for a retry) or running.
+        """
+        return self._db.execute("SELECT 1 FROM jobs WHERE status IN ('queued', 'running') LIMIT 1").fetchone() is not None
+
+
+def run_job(job: Dict[str, Any]) -> Any:
+    """
+    Generates (for wiki jobs) and renders the campaign of a job. Returns the result of combine_assets.
+    """
+    from backend.combination.main import combine_assets
+
+    params = dict(job['params'])
+    wikipedia_url = params.pop('wikipedia_url', None)
+    target_language = params.pop('target_language', None)
+    if wikipedia_url:
+        # Imported here, so render-only workers do not need the generation dependencies
+        from backend.generation.specialized_generators.wiki_generator import generate_wiki_assets
+        os.makedirs(job['asset_folder'], exist_ok=True)
+        generate_wiki_assets(asset_folder=job['asset_folder'], wikipedia_url=wikipedia_url, target_language=target_language)
+    return combine_assets(asset_folder=job['asset_folder'], **params)
+
+
+def _send_heartbeats(db_path: str, job_id: int, worker: str, stop: threading.Event) -> None:
+    # SQLite connections can not be shared between threads, so the heartbeat thread uses its own
+    queue = JobQueue(db_path)
+    try:
+        while not stop.wait(HEARTBEAT_SECONDS):
+            queue.heartbeat(job_id, worker)
+    finally:
+        queue.close()
+
+
+def worker_trace_path(trace_path: str, pid: int) -> str:
+    """
+    Returns the file the worker process pid writes its trace events to, before they are merged into trace_path.
+    """
+    return f"{trace_path}.worker_{pid}"
+
+
+def work(db_path: str, wait: bool = False, poll_seconds: float = 2, max_jobs: int = None, trace_path: str = None) -> int:
+    """
+    Worker loop: claims and renders jobs until none are left (or forever with wait). Returns the number of jobs handled.
+
+    Parameters:
+    - db_path (str): Queue database.
+    - wait (bool): Keep polling for new jobs when the queue is empty, instead of returning.
+    - poll_seconds (float): Time between polls while no job is due.
+    - max_jobs (int): Return after this many jobs, e.g. to recycle the process.
+    - trace_path (str): Trace the jobs of this worker and write the events to worker_trace_path(trace_path, pid)
+      when the loop ends, failed jobs included. run_workers merges them.
+    """
+    from backend.batch import render_guard
+
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    queue = JobQueue(db_path)
+    handled = 0
+    if trace_path:
+        tracing.enable()
+    try:
+        while max_jobs is None or handled < max_jobs:
+            job = queue.claim(worker)
+            if job is None:
+                # Jobs that wait for a retry or run in another worker (which may still crash) keep this worker around
+                if not wait and not queue.has_pending():
+                    break
+                time.sleep(poll_seconds)
+                continue
+
+            logging.info(f"Worker '{worker}' rendering job {job['id']} ('{job['asset_folder']}', attempt {job['attempts']})")
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=_send_heartbeats, args=(db_path, job['id'], worker, stop), daemon=True)
+            heartbeat.start()
+            try:
+                with render_guard(f"job {job['id']}"), tracing.span('job', 'queue', job=job['id'], asset_folder=job['asset_folder']):
+                    output = run_job(job)
+            except Exception as e:
+                status = queue.fail(job['id'], f"{type(e).__name__}: {e}")
+                logging.exception(f"Job {job['id']} failed ({'will be retried' if status == 'queued' else 'no attempts left'})")
+            else:
+                queue.complete(job['id'], output)
+                logging.info(f"Job {job['id']} done: {output}")
+            finally:
+                stop.set()
+                heartbeat.join()
+            handled += 1
+    finally:
+        queue.close()
+        if trace_path:
+            with open(worker_trace_path(trace_path, os.getpid()), 'w') as f:
+                json.dump(tracing.drain(), f)
+    return handled
+
+
+def _work_in_process(db_path: str, wait: bool, poll_seconds: float, max_jobs: Optional[int], trace_path: Optional[str]) -> None:
+    logging.basicConfig(level=logging.INFO)
+    work(db_path, wait, poll_seconds, max_jobs, trace_path)
+
+
+def _merge_worker_traces(trace_path: str, pids: List[int]) -> None:
+    # Worker processes that crashed before the end of their loop leave no file
+    for pid in pids:
+        path = Path(worker_trace_path(trace_path, pid))
+        if not path.exists():
+            continue
+        with open(path, 'r') as f:
+            tracing.merge(json.load(f))
+        path.unlink()
+
+
+def run_workers(db_path: str, workers: int = None, wait: bool = False, poll_seconds: float = 2, max_jobs: int = None,
+                trace_path: str = None) -> Dict[str, int]:
+    """
+    Starts a pool of worker processes on the queue and waits until they are done.
+
+    Parameters:
+    - db_path (str): Queue database.
+    - workers (int): Number of worker processes. Defaults to the number of CPU cores.
+    - wait, poll_seconds, max_jobs: See work. A worker that reaches max_jobs is replaced by a fresh process.
+    - trace_path (str): Trace the jobs in the worker processes. Their events are merged into the trace of this
+      process (enable tracing before and call tracing.finish(trace_path) afterwards).
+
+    Returns:
+    - Dict[str, int]: Number of jobs per status afterwards.
+    """
+    workers = workers or os.cpu_count() or 1
+    # Workers start their own segment workers, so they can not be daemon processes; spawn keeps them independent of this process
+    context = multiprocessing.get_context('spawn')
+    args = (db_path, wait, poll_seconds, max_jobs, trace_path)
+    processes = [context.Process(target=_work_in_process, args=args) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    pids = [process.pid for process in processes]
+
+    queue = JobQueue(db_path)
+    try:
+        while processes:
+            time.sleep(poll_seconds)
+            for index, process in enumerate(processes):
+                if process.is_alive():
+                    continue
+                process.join()
+                if process.exitcode != 0:
+                    logging.warning(f"Worker process {process.pid} exited with code {process.exitcode}")
+                if wait or queue.has_pending():
+                    # Recycled (max_jobs) or crashed workers are replaced while there is work
+                    processes[index] = context.Process(target=_work_in_process, args=args)
+                    processes[index].start()
+                    pids.append(processes[index].pid)
+                else:
+                    processes[index] = None
+            processes = [process for process in processes if process is not None]
+        return queue.counts()
+    finally:
+        for process in processes:
+            process.terminate()
+        queue.close()
+        if trace_path:
+            _merge_worker_traces(trace_path, pids)
+
+
+def _print_status(queue: JobQueue) -> None:
+    print(json.dumps(queue.counts(), indent=4))
+    for job in queue.jobs('failed'):
+        print(f"Job {job['id']} ('{job['asset_folder']}') failed after {job['attempts']} attempts: {job['error']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Queue campaign folders and render them with a pool of worker processes.")
+    parser.add_argument('--db', type=str, default='jobs.db', help="Path to the queue database")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    enqueue_parser = subparsers.add_parser('enqueue', help="Add render jobs")
+    enqueue_parser.add_argument('asset_folders', nargs='*', help="Campaign folders to render")
+    enqueue_parser.add_argument('--wiki', type=str, default=None, help="Comma separated Wikipedia URLs to generate and render")
+    enqueue_parser.add_argument('--target_language', type=str, default='English', help="Target language of wiki campaigns")
+    enqueue_parser.add_argument('--target_script', type=str, default='latin', help="Script used for the subtitles")
+    enqueue_parser.add_argument('--output_filename', type=str, default='output_video.mp4', help="Output filename of every video")
+    enqueue_parser.add_argument('--encoding_profile', type=str, default=None, choices=['draft', 'delivery', 'archive'], help="Encoding profile")
+    enqueue_parser.add_argument('--preview', action='store_true', help="Render low resolution previews")
+    enqueue_parser.add_argument('--max_attempts', type=int, default=DEFAULT_MAX_ATTEMPTS, help="Attempts per job before it is marked failed")
+
+    work_parser = subparsers.add_parser('work', help="Render queued jobs with a pool of worker processes")
+    work_parser.add_argument('--workers', type=int, default=None, help="Number of worker processes (default: number of CPU cores)")
+    work_parser.add_argument('--wait', action='store_true', help="Keep waiting for new jobs when the queue is empty")
+    work_parser.add_argument('--max_jobs', type=int, default=None, help="Replace a worker process after this many jobs")
+    work_parser.add_argument('--trace', type=str, default=None, help="Write a Chrome trace JSON of the jobs of all workers to this file")
+
+    subparsers.add_parser('status', help="Print the number of jobs per status and the failed jobs")
+    subparsers.add_parser('retry', help="Queue failed jobs again")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    queue = JobQueue(args.db)
+    if args.command == 'enqueue':
+        params = {'output_filename': args.output_filename, 'target_script': args.target_script, 'preview': args.preview,
+                  'encoding_profile': args.encoding_profile}
+        for asset_folder in args.asset_folders:
+            queue.enqueue(str(Path(asset_folder).resolve()), params, args.max_attempts)
+        for wikipedia_url in (args.wiki.split(',') if args.wiki else []):
+            campaign_id = wikipedia_url.split("/")[-1]
+            queue.enqueue(str(Path(f"assets/Campaign_{campaign_id}_1A").resolve()),
+                          {**params, 'wikipedia_url': wikipedia_url, 'target_language': args.target_language}, args.max_attempts)
+        _print_status(queue)
+    elif args.command == 'work':
+        queue.close()
+        if args.trace:
+            tracing.enable()
+        try:
+            print(json.dumps(run_workers(args.db, args.workers, args.wait, max_jobs=args.max_jobs, trace_path=args.trace), indent=4))
+        finally:
+            if args.trace:
+                tracing.finish(args.trace)
+    elif args.command == 'status':
+        _print_status(queue)
+    elif args.command == 'retry':
+        logging.info(f"Queued {queue.retry_failed()} failed jobs again")
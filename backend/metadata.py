@@ -0,0 +1,212 @@
+"""
+Asset metadata index.
+
+Every asset file of a campaign is probed once (with ffprobe, or by parsing `ffmpeg -i` when ffprobe is not
+installed) for its duration, resolution, frame rate, codecs, alpha channel and audio sample rate. The results
+are stored with the file's content hash in 'asset_metadata.json' next to config.json and reused until the
+file's size or modification time changes, so planning, validation and cost estimates run without starting
+any decoder.
+"""
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from moviepy.config import FFMPEG_BINARY
+
+from backend.cache import file_digest, remember_digest
+
+METADATA_VERSION = 1
+METADATA_FILENAME = 'asset_metadata.json'
+
+# Pixel formats with an alpha channel
+_ALPHA_PIX_FMT = re.compile(r'^(rgba|bgra|argb|abgr|ya|yuva|gbrap|rgba64|bgra64)')
+
+
+def _ffprobe_binary() -> Optional[str]:
+    """
+    Returns the ffprobe executable: FFPROBE_BINARY, the ffprobe next to MoviePy's ffmpeg, or the one on the PATH.
+    """
+    if os.getenv('FFPROBE_BINARY'):
+        return os.getenv('FFPROBE_BINARY')
+    sibling = Path(FFMPEG_BINARY).with_name(Path(FFMPEG_BINARY).name.replace('ffmpeg', 'ffprobe'))
+    if sibling.name != Path(FFMPEG_BINARY).name and sibling.exists():
+        return str(sibling)
+    return shutil.which('ffprobe')
+
+
+def _parse_rate(rate: Optional[str]) -> Optional[float]:
+    """
+    Turns an ffprobe frame rate such as '30000/1001' into a float.
+    """
+    if not rate or rate in ('0/0', 'N/A'):
+        return None
+    numerator, _, denominator = rate.partition('/')
+    value = float(numerator) / float(denominator or 1)
+    return round(value, 3) if value else None
+
+
+def _probe_ffprobe(ffprobe: str, path: Path) -> Dict[str, Any]:
+    result = subprocess.run([ffprobe, '-v', 'error', '-show_format', '-show_streams', '-of', 'json', str(path)],
+                            capture_output=True, text=True, check=True)
+    data = json.loads(result.stdout)
+    video = next((stream for stream in data.get('streams', []) if stream.get('codec_type') == 'video'), None)
+    audio = next((stream for stream in data.get('streams', []) if stream.get('codec_type') == 'audio'), None)
+    duration = data.get('format', {}).get('duration')
+    return {
+        'duration': float(duration) if duration not in (None, 'N/A') else None,
+        'width': video.get('width') if video else None,
+        'height': video.get('height') if video else None,
+        'fps': _parse_rate(video.get('avg_frame_rate') or video.get('r_frame_rate')) if video else None,
+        'video_codec': video.get('codec_name') if video else None,
+        'pix_fmt': video.get('pix_fmt') if video else None,
+        'audio_codec': audio.get('codec_name') if audio else None,
+        'sample_rate': int(audio['sample_rate']) if audio and audio.get('sample_rate') else None,
+        'channels': audio.get('channels') if audio else None,
+    }
+
+
+def _probe_ffmpeg(path: Path) -> Dict[str, Any]:
+    # Without input options ffmpeg exits with an error after printing the stream info, which is all we need
+    result = subprocess.run([FFMPEG_BINARY, '-hide_banner', '-i', str(path)], capture_output=True, text=True)
+    text = result.stderr
+    if 'Stream #' not in text:
+        raise IOError(f"ffmpeg could not read '{path.name}': {text.strip()}")
+
+    metadata = {key: None for key in ('duration', 'width', 'height', 'fps', 'video_codec', 'pix_fmt', 'audio_codec', 'sample_rate', 'channels')}
+    match = re.search(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)', text)
+    if match:
+        hours, minutes, seconds = match.groups()
+        metadata['duration'] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    video = re.search(r'Stream #.*?Video: (\w+)[^,]*, (\w+)[^,]*(?:\([^)]*\))?.*?, (\d+)x(\d+)(.*)', text)
+    if video:
+        metadata['video_codec'], metadata['pix_fmt'] = video.group(1), video.group(2)
+        metadata['width'], metadata['height'] = int(video.group(3)), int(video.group(4))
+        fps = re.search(r'([\d.]+) fps', video.group(5))
+        metadata['fps'] = float(fps.group(1)) if fps else None
+
+    audio = re.search(r'Stream #.*?Audio: (\w+).*?(\d+) Hz, (\w+)', text)
+    if audio:
+        metadata['audio_codec'], metadata['sample_rate'] = audio.group(1), int(audio.group(2))
+        metadata['channels'] = {'mono': 1, 'stereo': 2}.get(audio.group(3))
+    return metadata
+
+
+def probe_file(path) -> Dict[str, Any]:
+    """
+    Returns the metadata of a media file without decoding it.
+
+    Returns:
+    - Dict[str, Any]: duration (seconds, None for still images), width, height, fps, video_codec, pix_fmt,
+      has_alpha, has_video, has_audio, audio_codec, sample_rate and channels.
+    """
+    path = Path(path)
+    ffprobe = _ffprobe_binary()
+    metadata = _probe_ffprobe(ffprobe, path) if ffprobe else _probe_ffmpeg(path)
+    metadata['has_video'] = metadata['width'] is not None
+    metadata['has_audio'] = metadata['audio_codec'] is not None
+    metadata['has_alpha'] = bool(metadata['pix_fmt'] and _ALPHA_PIX_FMT.match(metadata['pix_fmt']))
+    if metadata['video_codec'] in ('mjpeg', 'png', 'bmp', 'webp', 'tiff') and not metadata['has_audio']:
+        # Still images report the duration and rate of a single frame
+        metadata['duration'] = None
+        metadata['fps'] = None
+    return metadata
+
+
+class AssetIndex:
+    """
+    Metadata of the files in an asset folder, persisted in asset_metadata.json.
+
+    Parameters:
+    - asset_folder: Campaign folder (the folder with config.json).
+    """
+
+    def __init__(self, asset_folder):
+        self.asset_path = Path(asset_folder)
+        self.index_path = self.asset_path / METADATA_FILENAME
+        self.files = {}
+        self._dirty = False
+        if self.index_path.exists():
+            try:
+                with open(self.index_path, 'r') as f:
+                    data = json.load(f)
+                if data.get('version') == METADATA_VERSION:
+                    self.files = data.get('files', {})
+            except (OSError, ValueError) as e:
+                logging.warning(f"Could not read '{self.index_path}', probing all assets again: {e}")
+
+    def get(self, filename: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the metadata of an asset file, probing it if it is new or changed since it was indexed.
+        Returns None if the file does not exist or can not be probed.
+        """
+        path = self.asset_path / filename
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+
+        entry = self.files.get(filename)
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            # Proxies and segment keys hash the same file; reuse the stored hash for them
+            remember_digest(path, entry['sha256'])
+            return entry
+
+        try:
+            metadata = probe_file(path)
+        except Exception as e:
+            logging.warning(f"Could not probe asset '{filename}': {e}")
+            return None
+        entry = {**metadata, 'sha256': file_digest(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        self.files[filename] = entry
+        self._dirty = True
+        return entry
+
+    def prune(self) -> None:
+        """
+        Forgets files that no longer exist.
+        """
+        for filename in [name for name in self.files if not (self.asset_path / name).exists()]:
+            del self.files[filename]
+            self._dirty = True
+
+    def save(self) -> None:
+        """
+        Writes the index if anything changed.
+        """
+        if not self._dirty:
+            return
+        temp_path = self.index_path.with_name(f"{METADATA_FILENAME}.{os.getpid()}.tmp")
+        with open(temp_path, 'w') as f:
+            json.dump({'version': METADATA_VERSION, 'files': self.files}, f, indent=4)
+        os.replace(temp_path, self.index_path)
+        self._dirty = False
+
+
+def index_assets(asset_folder, filenames=None) -> AssetIndex:
+    """
+    Brings the metadata index of an asset folder up to date and saves it.
+
+    Parameters:
+    - asset_folder: Campaign folder.
+    - filenames: Files to index. Defaults to every file referenced in config.json.
+
+    Returns:
+    - AssetIndex: The updated index.
+    """
+    index = AssetIndex(asset_folder)
+    if filenames is None:
+        config_file = Path(asset_folder) / 'config.json'
+        with open(config_file, 'r') as f:
+            configs = json.load(f)
+        filenames = [config['filename'] for config in configs.get('assets', []) if config.get('asset_type') and config.get('filename')]
+    for filename in filenames:
+        index.get(filename)
+    index.prune()
+    index.save()
+    return index
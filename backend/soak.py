@@ -0,0 +1,139 @@
+"""
+Soak run for the batch mode.
+
+Renders many synthetic campaigns (see benchmark.py) one after another in this process, each inside
+batch.render_guard, and records the resident memory, open file descriptors, ffmpeg child processes and
+temporary folders after every campaign. After a warm-up (caches filling up, lazy imports) these numbers
+must stay flat; the run exits with status 1 and lists the violations otherwise.
+
+Usage (from the repository root):
+    python -m backend.soak [--campaigns 30] [--warmup 5] [--fail_every 7] [--output soak.json]
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List
+
+from backend.benchmark import SCENARIOS, make_campaign
+
+# Subtitles fall back to Pillow's built-in font (see subtitles.resolve_font) when assets/stlib/fonts is missing
+SOAK_SCENARIOS = ['photos', 'video_360p', 'gif_overlay', 'audio_mix', 'subtitles']
+
+
+def corrupt_campaign(folder: Path) -> None:
+    """
+    Truncates the video files of a campaign, so its render fails halfway (used to check the failure path).
+    """
+    for path in folder.glob('*.mp4'):
+        data = path.read_bytes()
+        path.write_bytes(data[:len(data) // 3])
+
+
+def run_soak(campaigns: int = 30, warmup: int = 5, duration: float = 2, scenarios: List[str] = None, fail_every: int = 0,
+             max_rss_growth_mb: float = 64, max_fd_growth: int = 0, workers: int = 1) -> Dict[str, Any]:
+    """
+    Renders campaigns synthetic campaigns in this process and checks that resource usage stays flat.
+
+    Parameters:
+    - campaigns (int): Number of campaigns to render.
+    - warmup (int): Campaigns rendered before the baseline is taken.
+    - duration (float): Duration of every campaign in seconds.
+    - scenarios (List[str]): Benchmark scenarios to cycle through. Defaults to SOAK_SCENARIOS.
+    - fail_every (int): Corrupt every n-th campaign so its render fails. 0 renders all campaigns intact.
+    - max_rss_growth_mb (float): Allowed growth of the resident memory over the baseline.
+    - max_fd_growth (int): Allowed growth of the number of open file descriptors over the baseline.
+    - workers (int): Worker processes passed to combine_assets.
+
+    Returns:
+    - Dict[str, Any]: Samples per campaign, the baseline and a list of violations ('ok' is True without any).
+    """
+    scenarios = scenarios or SOAK_SCENARIOS
+    warmup = max(1, min(warmup, campaigns - 1))
+    temp_dir = tempfile.mkdtemp(prefix='adflowgen_soak_')
+    os.environ.setdefault('ADFLOWGEN_CACHE_DIR', os.path.join(temp_dir, 'cache'))
+    # Imported after the cache folder is set, the caches pick their folder at import time
+    from backend.batch import render_guard, resource_usage
+    from backend.combination.main import combine_assets
+
+    samples = []
+    violations = []
+    try:
+        for index in range(campaigns):
+            name = scenarios[index % len(scenarios)]
+            folder = Path(temp_dir) / f"Campaign_Soak_{index:04d}"
+            make_campaign(folder, SCENARIOS[name], duration)
+            should_fail = bool(fail_every) and (index + 1) % fail_every == 0
+            if should_fail:
+                corrupt_campaign(folder)
+
+            error = None
+            try:
+                with render_guard(folder.name):
+                    combine_assets(str(folder), workers=workers, incremental=False)
+            except Exception as e:
+                error = str(e).splitlines()[0] if str(e) else type(e).__name__
+            if error and not should_fail:
+                violations.append(f"Campaign {index} ({name}) failed: {error}")
+            shutil.rmtree(folder, ignore_errors=True)
+
+            usage = resource_usage()
+            samples.append({'campaign': index, 'scenario': name, 'failed': error is not None, **usage})
+            logging.info(f"Campaign {index} ({name}{', failed' if error else ''}): rss {usage['rss_bytes'] / 1024 / 1024:.1f} MB, "
+                         f"{usage['open_fds']} fds, {usage['ffmpeg_processes']} ffmpeg processes, {usage['temp_paths']} temp folders")
+            if usage['ffmpeg_processes'] or usage['temp_paths']:
+                violations.append(f"Campaign {index} left {usage['ffmpeg_processes']} ffmpeg processes and {usage['temp_paths']} temp folders behind")
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    baseline = samples[warmup - 1] if len(samples) >= warmup else None
+    if baseline is not None:
+        peak_rss = max(sample['rss_bytes'] for sample in samples[warmup:])
+        peak_fds = max(sample['open_fds'] for sample in samples[warmup:])
+        rss_growth_mb = (peak_rss - baseline['rss_bytes']) / 1024 / 1024
+        if rss_growth_mb > max_rss_growth_mb:
+            violations.append(f"Resident memory grew by {rss_growth_mb:.1f} MB after the warm-up (allowed {max_rss_growth_mb} MB)")
+        if baseline['open_fds'] >= 0 and peak_fds - baseline['open_fds'] > max_fd_growth:
+            violations.append(f"Open file descriptors grew by {peak_fds - baseline['open_fds']} after the warm-up (allowed {max_fd_growth})")
+
+    return {
+        'settings': {'campaigns': campaigns, 'warmup': warmup, 'duration_seconds': duration, 'scenarios': scenarios,
+                     'fail_every': fail_every, 'workers': workers},
+        'baseline': baseline,
+        'samples': samples,
+        'violations': violations,
+        'ok': not violations,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render many synthetic campaigns in one process and check that memory and file descriptors stay flat.")
+    parser.add_argument('--campaigns', type=int, default=30, help="Number of campaigns to render")
+    parser.add_argument('--warmup', type=int, default=5, help="Campaigns rendered before the baseline is taken")
+    parser.add_argument('--duration', type=float, default=2, help="Duration of every campaign in seconds")
+    parser.add_argument('--scenarios', type=str, default=','.join(SOAK_SCENARIOS), help="Comma separated benchmark scenarios to cycle through")
+    parser.add_argument('--fail_every', type=int, default=0, help="Corrupt every n-th campaign to check that failed renders release their resources too")
+    parser.add_argument('--max_rss_growth_mb', type=float, default=64, help="Allowed resident memory growth after the warm-up")
+    parser.add_argument('--max_fd_growth', type=int, default=0, help="Allowed growth of open file descriptors after the warm-up")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes passed to combine_assets")
+    parser.add_argument('--output', type=str, default=None, help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    unknown = [name for name in args.scenarios.split(',') if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+    report = run_soak(args.campaigns, args.warmup, args.duration, args.scenarios.split(','), args.fail_every,
+                      args.max_rss_growth_mb, args.max_fd_growth, args.workers)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+    for violation in report['violations']:
+        logging.error(violation)
+    sys.exit(0 if report['ok'] else 1)
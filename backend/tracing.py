@@ -0,0 +1,149 @@
+"""
+Optional per-stage tracing.
+
+Stages (asset generation, timeline building, proxy transcoding, subtitle rasterization, audio mixing, encoding, ...)
+are recorded as spans with `span(...)`. Per-frame work (decoding a layer, composing, format conversion, waiting
+for x264) is too fine grained for one event per call, so it is summed per name with `add(...)` and emitted as one
+event per segment.
+
+Tracing is off by default and costs a single flag check per call then. When enabled, `finish(path)` writes a
+Chrome trace (open it in chrome://tracing or https://ui.perfetto.dev) and logs a summary table per stage.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+_enabled = False
+_events: List[Dict[str, Any]] = []
+# Summed per-frame timings: name -> [seconds, calls, items]
+_totals = defaultdict(lambda: [0.0, 0, 0])
+_lock = threading.Lock()
+
+
+def enable(clear: bool = True) -> None:
+    """
+    Turns tracing on for this process.
+    """
+    global _enabled
+    _enabled = True
+    if clear:
+        drain()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def _now_us() -> float:
+    return time.perf_counter() * 1e6
+
+
+@contextmanager
+def span(name: str, category: str = 'render', **args):
+    """
+    Records the time spent inside the with block as one trace event.
+    """
+    if not _enabled:
+        yield
+        return
+    start = _now_us()
+    try:
+        yield
+    finally:
+        event = {'name': name, 'cat': category, 'ph': 'X', 'ts': start, 'dur': _now_us() - start,
+                 'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args}
+        with _lock:
+            _events.append(event)
+
+
+def add(name: str, seconds: float, items: int = 1) -> None:
+    """
+    Adds the duration of one call of a per-frame operation to its running total.
+    """
+    if not _enabled:
+        return
+    with _lock:
+        total = _totals[name]
+        total[0] += seconds
+        total[1] += 1
+        total[2] += items
+
+
+def flush_totals(category: str = 'frames', **args) -> None:
+    """
+    Emits the running totals of per-frame operations as one event each (ending now) and resets them.
+    """
+    if not _enabled:
+        return
+    end = _now_us()
+    with _lock:
+        for name, (seconds, calls, items) in _totals.items():
+            _events.append({'name': name, 'cat': category, 'ph': 'X', 'ts': end - seconds * 1e6, 'dur': seconds * 1e6,
+                            'pid': os.getpid(), 'tid': threading.get_ident(), 'args': {**args, 'calls': calls, 'frames': items}})
+        _totals.clear()
+
+
+def drain() -> List[Dict[str, Any]]:
+    """
+    Returns and clears the recorded events. Used by worker processes to send their events to the parent.
+    """
+    with _lock:
+        events = list(_events)
+        _events.clear()
+        _totals.clear()
+    return events
+
+
+def merge(events: List[Dict[str, Any]]) -> None:
+    """
+    Adds events recorded in another process.
+    """
+    if not _enabled or not events:
+        return
+    with _lock:
+        _events.extend(events)
+
+
+def stage_totals() -> Dict[tuple, List]:
+    """
+    Returns {(category, stage): [seconds, calls, frames]} summed over all recorded events.
+    Time of worker processes is summed too, so parallel stages can add up to more than the wall time.
+    """
+    stages = defaultdict(lambda: [0.0, 0, 0])
+    with _lock:
+        for event in _events:
+            stage = stages[(event['cat'], event['name'])]
+            stage[0] += event['dur'] / 1e6
+            stage[1] += event['args'].get('calls', 1)
+            stage[2] += event['args'].get('frames', 0)
+    return dict(stages)
+
+
+def summary_table() -> str:
+    """
+    Returns a table with the total time, number of calls and frames per stage, slowest stage first.
+    """
+    lines = [f"{'category':<12} {'stage':<40} {'seconds':>10} {'calls':>8} {'frames':>8}"]
+    for (category, name), (seconds, calls, frames) in sorted(stage_totals().items(), key=lambda item: -item[1][0]):
+        lines.append(f"{category:<12} {name[:40]:<40} {seconds:>10.3f} {calls:>8} {frames or '':>8}")
+    return '\n'.join(lines)
+
+
+def finish(trace_path: str) -> None:
+    """
+    Writes the Chrome trace JSON to trace_path, logs the summary table and turns tracing off.
+    """
+    global _enabled
+    if not _enabled:
+        return
+    with _lock:
+        events = sorted(_events, key=lambda event: event['ts'])
+    with open(trace_path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    logging.info(f"Wrote trace with {len(events)} events to '{trace_path}'\n{summary_table()}")
+    _enabled = False
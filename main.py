@@ -2,14 +2,15 @@
 This script generates wiki assets and combines them into a video file.
 
 Usage:
-    python main.py --urls <comma_separated_urls> --target_language <language> --target_script <script> --output_filename <filename>
+    python main.py --urls <comma_separated_urls> --target_language <language> --target_script <script> --output_filename <filename> [--workers <n>] [--encoding_profile <draft|delivery|archive>] [--trace <trace.json>] [--keep_going] [--queue <jobs.db> [--queue_workers <n>]]
 
 Example:
     python main.py 
         --urls "https://en.wikipedia.org/wiki/Great_Wall_of_China"\
         --target_language "Amharic"\
         --target_script "ethiopian"\
-        --output_filename "result.mp4"
+        --output_filename "result.mp4"\
+        --workers 8
 """
 
 import logging
@@ -17,19 +18,51 @@ import os
 import argparse
 from backend.generation.specialized_generators.wiki_generator import generate_wiki_assets
 from backend.combination.main import combine_assets
+from backend import tracing
+from backend.batch import render_guard
+from backend.jobs import JobQueue, run_workers
 from dotenv import load_dotenv
 
-def main(urls, target_language, target_script, output_filename):
+def main(urls, target_language, target_script, output_filename, workers=1, max_memory_mb=None, encoding_profile=None, trace_path=None,
+         keep_going=False, queue_path=None, queue_workers=None):
     load_dotenv()
     logging.basicConfig(level=logging.INFO)
-    logging.info(f"Generating wiki assets for {urls} in {target_language} using {target_script} script")
-    
-    for wikipedia_url in urls:
-        campaign_id = wikipedia_url.split("/")[-1]
-        asset_folder = f"assets/Campaign_{campaign_id}_1A"
-        os.makedirs(asset_folder, exist_ok=True)
-        generate_wiki_assets(asset_folder=asset_folder, wikipedia_url=wikipedia_url, target_language=target_language)
-        combine_assets(asset_folder=asset_folder, output_filename=output_filename, target_script=target_script, preview=False)
+    if trace_path:
+        # One trace covers generation and rendering of all campaigns, also when they run in queue workers
+        tracing.enable()
+    try:
+        if queue_path:
+            # Campaigns are generated and rendered in parallel by a pool of worker processes (see backend/jobs.py)
+            queue = JobQueue(queue_path)
+            params = {'output_filename': output_filename, 'target_script': target_script, 'workers': workers, 'max_memory_mb': max_memory_mb,
+                      'encoding_profile': encoding_profile, 'target_language': target_language}
+            for wikipedia_url in urls:
+                campaign_id = wikipedia_url.split("/")[-1]
+                queue.enqueue(os.path.abspath(f"assets/Campaign_{campaign_id}_1A"), {**params, 'wikipedia_url': wikipedia_url})
+            queue.close()
+            logging.info(f"Queued {len(urls)} campaigns, job status: {run_workers(queue_path, queue_workers, trace_path=trace_path)}")
+            return
+        logging.info(f"Generating wiki assets for {urls} in {target_language} using {target_script} script")
+
+        for wikipedia_url in urls:
+            campaign_id = wikipedia_url.split("/")[-1]
+            asset_folder = f"assets/Campaign_{campaign_id}_1A"
+            os.makedirs(asset_folder, exist_ok=True)
+            try:
+                # Readers, ffmpeg processes and temporary files of a campaign never outlive it, so one process can render many
+                with render_guard(campaign_id):
+                    with tracing.span('generate campaign', 'generation', campaign=campaign_id):
+                        generate_wiki_assets(asset_folder=asset_folder, wikipedia_url=wikipedia_url, target_language=target_language)
+                    combine_assets(asset_folder=asset_folder, output_filename=output_filename, target_script=target_script, preview=False, workers=workers, max_memory_mb=max_memory_mb,
+                                   encoding_profile=encoding_profile)
+            except Exception:
+                if not keep_going:
+                    raise
+                logging.exception(f"Campaign '{campaign_id}' failed, continuing with the next URL")
+    finally:
+        # Also written when a campaign fails, that is when the trace is needed most
+        if trace_path:
+            tracing.finish(trace_path)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate wiki assets and combine them into a video file.")
@@ -37,8 +70,17 @@ if __name__ == "__main__":
     parser.add_argument('--target_language', type=str, required=True, help="Target language for the assets")
     parser.add_argument('--target_script', type=str, required=True, help="Target script for the assets")
     parser.add_argument('--output_filename', type=str, required=True, help="Output filename for the combined video")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker processes used to render the video in parallel segments")
+    parser.add_argument('--max_memory_mb', type=int, default=None, help="Memory cap in MB for rendering one video")
+    parser.add_argument('--trace', type=str, default=None, help="Write a Chrome trace JSON of all stages to this file and log a summary table")
+    parser.add_argument('--encoding_profile', type=str, default=None, choices=['draft', 'delivery', 'archive'],
+                        help="Encoding profile, overrides encoding_profile in the config.json (default: delivery)")
+    parser.add_argument('--keep_going', action='store_true', help="Log a failed campaign and continue with the next URL instead of stopping")
+    parser.add_argument('--queue', type=str, default=None, help="Queue the campaigns in this SQLite database and render them with a pool of worker processes")
+    parser.add_argument('--queue_workers', type=int, default=None, help="Number of queue worker processes (default: number of CPU cores)")
 
     args = parser.parse_args()
     urls = args.urls.split(',')
 
-    main(urls, args.target_language, args.target_script, args.output_filename)
\ No newline at end of file
+    main(urls, args.target_language, args.target_script, args.output_filename, args.workers, args.max_memory_mb, args.encoding_profile, args.trace, args.keep_going,
+         args.queue, args.queue_workers)
\ No newline at end of file
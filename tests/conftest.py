@@ -0,0 +1,25 @@
+import subprocess
+
+import pytest
+from moviepy.config import FFMPEG_BINARY
+
+
+@pytest.fixture(autouse=True)
+def cache_root(tmp_path, monkeypatch):
+    """
+    Points the shared caches (downloads, searches, fonts, proxies) at a folder of the test.
+    """
+    root = tmp_path / 'cache'
+    monkeypatch.setenv('ADFLOWGEN_CACHE_DIR', str(root))
+    return root
+
+
+@pytest.fixture
+def tone_file(tmp_path):
+    """
+    A 30 second sine tone, longer than every test timeline.
+    """
+    path = tmp_path / 'tone.m4a'
+    subprocess.run([FFMPEG_BINARY, '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440', '-t', '30', str(path)],
+                   check=True)
+    return path
@@ -0,0 +1,88 @@
+import functools
+import os
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from backend.cache import file_digest
+from backend.generation import download_cache
+from backend.generation.download_cache import cached_download
+
+
+@pytest.fixture
+def server(tmp_path):
+    """
+    Serves tmp_path/served over HTTP and records (path, status) of every request.
+    """
+    root = tmp_path / 'served'
+    root.mkdir()
+    log = []
+
+    class Handler(SimpleHTTPRequestHandler):
+        def log_request(self, code='-', size='-'):
+            log.append((self.path, int(code)))
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(Handler, directory=str(root)))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield root, f"http://127.0.0.1:{httpd.server_port}", log
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_second_download_is_a_cache_hit(tmp_path, server, monkeypatch):
+    root, base_url, log = server
+    (root / 'image.jpg').write_bytes(b'image data' * 1000)
+    hashed = []
+    monkeypatch.setattr(download_cache, 'file_digest', lambda path: hashed.append(path) or file_digest(path))
+
+    first = cached_download(f"{base_url}/image.jpg", tmp_path / 'campaign_a' / 'image.jpg')
+    second = cached_download(f"{base_url}/image.jpg", tmp_path / 'campaign_b' / 'image.jpg')
+
+    assert log == [('/image.jpg', 200)]
+    assert first.read_bytes() == second.read_bytes() == b'image data' * 1000
+    # Both campaigns get a hardlink to the cached file, which is not hashed again on a hit
+    assert os.path.samefile(first, second)
+    assert hashed == []
+
+
+def test_expired_download_is_revalidated(tmp_path, server, monkeypatch):
+    root, base_url, log = server
+    served = root / 'image.jpg'
+    served.write_bytes(b'version 1')
+    monkeypatch.setattr(download_cache, 'DOWNLOAD_MAX_AGE_SECONDS', 0)
+
+    cached_download(f"{base_url}/image.jpg", tmp_path / 'first.jpg')
+    output_path = cached_download(f"{base_url}/image.jpg", tmp_path / 'second.jpg')
+    assert log == [('/image.jpg', 200), ('/image.jpg', 304)]
+    assert output_path.read_bytes() == b'version 1'
+
+    served.write_bytes(b'version 2')
+    later = time.time() + 10
+    os.utime(served, (later, later))
+    output_path = cached_download(f"{base_url}/image.jpg", tmp_path / 'third.jpg')
+    assert log[-1] == ('/image.jpg', 200)
+    assert output_path.read_bytes() == b'version 2'
+
+
+def test_missing_url_raises(tmp_path, server, monkeypatch):
+    root, base_url, log = server
+    with pytest.raises(requests.HTTPError):
+        cached_download(f"{base_url}/missing.jpg", tmp_path / 'missing.jpg')
+    assert not (tmp_path / 'missing.jpg').exists()
+
+    # A cached URL that is gone raises too, instead of serving the old copy
+    served = root / 'image.jpg'
+    served.write_bytes(b'image data')
+    cached_download(f"{base_url}/image.jpg", tmp_path / 'image.jpg')
+    served.unlink()
+    monkeypatch.setattr(download_cache, 'DOWNLOAD_MAX_AGE_SECONDS', 0)
+    with pytest.raises(requests.HTTPError):
+        cached_download(f"{base_url}/image.jpg", tmp_path / 'image_again.jpg')
+    assert log[-1] == ('/image.jpg', 404)
@@ -0,0 +1,42 @@
+import json
+import threading
+import time
+from collections import defaultdict
+
+from backend.generation import main as generation
+
+
+def test_generate_assets_caps_every_provider(tmp_path, monkeypatch):
+    assets = ([{'generation_method': 'stock_photo', 'filename': f"photo_{index}.jpg"} for index in range(6)]
+              + [{'generation_method': 'voice', 'filename': f"voice_{index}.mp3"} for index in range(3)]
+              + [{'generation_method': 'direct_image_url', 'src': f"https://upload.wikimedia.org/{index}.jpg", 'filename': f"wiki_{index}.jpg"}
+                 for index in range(6)])
+    (tmp_path / 'config.json').write_text(json.dumps({'general': {'generation_concurrency': {'pexels': 2, 'wikimedia': 3}}, 'assets': assets}))
+
+    lock = threading.Lock()
+    running = defaultdict(int)
+    peaks = defaultdict(int)
+    started = {}
+    finished = []
+
+    def fake_generate_asset(asset, asset_path):
+        provider = generation.asset_provider(asset)
+        with lock:
+            running[provider] += 1
+            peaks[provider] = max(peaks[provider], running[provider])
+            started.setdefault(provider, time.perf_counter())
+        time.sleep(0.05)
+        with lock:
+            running[provider] -= 1
+            finished.append(time.perf_counter())
+        return [{'asset_type': 'image', 'filename': f"extra_{asset['filename']}"}]
+
+    monkeypatch.setattr(generation, 'generate_asset', fake_generate_asset)
+    generation.generate_assets(str(tmp_path), max_workers=8)
+
+    assert peaks == {'pexels': 2, 'elevenlabs': 1, 'wikimedia': 3}
+    # A provider at its cap does not hold back the others: all of them start before the first asset is done
+    assert max(started.values()) < min(finished)
+    # Additional entries are appended in config order, whatever finished first
+    config = json.loads((tmp_path / 'config.json').read_text())
+    assert [asset['filename'] for asset in config['assets'][len(assets):]] == [f"extra_{asset['filename']}" for asset in assets]
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from moviepy import ColorClip, CompositeVideoClip, ImageClip
+
+from backend.combination import segments
+from backend.combination.audio import AUDIO_FPS, decode_audio, mix_audio, write_audio
+from backend.combination.segments import count_video_frames, plan_segments, render_segmented
+
+FPS = 24
+
+
+def make_timeline(duration, overlay_color=(0, 0, 255)):
+    background = ColorClip((64, 48), color=(200, 0, 0), duration=duration)
+    # A moving overlay in the second half, so the timeline has still and moving stretches
+    overlay = (ImageClip(np.full((16, 16, 3), overlay_color, dtype=np.uint8)).with_start(duration / 2).with_duration(duration / 2)
+               .with_position(lambda t: (int(t * 10), 10)))
+    layers = [background, overlay]
+    return CompositeVideoClip(layers, size=(64, 48)).with_duration(duration).with_fps(FPS), layers
+
+
+@pytest.mark.parametrize('duration', [4.3, 5.0, 7.3])
+def test_render_segmented_keeps_every_frame_with_audio(tmp_path, tone_file, duration):
+    clip, _ = make_timeline(duration)
+    output_path = tmp_path / 'output.mp4'
+
+    def write_mix(audio_path):
+        return write_audio(mix_audio(duration, layer_sources=[(str(tone_file), 0, duration)], video_fps=FPS), audio_path)
+
+    render_segmented(clip, [(output_path, None)], None, (), workers=1, still_intervals=[(0, duration / 2)], audio_writer=write_mix)
+
+    planned_frames = sum(end - first for first, end, _ in plan_segments(duration, FPS, 1, [(0, duration / 2)]))
+    assert planned_frames == int(np.ceil(duration * FPS - 1e-6))
+    assert count_video_frames(output_path) == planned_frames
+    # The audio ends with the last frame, not before it (AAC pads up to one 1024 sample frame)
+    audio_seconds = len(decode_audio(output_path)) / AUDIO_FPS
+    assert planned_frames / FPS <= audio_seconds < planned_frames / FPS + 2048 / AUDIO_FPS
+
+
+def test_incremental_render_reuses_unchanged_segments(tmp_path, monkeypatch):
+    cache_dir = tmp_path / 'segment_cache'
+    encoded = []
+    write_segment, write_still_segment = segments.write_segment, segments.write_still_segment
+    monkeypatch.setattr(segments, 'write_segment', lambda clip, start, end, *args, **kwargs: encoded.append(start) or write_segment(clip, start, end, *args, **kwargs))
+    monkeypatch.setattr(segments, 'write_still_segment', lambda clip, first_frame, *args, **kwargs: encoded.append(first_frame / FPS) or write_still_segment(clip, first_frame, *args, **kwargs))
+
+    def render(overlay_color):
+        encoded.clear()
+        clip, layers = make_timeline(6, overlay_color)
+        output_path = tmp_path / 'output.mp4'
+        render_segmented(clip, [(output_path, None)], None, (), workers=1, layers=layers, cache_dir=cache_dir)
+        return count_video_frames(output_path)
+
+    # 6 seconds on the 2 second grid: three segments
+    assert render((0, 0, 255)) == 144
+    assert len(encoded) == 3
+    assert render((0, 0, 255)) == 144
+    assert encoded == []
+    # The overlay only covers the last 3 seconds, so the first segment is reused
+    assert render((0, 255, 0)) == 144
+    assert sorted(encoded) == [2, 4]
+    assert len(list(cache_dir.glob('*.mp4'))) == 3